@@ -3,11 +3,27 @@
 
 """
 Этот файл создан для обеспечения совместимости с gunicorn.
-Он запускает Telegram-бота вместо веб-приложения.
+
+Бот получает обновления одним из двух способов:
+- опросом (по умолчанию): бот запускается в отдельном потоке через
+  main.run_bot_with_restart, а веб-приложение только сообщает, что бот работает;
+- через webhook (задан WEBHOOK_URL): Telegram отправляет обновления POST-запросами
+  на WEBHOOK_PATH, приложение проверяет секретный токен и передает обновления
+  в пул потоков обработчиков бота. Webhook регистрируется при запуске.
+
+Пример запуска в режиме webhook:
+    WEBHOOK_URL=https://example.com gunicorn -w 1 --threads 8 app:app
+
+Обработчики хранят часть состояния в памяти процесса (ожидание пароля,
+снимки списков, фоновые задания), поэтому приложение рассчитано на один
+рабочий процесс gunicorn с несколькими потоками.
 """
 
 import os
+import json
 import time
+import hmac
+import hashlib
 import logging
 import threading
 
@@ -22,6 +38,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_STATE_FILE
+)
+from storage_backends import atomic_write_json
+
+# Максимальный размер тела запроса с обновлением (в байтах)
+WEBHOOK_MAX_BODY_SIZE = 1024 * 1024
+
 # Запуск бота в отдельном потоке
 def start_bot_thread():
     """Запуск бота в отдельном потоке."""
@@ -39,12 +63,114 @@ def start_bot_thread():
         import traceback
         logger.error(traceback.format_exc())
 
-# Запускаем бота в отдельном потоке
-bot_thread = threading.Thread(target=start_bot_thread)
-bot_thread.daemon = True  # Делаем поток демоном, чтобы он завершался вместе с основным потоком
-bot_thread.start()
+def get_webhook_secret_token(bot_token):
+    """
+    Секретный токен webhook.
+
+    Если WEBHOOK_SECRET_TOKEN не задан, токен выводится из токена бота,
+    чтобы он совпадал во всех процессах приложения.
+    """
+    if WEBHOOK_SECRET_TOKEN:
+        return WEBHOOK_SECRET_TOKEN
+    return hashlib.sha256(f"webhook:{bot_token}".encode("utf-8")).hexdigest()
+
+def webhook_state(webhook_url, secret_token):
+    """Параметры регистрации webhook; секретный токен хранится только в виде хеша."""
+    return {
+        "url": webhook_url,
+        "secret_sha256": hashlib.sha256(secret_token.encode("utf-8")).hexdigest(),
+        "max_connections": WEBHOOK_MAX_CONNECTIONS,
+    }
+
 
-logger.info("Бот запущен в отдельном потоке")
+def load_webhook_state(state_file=WEBHOOK_STATE_FILE):
+    """Параметры последней регистрации webhook или None, если они неизвестны."""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать параметры webhook из {state_file}: {e}")
+        return None
+
+
+def setup_webhook(bot, secret_token, state_file=WEBHOOK_STATE_FILE):
+    """
+    Зарегистрировать webhook в Telegram, если он еще не указывает на этот сервер.
+
+    Telegram не сообщает установленный секретный токен, поэтому после
+    регистрации сохраняется хеш токена: при смене токена (или если хеш
+    неизвестен) webhook регистрируется заново.
+    """
+    webhook_url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
+    state = webhook_state(webhook_url, secret_token)
+    try:
+        webhook_info = bot.get_webhook_info()
+        if webhook_info.url == webhook_url and load_webhook_state(state_file) == state:
+            logger.info(f"Webhook уже установлен: {webhook_url}")
+            return
+    except Exception as e:
+        logger.warning(f"Не удалось получить информацию о webhook: {e}")
+
+    bot.set_webhook(
+        url=webhook_url,
+        secret_token=secret_token,
+        max_connections=WEBHOOK_MAX_CONNECTIONS
+    )
+    logger.info(f"Webhook установлен: {webhook_url}")
+    try:
+        atomic_write_json(state_file, state)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить параметры webhook в {state_file}: {e}")
+
+class WebhookApp:
+    """WSGI-приложение, принимающее обновления Telegram."""
+
+    def __init__(self, bot, secret_token, path=WEBHOOK_PATH):
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path:
+            return self.respond(start_response, '200 OK', b"Telegram bot is running (webhook mode).")
+
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return self.respond(start_response, '405 Method Not Allowed', b"")
+
+        # Telegram передает секретный токен в заголовке каждого запроса
+        received_token = environ.get('HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN', '')
+        if not hmac.compare_digest(received_token.encode('utf-8'), self.secret_token.encode('utf-8')):
+            logger.warning(f"Запрос к webhook с неверным секретным токеном от {environ.get('REMOTE_ADDR')}")
+            return self.respond(start_response, '403 Forbidden', b"")
+
+        try:
+            content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length <= 0 or content_length > WEBHOOK_MAX_BODY_SIZE:
+            return self.respond(start_response, '400 Bad Request', b"")
+
+        try:
+            from telebot import types
+            body = environ['wsgi.input'].read(content_length).decode('utf-8')
+            update = types.Update.de_json(body)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать обновление webhook: {e}")
+            return self.respond(start_response, '400 Bad Request', b"")
+
+        # Обработчики выполняются в пуле потоков бота, ответ Telegram отправляется сразу
+        try:
+            self.bot.process_new_updates([update])
+        except Exception as e:
+            logger.error(f"Ошибка при передаче обновления {update.update_id} обработчикам: {e}")
+        return self.respond(start_response, '200 OK', b"")
+
+    @staticmethod
+    def respond(start_response, status, body):
+        start_response(status, [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+        return [body]
 
 # Flask-подобный объект, который использует gunicorn
 class SimpleApp:
@@ -54,13 +180,40 @@ class SimpleApp:
         start_response(status, response_headers)
         return [b"Telegram bot is running! Use the Telegram client to interact with it."]
 
-app = SimpleApp()
+if WEBHOOK_URL:
+    # Режим webhook: обновления приходят запросами к приложению
+    import main
+
+    main.register_handlers()
+    webhook_secret_token = get_webhook_secret_token(main.bot.token)
+    setup_webhook(main.bot, webhook_secret_token)
+
+    app = WebhookApp(main.bot, webhook_secret_token)
+    logger.info(f"Бот работает в режиме webhook ({WEBHOOK_PATH})")
+else:
+    # Запускаем бота в отдельном потоке
+    bot_thread = threading.Thread(target=start_bot_thread)
+    bot_thread.daemon = True  # Делаем поток демоном, чтобы он завершался вместе с основным потоком
+    bot_thread.start()
 
-if __name__ == "__main__":
+    logger.info("Бот запущен в отдельном потоке")
+
+    app = SimpleApp()
+
+if __name__ == "__main__" and WEBHOOK_URL:
+    # Без gunicorn принимаем запросы встроенным WSGI-сервером
+    from wsgiref.simple_server import make_server
+    port = int(os.environ.get("PORT", "5000"))
+    logger.info(f"Прием обновлений на порту {port}")
+    try:
+        make_server("0.0.0.0", port, app).serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Остановка бота пользователем.")
+elif __name__ == "__main__":
     # Запускаем простой бесконечный цикл, чтобы процесс не завершался
     try:
         while True:
             time.sleep(60)  # Проверка каждую минуту
             logger.debug("Бот работает...")
     except KeyboardInterrupt:
-        logger.info("Остановка бота пользователем.")
\ No newline at end of file
+        logger.info("Остановка бота пользователем.")
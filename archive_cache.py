@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Кэш собранных ZIP-архивов.
+
+Архив определяется ключом манифеста: пользователь, тип архива и для
+каждого файла его идентификатор в каталоге, размер и время изменения.
+Пока файлы не менялись, повторная загрузка отправляет тома из кэша
+(или по сохраненному file_id Telegram) без повторной сборки.
+
+Каждый кэшированный архив хранится в каталоге кэша как тома
+<ключ>.<номер>.zip и файл описания <ключ>.json с размерами томов и их
+file_id. Общий размер кэша ограничен; при превышении удаляются архивы,
+которые дольше всех не использовались (по времени изменения описания).
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+from config import (
+    ARCHIVE_CACHE_DIR, ARCHIVE_CACHE_MAX_BYTES, ZIP_VOLUME_MAX_SIZE,
+    ZIP_COMPRESSION_LEVEL, ZIP_PROBE_MIN_RATIO
+)
+from storage_backends import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Версия формата архивов: меняется, если меняется способ сборки
+ARCHIVE_FORMAT_VERSION = 1
+
+
+class ArchiveCache:
+    """Кэш томов ZIP-архивов на диске с вытеснением давно не использованных."""
+
+    def __init__(self, cache_dir=ARCHIVE_CACHE_DIR, max_bytes=ARCHIVE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def manifest_key(user_id, archive_type, files):
+        """
+        Вычислить ключ архива.
+
+        Args:
+            user_id: ID пользователя
+            archive_type: Тип архива ("all", "photos", "videos", "documents")
+            files: Записи каталога (поля id, size, mtime) в порядке добавления в архив
+
+        Returns:
+            Шестнадцатеричная строка ключа
+        """
+        digest = hashlib.sha256()
+        digest.update(
+            f"{ARCHIVE_FORMAT_VERSION}|{ZIP_VOLUME_MAX_SIZE}|{ZIP_COMPRESSION_LEVEL}|{ZIP_PROBE_MIN_RATIO}|"
+            f"{user_id}|{archive_type}\n".encode("utf-8")
+        )
+        for file in files:
+            digest.update(f"{file['id']}|{file['size']}|{file['mtime']!r}\n".encode("utf-8"))
+        return digest.hexdigest()[:32]
+
+    def _manifest_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def volume_path(self, key, index):
+        """Путь к тому кэшированного архива."""
+        return os.path.join(self.cache_dir, f"{key}.{index}.zip")
+
+    def get(self, key):
+        """
+        Получить описание кэшированного архива.
+
+        Returns:
+            Словарь {"volumes": [{"size", "count", "file_id", "path"}, ...]} или
+            None, если архива нет или какой-то том нельзя отправить
+            (нет ни файла, ни file_id)
+        """
+        manifest_path = self._manifest_path(key)
+        with self._lock:
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError):
+                return None
+
+            for index, volume in enumerate(manifest["volumes"]):
+                path = self.volume_path(key, index)
+                volume["path"] = path if os.path.exists(path) else None
+                if not volume["path"] and not volume.get("file_id"):
+                    return None
+
+            # Отмечаем использование для вытеснения по давности
+            os.utime(manifest_path)
+        return manifest
+
+    def store_volume(self, key, index, archive_file):
+        """
+        Сохранить том архива в кэш.
+
+        Содержимое копируется из archive_file с текущей позиции до конца,
+        после копирования позиция возвращается обратно.
+        """
+        position = archive_file.tell()
+        path = self.volume_path(key, index)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "wb") as target:
+                shutil.copyfileobj(archive_file, target)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить том архива в кэш: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        finally:
+            archive_file.seek(position)
+
+    def commit(self, key, volumes):
+        """
+        Сохранить описание архива и освободить место в кэше.
+
+        Args:
+            key: Ключ архива
+            volumes: Список словарей {"size", "count", "file_id"} по томам
+        """
+        manifest = {
+            "created_at": time.time(),
+            "volumes": [
+                {"size": volume["size"], "count": volume["count"], "file_id": volume.get("file_id")}
+                for volume in volumes
+            ],
+        }
+        with self._lock:
+            atomic_write_json(self._manifest_path(key), manifest)
+        self.evict()
+
+    def set_file_id(self, key, index, file_id):
+        """Запомнить file_id Telegram для тома кэшированного архива."""
+        manifest_path = self._manifest_path(key)
+        with self._lock:
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError):
+                return
+            manifest["volumes"][index]["file_id"] = file_id
+            atomic_write_json(manifest_path, manifest)
+
+    def invalidate(self, key):
+        """Удалить архив из кэша."""
+        with self._lock:
+            self._remove_entry(key)
+
+    def _remove_entry(self, key, volumes_only=False):
+        """Удалить файлы архива; при volumes_only описание с file_id сохраняется."""
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.startswith(f"{key}.") or (volumes_only and name.endswith(".json")):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                removed += os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+        return removed
+
+    def evict(self):
+        """
+        Удалить давно не использованные архивы, пока размер кэша превышает предел.
+
+        Сначала удаляются тома: описание архива небольшое и позволяет отправить
+        его повторно по file_id Telegram. Описания удаляются, только если
+        кэш по-прежнему превышает предел.
+        """
+        with self._lock:
+            last_used = {}
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                key = name.split(".", 1)[0]
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                last_used.setdefault(key, 0.0)
+                if name.endswith(".json"):
+                    last_used[key] = stat.st_mtime
+
+            # Тома без описания (недостроенные архивы) вытесняются первыми
+            ordered = sorted(last_used, key=last_used.get)
+            for volumes_only in (True, False):
+                for key in ordered:
+                    if total <= self.max_bytes:
+                        return
+                    removed = self._remove_entry(key, volumes_only=volumes_only)
+                    total -= removed
+                    if removed:
+                        logger.info(f"Архив {key} удален из кэша ({removed / (1024 * 1024):.2f} МБ)")
+
+
+# Создаем глобальный экземпляр кэша архивов
+archive_cache = ArchiveCache()
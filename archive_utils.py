@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Создание ZIP-архивов с файлами пользователей.
+
+Архив пишется потоково в SpooledTemporaryFile: небольшие архивы остаются
+в памяти, большие переносятся в анонимный временный файл, который удаляется
+операционной системой при закрытии. Временные каталоги не создаются, поэтому
+после отправки (или ошибки) на диске ничего не остается.
+"""
+
+import os
+import time
+import zlib
+import queue
+import atexit
+import struct
+import logging
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from config import (
+    ARCHIVE_SPOOL_MAX_MEMORY, ZIP_COMPRESSION_LEVEL, ZIP_PROBE_SIZE, ZIP_PROBE_MIN_RATIO,
+    ZIP_VOLUME_MAX_SIZE, ZIP_VOLUME_PREFETCH, ZIP_WORKERS,
+    SUPPORTED_PHOTO_EXTENSIONS, SUPPORTED_VIDEO_EXTENSIONS
+)
+
+logger = logging.getLogger(__name__)
+
+# Форматы, которые уже сжаты: повторное сжатие тратит процессор почти без выигрыша
+COMPRESSED_EXTENSIONS = frozenset(
+    SUPPORTED_PHOTO_EXTENSIONS + SUPPORTED_VIDEO_EXTENSIONS + [
+        '.heic', '.avif', '.mp3', '.m4a', '.ogg', '.opus', '.aac', '.flac',
+        '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+        '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.apk', '.jar',
+    ]
+)
+
+
+def is_compressible(file_path, probe_size=ZIP_PROBE_SIZE, min_ratio=ZIP_PROBE_MIN_RATIO):
+    """
+    Оценить, имеет ли смысл сжимать файл.
+
+    Первые probe_size байт сжимаются zlib с минимальным уровнем; если они
+    сжимаются меньше чем в min_ratio раз, файл считается несжимаемым.
+    """
+    with open(file_path, 'rb') as file:
+        sample = file.read(probe_size)
+    if not sample:
+        return False
+    return len(sample) / len(zlib.compress(sample, 1)) >= min_ratio
+
+
+def choose_compression(file_path):
+    """Выбрать метод сжатия записи архива: ZIP_STORED или ZIP_DEFLATED."""
+    _, ext = os.path.splitext(file_path.lower())
+    if ext in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if not is_compressible(file_path):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+# Размер блока при чтении файлов для сжатия
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Общий пул процессов для сжатия записей архива и число его процессов
+_process_pool = None
+_process_pool_size = 0
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers=ZIP_WORKERS):
+    """
+    Получить общий пул процессов для сжатия.
+
+    Дочерние процессы запускаются через forkserver (или spawn), а не fork,
+    чтобы не копировать блокировки потоков бота.
+    """
+    global _process_pool, _process_pool_size
+    with _process_pool_lock:
+        if _process_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _process_pool_size = workers or os.cpu_count() or 1
+            _process_pool = ProcessPoolExecutor(max_workers=_process_pool_size, mp_context=context)
+            atexit.register(shutdown_process_pool)
+            logger.info(f"Запущен пул сжатия архивов: {_process_pool_size} процессов")
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Остановить пул процессов сжатия."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def compress_entry(file_path, compression, compresslevel):
+    """
+    Подготовить запись архива (выполняется в процессе пула).
+
+    Для DEFLATE сжатые данные без заголовков zlib (raw deflate) пишутся во
+    временный файл, и в родительский процесс передается только его путь.
+    Для STORED файл не читается: содержимое и контрольная сумма вычисляются
+    при сборке архива.
+
+    Returns:
+        Кортеж (метод, crc32 или None, размер файла, размер сжатых данных,
+        путь к файлу сжатых данных или None, (mtime, mode) файла)
+    """
+    stat = os.stat(file_path)
+    if compression == "auto":
+        method = choose_compression(file_path)
+    else:
+        method = zipfile.ZIP_DEFLATED
+    if method == zipfile.ZIP_STORED:
+        return method, None, stat.st_size, stat.st_size, None, (stat.st_mtime, stat.st_mode)
+
+    crc = 0
+    size = 0
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    fd, data_path = tempfile.mkstemp(prefix="zip-entry-", suffix=".deflate")
+    try:
+        with os.fdopen(fd, 'wb') as output, open(file_path, 'rb') as file:
+            while True:
+                chunk = file.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                output.write(compressor.compress(chunk))
+            output.write(compressor.flush())
+            compressed_size = output.tell()
+    except BaseException:
+        _remove_entry_data(data_path)
+        raise
+    return method, crc, size, compressed_size, data_path, (stat.st_mtime, stat.st_mode)
+
+
+def _remove_entry_data(data_path):
+    """Удалить временный файл сжатых данных записи."""
+    if data_path is None:
+        return
+    try:
+        os.remove(data_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Не удалось удалить временный файл {data_path}: {e}")
+
+
+def _discard_entry(future):
+    """Удалить данные записи, которая уже не попадет в архив."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    _remove_entry_data(future.result()[4])
+
+
+class ZipAssembler:
+    """
+    Сборка ZIP-архива из заранее подготовленных записей.
+
+    Записи добавляются последовательно с известными размерами, поэтому
+    заголовки пишутся сразу, без дескрипторов данных. Если crc32 еще не
+    известна, она вычисляется при копировании и записывается в локальный
+    заголовок после данных (fileobj должен поддерживать seek). Форматы ZIP64
+    используются, только когда размеры или смещения этого требуют.
+    """
+
+    ZIP64_LIMIT = 0xFFFFFFFF
+
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.start = fileobj.tell()
+        self.entries = []
+
+    @staticmethod
+    def _dos_datetime(mtime):
+        year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+        if year < 1980:
+            year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+        dos_time = (hour << 11) | (minute << 5) | (second // 2)
+        dos_date = ((year - 1980) << 9) | (month << 5) | day
+        return dos_time, dos_date
+
+    def add(self, arcname, method, crc, file_size, compressed_size, mtime, mode, chunks):
+        """
+        Добавить запись в архив.
+
+        Args:
+            arcname: Имя файла в архиве
+            method: zipfile.ZIP_STORED или zipfile.ZIP_DEFLATED
+            crc: Контрольная сумма crc32 исходных данных или None, если ее
+                нужно вычислить по chunks (только для ZIP_STORED)
+            file_size: Размер исходных данных
+            compressed_size: Размер данных записи в архиве
+            mtime, mode: Время изменения и права доступа файла
+            chunks: Итератор блоков данных записи
+        """
+        name = arcname.encode('utf-8')
+        flags = 0x800 if not arcname.isascii() else 0
+        header_position = self.fp.tell()
+        offset = header_position - self.start
+        dos_time, dos_date = self._dos_datetime(mtime)
+        compute_crc = crc is None
+
+        zip64 = file_size >= self.ZIP64_LIMIT or compressed_size >= self.ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 0x0001, 16, file_size, compressed_size) if zip64 else b""
+        version = 45 if zip64 else 20
+        self.fp.write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, version, flags, method, dos_time, dos_date, crc or 0,
+            self.ZIP64_LIMIT if zip64 else compressed_size,
+            self.ZIP64_LIMIT if zip64 else file_size,
+            len(name), len(extra)
+        ))
+        self.fp.write(name)
+        self.fp.write(extra)
+
+        written = 0
+        computed_crc = 0
+        for chunk in chunks:
+            self.fp.write(chunk)
+            written += len(chunk)
+            if compute_crc:
+                computed_crc = zlib.crc32(chunk, computed_crc)
+        if written != compressed_size:
+            raise ValueError(f"Размер данных записи {arcname} изменился при сборке архива")
+
+        if compute_crc:
+            # Поле crc32 находится в 14 байтах от начала локального заголовка
+            crc = computed_crc
+            end = self.fp.tell()
+            self.fp.seek(header_position + 14)
+            self.fp.write(struct.pack("<I", crc))
+            self.fp.seek(end)
+
+        self.entries.append((name, flags, method, dos_time, dos_date, crc, compressed_size, file_size, offset, mode))
+
+    def close(self):
+        """Записать центральный каталог и конец архива."""
+        directory_offset = self.fp.tell() - self.start
+        for name, flags, method, dos_time, dos_date, crc, compressed_size, file_size, offset, mode in self.entries:
+            extra_values = []
+            if file_size >= self.ZIP64_LIMIT:
+                extra_values.append(file_size)
+            if compressed_size >= self.ZIP64_LIMIT:
+                extra_values.append(compressed_size)
+            if offset >= self.ZIP64_LIMIT:
+                extra_values.append(offset)
+            extra = b""
+            if extra_values:
+                extra = struct.pack(f"<HH{len(extra_values)}Q", 0x0001, 8 * len(extra_values), *extra_values)
+            version = 45 if extra_values else 20
+            self.fp.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, flags, method,
+                dos_time, dos_date, crc,
+                min(compressed_size, self.ZIP64_LIMIT), min(file_size, self.ZIP64_LIMIT),
+                len(name), len(extra), 0, 0, 0, (mode & 0xFFFF) << 16, min(offset, self.ZIP64_LIMIT)
+            ))
+            self.fp.write(name)
+            self.fp.write(extra)
+
+        directory_end = self.fp.tell() - self.start
+        directory_size = directory_end - directory_offset
+        count = len(self.entries)
+        if count >= 0xFFFF or directory_offset >= self.ZIP64_LIMIT or directory_size >= self.ZIP64_LIMIT:
+            # Запись ZIP64 конца центрального каталога и указатель на нее
+            self.fp.write(struct.pack(
+                "<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, directory_size, directory_offset
+            ))
+            self.fp.write(struct.pack("<IIQI", 0x07064b50, 0, directory_end, 1))
+        self.fp.write(struct.pack(
+            "<IHHHHIIH", 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(directory_size, self.ZIP64_LIMIT), min(directory_offset, self.ZIP64_LIMIT), 0
+        ))
+
+
+def _read_exactly(file, size):
+    """Прочитать открытый файл блоками, не больше size байт."""
+    remaining = size
+    while remaining > 0:
+        chunk = file.read(min(READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def write_zip_parallel(files, fileobj, compression="auto", compresslevel=ZIP_COMPRESSION_LEVEL, workers=ZIP_WORKERS,
+                       progress=None):
+    """
+    Записать файлы в ZIP-архив, сжимая записи в пуле процессов.
+
+    Записи сжимаются параллельно, а в архив добавляются строго в порядке
+    files. Процессы пула пишут сжатые данные во временные файлы, поэтому
+    память родительского процесса не зависит от размера записей; число
+    одновременно подготавливаемых записей ограничено, чтобы не занимать
+    лишнее место на диске.
+
+    Returns:
+        Количество файлов, добавленных в архив
+    """
+    pool = get_process_pool(workers)
+    window = max(2, _process_pool_size * 2)
+    assembler = ZipAssembler(fileobj)
+    pending = deque()
+    paths = iter(files)
+    added = 0
+
+    def submit_next():
+        for file_path in paths:
+            pending.append((file_path, pool.submit(compress_entry, file_path, compression, compresslevel)))
+            return
+
+    for _ in range(window):
+        submit_next()
+
+    try:
+        while pending:
+            file_path, future = pending.popleft()
+            submit_next()
+            try:
+                method, crc, file_size, compressed_size, data_path, (mtime, mode) = future.result()
+            except FileNotFoundError:
+                logger.warning(f"Файл {file_path} не существует, пропускаем")
+                continue
+
+            try:
+                # Для STORED копируется сам файл, для DEFLATE - подготовленные сжатые данные
+                source_path = file_path if data_path is None else data_path
+                try:
+                    source = open(source_path, 'rb')
+                except FileNotFoundError:
+                    logger.warning(f"Файл {file_path} не существует, пропускаем")
+                    continue
+                arcname = os.path.basename(file_path)
+                with source:
+                    assembler.add(
+                        arcname, method, crc, file_size, compressed_size, mtime, mode,
+                        _read_exactly(source, compressed_size)
+                    )
+            finally:
+                _remove_entry_data(data_path)
+            added += 1
+            logger.debug(f"Добавлен файл {arcname} в архив ({'DEFLATE' if method == zipfile.ZIP_DEFLATED else 'STORED'})")
+            if progress:
+                progress(file_size)
+    finally:
+        # При ошибке сборки отменяем оставшиеся записи, а уже подготовленные удаляем
+        for _, future in pending:
+            if not future.cancel():
+                future.add_done_callback(_discard_entry)
+
+    assembler.close()
+    return added
+
+
+def write_zip(files, fileobj, compression="auto", compresslevel=ZIP_COMPRESSION_LEVEL, workers=ZIP_WORKERS,
+              progress=None):
+    """
+    Записать файлы в ZIP-архив, открытый в fileobj.
+
+    Содержимое каждого файла копируется блоками, без чтения файла целиком.
+    Если доступно больше одного процесса сжатия и файлов несколько, записи
+    сжимаются параллельно (write_zip_parallel).
+
+    Args:
+        files: Список путей к файлам
+        fileobj: Файловый объект для записи архива
+        compression: "auto" - выбирать сжатие для каждого файла,
+            "deflate" - сжимать все файлы
+        compresslevel: Уровень сжатия DEFLATE (0-9)
+        workers: Число процессов сжатия (0 - по числу ядер, 1 - без пула)
+        progress: Функция, вызываемая после добавления каждого файла с его
+            размером в байтах; исключение из нее прерывает сборку архива
+
+    Returns:
+        Количество файлов, добавленных в архив
+    """
+    if (workers or os.cpu_count() or 1) > 1 and len(files) > 1:
+        return write_zip_parallel(files, fileobj, compression, compresslevel, workers, progress)
+
+    added = 0
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for file_path in files:
+            if not os.path.exists(file_path):
+                logger.warning(f"Файл {file_path} не существует, пропускаем")
+                continue
+
+            if compression == "auto":
+                compress_type = choose_compression(file_path)
+            else:
+                compress_type = zipfile.ZIP_DEFLATED
+
+            # Добавляем файл в архив под его именем
+            arcname = os.path.basename(file_path)
+            zipf.write(file_path, arcname=arcname, compress_type=compress_type, compresslevel=compresslevel)
+            added += 1
+            logger.debug(f"Добавлен файл {arcname} в архив ({'DEFLATE' if compress_type == zipfile.ZIP_DEFLATED else 'STORED'})")
+            if progress:
+                progress(zipf.infolist()[-1].file_size)
+    return added
+
+
+def max_entry_size(file_size, arcname):
+    """
+    Верхняя оценка места, которое файл займет в ZIP-архиве.
+
+    Учитывает заголовки записи (локальный, дескриптор данных, запись
+    центрального каталога с полями ZIP64) и худший случай DEFLATE для
+    несжимаемых данных (5 байт на блок 16 КБ).
+    """
+    name_size = len(arcname.encode('utf-8'))
+    return file_size + (file_size // 16384 + 1) * 5 + 2 * name_size + 200
+
+
+def plan_volumes(files, max_size=ZIP_VOLUME_MAX_SIZE):
+    """
+    Разбить файлы на тома, каждый из которых гарантированно меньше max_size.
+
+    Разбиение выполняется заранее по размерам из каталога, порядок файлов
+    сохраняется.
+
+    Args:
+        files: Список записей каталога (словари с полями path и size)
+        max_size: Максимальный размер одного архива в байтах
+
+    Returns:
+        Кортеж (список томов - списков путей, список записей, которые
+        не помещаются ни в один том)
+    """
+    # Конец центрального каталога (с записями ZIP64)
+    archive_overhead = 22 + 56 + 20
+    volumes = []
+    oversized = []
+    current = []
+    current_size = archive_overhead
+    for file in files:
+        entry_size = max_entry_size(file["size"], os.path.basename(file["path"]))
+        if entry_size + archive_overhead > max_size:
+            oversized.append(file)
+            continue
+        if current and current_size + entry_size > max_size:
+            volumes.append(current)
+            current = []
+            current_size = archive_overhead
+        current.append(file["path"])
+        current_size += entry_size
+    if current:
+        volumes.append(current)
+    return volumes, oversized
+
+
+class VolumeBuilder:
+    """
+    Сборка томов архива в фоновом потоке.
+
+    Тома собираются по очереди и передаются потребителю через очередь
+    ограниченного размера, поэтому отправка первого тома начинается, пока
+    следующие еще собираются, а в памяти и на диске одновременно находится
+    не больше prefetch готовых томов. Все незабранные тома закрываются
+    (и удаляются) при выходе из блока with.
+
+    Использование:
+        with VolumeBuilder(volumes) as builder:
+            for index, archive, size, count in builder:
+                ...
+
+    Функция progress (если задана) вызывается в потоке сборки после
+    добавления каждого файла с его размером (см. write_zip).
+    """
+
+    _DONE = object()
+
+    def __init__(self, volumes, max_memory=ARCHIVE_SPOOL_MAX_MEMORY, prefetch=ZIP_VOLUME_PREFETCH, progress=None):
+        self.volumes = volumes
+        self.max_memory = max_memory
+        self.progress = progress
+        self._queue = queue.Queue(maxsize=max(1, prefetch))
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="zip-volume-builder", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _put(self, item):
+        """Передать элемент потребителю; False, если сборка остановлена."""
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for index, paths in enumerate(self.volumes):
+                if self._stop_event.is_set():
+                    return
+                archive = tempfile.SpooledTemporaryFile(max_size=self.max_memory, suffix=".zip")
+                try:
+                    count = write_zip(paths, archive, progress=self.progress)
+                    size = archive.tell()
+                    archive.seek(0)
+                except BaseException:
+                    archive.close()
+                    raise
+                if not self._put((index, archive, size, count)):
+                    archive.close()
+                    return
+        except Exception as e:
+            logger.error(f"Ошибка при сборке тома архива: {e}")
+            self._put(e)
+        finally:
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            index, archive, size, count = item
+            try:
+                yield index, archive, size, count
+            finally:
+                archive.close()
+
+    def close(self):
+        """Остановить сборку и удалить все собранные, но не отправленные тома."""
+        self._stop_event.set()
+        while self._thread.is_alive() or not self._queue.empty():
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if isinstance(item, tuple):
+                item[1].close()
+        self._thread.join()
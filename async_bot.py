@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный режим работы бота.
+
+Обновления получает и обрабатывает асинхронный бот (AsyncTeleBot) в цикле
+событий asyncio. Самые частые обработчики выполняются как корутины и не
+занимают поток, пока ждут Telegram:
+
+- команды /help, /files, /photos, /videos, /documents;
+- кнопки главного меню, справки, категорий файлов и страниц списка;
+- сохранение фото, видео и документов (файл скачивается по частям через
+  aiohttp, запись на диск и хэш - в пуле потоков).
+
+Работа с диском, каталогом и хранилищем пользователей выполняется в пуле из
+ASYNC_IO_THREADS потоков. Остальные команды и кнопки (архивы, обмен
+файлами, удаление и т.д.) пока выполняют синхронные обработчики simple_bot
+в отдельном пуле из DISPATCH_WORKERS потоков.
+
+Обновления одного чата выполняются по очереди (AsyncChatLanes), разных
+чатов - параллельно. Если необработанных обновлений больше
+ASYNC_MAX_PENDING_UPDATES, получение новых приостанавливается, и они
+остаются на стороне Telegram. Исходящие запросы проходят через общий
+планировщик rate_limiter (call_async), все асинхронные запросы - через одну
+сессию aiohttp с пулом не больше HTTP_POOL_SIZE соединений.
+
+Режим работает только с опросом getUpdates (webhook - в app.py).
+
+Использование:
+    python async_bot.py
+"""
+
+import os
+import sys
+import asyncio
+import hashlib
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler('bot.log')
+    ]
+)
+logger = logging.getLogger(__name__)
+
+import aiohttp
+from telebot import util, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from config import (
+    ASYNC_MAX_PENDING_UPDATES, ASYNC_IO_THREADS, DISPATCH_WORKERS, DISPATCH_MAX_LANE_SIZE,
+    HTTP_POOL_SIZE, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT
+)
+import simple_bot
+from simple_bot import (
+    build_file_listing, get_upload_target, get_upload_file_name, upload_status_text,
+    upload_saved_message, upload_error_text, upload_failed_text, UPLOAD_KINDS
+)
+from ui_templates import (
+    HELP_TEXT, HELP_MARKUP, HELP_COMPACT_TEXT, HELP_COMPACT_MARKUP, MAIN_MENU_TEXT, MAIN_MENU_COMPACT_MARKUP
+)
+from user_storage import user_storage
+from file_catalog import file_catalog
+from listing_cache import listing_cache
+from blob_store import blob_store
+from file_utils import DEFAULT_FILE_URL
+from dispatcher import AsyncChatLanes
+from callback_router import CallbackRouter
+from rate_limiter import rate_limiter
+
+# Одна сессия aiohttp на цикл событий: ее пул ограничиваем так же, как пул requests
+asyncio_helper.REQUEST_LIMIT = HTTP_POOL_SIZE
+
+# Пул для работы с диском и хранилищами из корутин
+io_executor = ThreadPoolExecutor(ASYNC_IO_THREADS, thread_name_prefix="async-io")
+
+# Пул для синхронных обработчиков simple_bot
+sync_executor = ThreadPoolExecutor(DISPATCH_WORKERS, thread_name_prefix="sync-handler")
+
+# Тип файлов для команд и кнопок категорий
+COMMAND_FILE_TYPES = {"files": None, "photos": "photo", "videos": "video", "documents": "document"}
+
+
+class AsyncFileBot(AsyncTeleBot):
+    """Асинхронный бот с порядком обработки внутри чата и ограничением необработанных обновлений."""
+
+    def __init__(self, token, max_pending=ASYNC_MAX_PENDING_UPDATES, max_lane_size=DISPATCH_MAX_LANE_SIZE):
+        super().__init__(token, parse_mode="HTML")
+        self.lanes = AsyncChatLanes(max_lane_size)
+        self.max_pending = max_pending
+        self._pending_count = 0
+        # Установлено, пока необработанных обновлений меньше max_pending
+        self._slots_available = asyncio.Event()
+        self._slots_available.set()
+
+    async def get_updates(self, *args, **kwargs):
+        # Пока необработанных обновлений слишком много, новые не запрашиваем
+        await self._slots_available.wait()
+        return await super().get_updates(*args, **kwargs)
+
+    async def process_new_updates(self, updates):
+        self._pending_count += len(updates)
+        if self._pending_count >= self.max_pending:
+            self._slots_available.clear()
+        await asyncio.gather(*(self._process_update(update) for update in updates))
+
+    async def _process_update(self, update):
+        try:
+            await self.lanes.run(update, self._handle_update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+        finally:
+            self._pending_count -= 1
+            if self._pending_count < self.max_pending:
+                self._slots_available.set()
+
+    async def _handle_update(self, update):
+        await super().process_new_updates([update])
+
+
+bot = AsyncFileBot(simple_bot.BOT_TOKEN)
+
+
+async def run_io(func, *args, **kwargs):
+    """Выполнить блокирующую функцию (диск, каталог, хранилище) в пуле io_executor."""
+    return await asyncio.get_running_loop().run_in_executor(io_executor, partial(func, *args, **kwargs))
+
+
+async def run_sync_handler(func, *args):
+    """Выполнить синхронный обработчик simple_bot в пуле sync_executor."""
+    return await asyncio.get_running_loop().run_in_executor(sync_executor, partial(func, *args))
+
+
+async def send_message(chat_id, text, **kwargs):
+    """Отправить сообщение с учетом лимитов Telegram."""
+    return await rate_limiter.call_async(chat_id, bot.send_message, chat_id, text, parse_mode="HTML", **kwargs)
+
+
+async def edit_message(chat_id, message_id, text, **kwargs):
+    """Отредактировать сообщение с учетом лимитов; неизмененное сообщение не считается ошибкой."""
+    try:
+        return await rate_limiter.call_async(
+            chat_id, bot.edit_message_text, text, chat_id=chat_id, message_id=message_id, parse_mode="HTML", **kwargs
+        )
+    except asyncio_helper.ApiTelegramException as e:
+        if "message is not modified" not in e.description:
+            raise
+
+
+async def is_verified(user):
+    return await run_io(user_storage.is_user_verified, user.id)
+
+
+async def forward_message(message):
+    """Передать сообщение синхронным обработчикам simple_bot."""
+    await run_sync_handler(simple_bot.bot.process_new_messages, [message])
+
+
+# Команды
+
+@bot.message_handler(commands=['help'])
+async def help_command(message):
+    """Отправить подробную справку с интерактивными кнопками."""
+    await send_message(message.chat.id, HELP_TEXT, reply_markup=HELP_MARKUP)
+
+@bot.message_handler(commands=list(COMMAND_FILE_TYPES))
+async def files_command(message):
+    """Показать список сохраненных файлов (/files, /photos, /videos, /documents)."""
+    # Запрос пароля у неверифицированного пользователя выполняет синхронный обработчик
+    if not await is_verified(message.from_user):
+        await forward_message(message)
+        return
+    file_type = COMMAND_FILE_TYPES[util.extract_command(message.text)]
+    await show_files(message.chat.id, message.from_user.id, 0, file_type)
+
+async def show_files(chat_id, user_id, page=0, file_type=None, message_id=None):
+    """Показать страницу списка файлов: новым сообщением или в сообщении message_id."""
+    try:
+        text, markup, page_files = await run_io(build_file_listing, user_id, page, file_type)
+        if message_id is not None:
+            # Снимок сохраняем до редактирования, чтобы кнопки сразу разрешались
+            listing_cache.put(chat_id, message_id, page_files)
+            await edit_message(chat_id, message_id, text, reply_markup=markup)
+        else:
+            sent_message = await send_message(chat_id, text, reply_markup=markup)
+            listing_cache.put(sent_message.chat.id, sent_message.message_id, page_files)
+    except Exception as e:
+        logger.error(f"Ошибка при отображении файлов: {e}")
+        try:
+            await send_message(chat_id, f"Произошла ошибка при отображении файлов: {str(e)}")
+        except Exception:
+            pass
+
+
+# Кнопки
+
+# Маршруты кнопок, обрабатываемых корутинами; остальные - синхронной таблицей simple_bot
+async_router = CallbackRouter()
+
+@async_router.route("cmd:menu")
+async def menu_callback(call):
+    """Показать главное меню (перерисовать текущее сообщение)."""
+    await edit_message(
+        call.message.chat.id, call.message.message_id, MAIN_MENU_TEXT, reply_markup=MAIN_MENU_COMPACT_MARKUP
+    )
+
+@async_router.route("cmd:help")
+async def help_callback(call):
+    """Показать справку в текущем сообщении."""
+    await edit_message(
+        call.message.chat.id, call.message.message_id, HELP_COMPACT_TEXT, reply_markup=HELP_COMPACT_MARKUP
+    )
+
+async def show_files_callback(call, page=0, file_type=None):
+    """Показать страницу списка файлов в сообщении с кнопкой."""
+    await show_files(call.message.chat.id, call.from_user.id, page, file_type, call.message.message_id)
+
+async_router.add("files", show_files_callback)
+async_router.add("cmd:photos", partial(show_files_callback, file_type="photo"))
+async_router.add("cmd:videos", partial(show_files_callback, file_type="video"))
+async_router.add("cmd:documents", partial(show_files_callback, file_type="document"))
+
+@async_router.route("page")
+async def page_callback(call, page, file_type=None):
+    """Страница списка файлов. Формат: page:номер_страницы:тип_файла"""
+    # Если тип файла 'all', значит нужно показать все файлы
+    if file_type == 'all':
+        file_type = None
+    await show_files_callback(call, int(page), file_type)
+
+@async_router.set_fallback
+async def sync_callback(call, verb, args):
+    """Передать нажатие синхронной таблице маршрутов simple_bot."""
+    await run_sync_handler(simple_bot.callback_router.dispatch, call)
+
+@bot.callback_query_handler(func=lambda call: True)
+async def button_handler(call):
+    """Обработать нажатия кнопок."""
+    try:
+        # Показать всплывающее уведомление о загрузке (ловим ошибку, если запрос устарел)
+        try:
+            await bot.answer_callback_query(call.id)
+        except Exception as e:
+            if "query is too old" in str(e) or "query ID is invalid" in str(e):
+                logger.warning(f"Устаревший запрос: {str(e)}")
+            else:
+                logger.error(f"Ошибка ответа на callback: {str(e)}")
+
+        await async_router.dispatch_async(call)
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике кнопок: {e}")
+        try:
+            await send_message(
+                call.message.chat.id,
+                f"❌ <b>Произошла ошибка при обработке запроса</b>\n\nПопробуйте снова или используйте /start для перезапуска бота."
+            )
+        except Exception:
+            pass
+
+
+# Сохранение файлов
+
+def _write_chunk(file, digest, chunk):
+    file.write(chunk)
+    digest.update(chunk)
+
+async def download_file_to_path(remote_path, dest_path, digest, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Скачать файл Telegram на диск по частям через сессию aiohttp бота.
+
+    Принятые данные накапливаются до chunk_size байт и записываются (вместе с
+    обновлением хэша digest) в пуле io_executor.
+
+    Returns:
+        Количество записанных байт
+    """
+    url = (asyncio_helper.FILE_URL or DEFAULT_FILE_URL).format(bot.token, remote_path)
+    session = await asyncio_helper.session_manager.get_session()
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=DOWNLOAD_TIMEOUT, sock_read=DOWNLOAD_TIMEOUT)
+    file = await run_io(open, dest_path, 'wb')
+    written = 0
+    try:
+        async with session.get(url, proxy=asyncio_helper.proxy, timeout=timeout) as response:
+            if response.status != 200:
+                raise asyncio_helper.ApiHTTPException('Download file', response)
+            buffer = bytearray()
+            while True:
+                data = await response.content.read(chunk_size - len(buffer))
+                if data:
+                    buffer += data
+                if buffer and (not data or len(buffer) >= chunk_size):
+                    await run_io(_write_chunk, file, digest, bytes(buffer))
+                    written += len(buffer)
+                    buffer.clear()
+                if not data:
+                    break
+    except BaseException:
+        await run_io(file.close)
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    await run_io(file.close)
+    return written
+
+async def save_upload(remote_path, dest_path, user_id, file_type):
+    """Скачать файл в хранилище содержимого и сохранить его у пользователя (как BlobStore.save_download)."""
+    digest = hashlib.sha256()
+    incoming_path = blob_store.new_incoming_path()
+    await download_file_to_path(remote_path, incoming_path, digest)
+    await run_io(blob_store.save_incoming, incoming_path, digest.hexdigest(), dest_path, user_id, file_type)
+
+@bot.message_handler(content_types=list(UPLOAD_KINDS))
+async def receive_file(message):
+    """Получить и сохранить файл, отправленный пользователем."""
+    if not await is_verified(message.from_user):
+        await forward_message(message)
+        return
+
+    chat_id = message.chat.id
+    try:
+        # Определяем файл и персональную папку пользователя для него
+        user_id = message.from_user.id
+        uploaded_file_id, file_name, save_folder = await run_io(get_upload_target, message)
+        file_info = await bot.get_file(uploaded_file_id)
+        file_name = get_upload_file_name(file_name, message.content_type, file_info.file_path)
+
+        status_message = await send_message(chat_id, upload_status_text(message.content_type))
+
+        try:
+            file_path = os.path.join(save_folder, file_name)
+            await save_upload(file_info.file_path, file_path, user_id, message.content_type)
+
+            # Запоминаем file_id исходной загрузки
+            await run_io(file_catalog.set_telegram_file_id, file_path, message.content_type, uploaded_file_id)
+
+            file_size = await run_io(os.path.getsize, file_path)
+            text, markup = upload_saved_message(message.content_type, file_path, file_size)
+            await edit_message(chat_id, status_message.message_id, text, reply_markup=markup)
+
+            logger.info(f"Файл {file_name} ({simple_bot.format_size(file_size)}) сохранен пользователем {message.from_user.first_name} (ID: {user_id})")
+
+        except Exception as download_error:
+            await edit_message(
+                chat_id, status_message.message_id, upload_error_text(message.content_type, download_error)
+            )
+            logger.error(f"Ошибка при загрузке файла от пользователя {user_id}: {download_error}")
+
+    except Exception as e:
+        logger.error(f"Критическая ошибка при обработке файла: {e}")
+        try:
+            await send_message(chat_id, upload_failed_text(e))
+        except Exception:
+            await send_message(
+                chat_id, "Произошла непредвиденная ошибка. Пожалуйста, используйте /start для перезапуска бота."
+            )
+
+
+# Остальные сообщения обрабатывают синхронные обработчики simple_bot
+@bot.message_handler(func=lambda message: True, content_types=util.content_type_media)
+async def sync_message(message):
+    await forward_message(message)
+
+
+async def run_async_bot():
+    """Получать и обрабатывать обновления в цикле событий asyncio."""
+    try:
+        # Пока установлен webhook, getUpdates завершается ошибкой 409
+        await bot.delete_webhook()
+        logger.info(
+            f"Запуск асинхронного опроса ({ASYNC_IO_THREADS} потоков ввода-вывода, "
+            f"{DISPATCH_WORKERS} потоков синхронных обработчиков)..."
+        )
+        await bot.infinity_polling(timeout=60, request_timeout=90)
+    finally:
+        await bot.close_session()
+        io_executor.shutdown(wait=False)
+        sync_executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # Импортируем хранилище в главном потоке, чтобы сохранить данные по SIGTERM
+    from user_storage import install_shutdown_handlers
+    install_shutdown_handlers()
+    try:
+        asyncio.run(run_async_bot())
+    except KeyboardInterrupt:
+        logger.info("Остановка бота пользователем.")
+        sys.exit(0)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Замер времени сборки ZIP-архива на смешанном наборе файлов.
+
+Сравнивает сжатие всех файлов DEFLATE (прежнее поведение) с выбором сжатия
+для каждого файла (STORED для медиа и несжимаемых данных).
+
+Использование:
+    python bench_zip.py [размер_набора_МБ]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from archive_utils import write_zip
+
+# Доли набора: (расширение, доля объема, сжимаемые данные)
+CORPUS = [
+    (".jpg", 0.35, False),
+    (".mp4", 0.40, False),
+    (".txt", 0.15, True),
+    (".bin", 0.10, False),
+]
+FILE_SIZE = 2 * 1024 * 1024
+
+
+def make_corpus(folder, total_mb):
+    """Создать набор файлов общим объемом total_mb мегабайт."""
+    rng = random.Random(0)
+    words = [b"storage", b"telegram", b"file", b"archive", b"user", b"document", b"share"]
+    files = []
+    for ext, share, compressible in CORPUS:
+        count = max(1, int(total_mb * 1024 * 1024 * share) // FILE_SIZE)
+        for i in range(count):
+            path = os.path.join(folder, f"sample_{i}{ext}")
+            with open(path, "wb") as file:
+                if compressible:
+                    data = b" ".join(rng.choice(words) for _ in range(FILE_SIZE // 6))
+                    file.write(data[:FILE_SIZE])
+                else:
+                    file.write(os.urandom(FILE_SIZE))
+            files.append(path)
+    return files
+
+
+def run(files, compression):
+    with tempfile.TemporaryFile() as archive:
+        started = time.perf_counter()
+        write_zip(files, archive, compression=compression)
+        elapsed = time.perf_counter() - started
+        size = archive.tell()
+    return elapsed, size
+
+
+if __name__ == "__main__":
+    total_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    folder = tempfile.mkdtemp(prefix="bench_zip_")
+    try:
+        files = make_corpus(folder, total_mb)
+        source_size = sum(os.path.getsize(path) for path in files)
+        print(f"Набор: {len(files)} файлов, {source_size / (1024 * 1024):.1f} МБ")
+        for compression in ("deflate", "auto"):
+            elapsed, size = run(files, compression)
+            print(f"{compression:8} {elapsed:7.2f} с  архив {size / (1024 * 1024):7.1f} МБ")
+    finally:
+        shutil.rmtree(folder)
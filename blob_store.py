@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Хранилище содержимого файлов с дедупликацией.
+
+Содержимое каждого сохраненного файла хранится один раз в каталоге
+BLOB_STORE_DIR под именем, равным его SHA-256 (<ab>/<cd>/<хэш>). Файлы в
+папках пользователей - жесткие ссылки на это содержимое, поэтому
+одинаковые файлы (у разных пользователей или в разных категориях) занимают
+место на диске один раз, а весь остальной код по-прежнему работает с
+обычными путями.
+
+Ссылки на содержимое считаются по каталогу файлов (поле blob): содержимое
+удаляется из хранилища, когда удаляется последний ссылающийся на него файл.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+from config import BLOB_STORE_DIR
+from file_catalog import file_catalog
+from file_utils import download_file_to_path
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при вычислении хэша существующих файлов
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Возраст недокачанного файла, после которого он считается брошенным (в секундах)
+INCOMING_MAX_AGE = 24 * 60 * 60
+
+
+def file_sha256(file_path):
+    """Вычислить SHA-256 содержимого файла, читая его блоками."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Хранилище содержимого по SHA-256 со ссылками из папок пользователей."""
+
+    def __init__(self, root=BLOB_STORE_DIR, catalog=file_catalog):
+        self.root = root
+        self.catalog = catalog
+        self.incoming_folder = os.path.join(root, "incoming")
+        # Защищает проверку наличия содержимого, создание ссылок и учет ссылок
+        self._lock = threading.Lock()
+        os.makedirs(self.incoming_folder, exist_ok=True)
+
+    def blob_path(self, blob):
+        """Путь к содержимому в хранилище."""
+        return os.path.join(self.root, blob[:2], blob[2:4], blob)
+
+    @staticmethod
+    def _link(source_path, dest_path):
+        """Атомарно заменить dest_path жесткой ссылкой на source_path (или копией, если ссылки недоступны)."""
+        temp_path = os.path.join(os.path.dirname(dest_path) or ".", f".link_{uuid.uuid4().hex}")
+        try:
+            try:
+                os.link(source_path, temp_path)
+            except OSError as e:
+                logger.warning(f"Не удалось создать жесткую ссылку на {source_path}, файл копируется: {e}")
+                shutil.copy2(source_path, temp_path)
+            os.replace(temp_path, dest_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _put(self, source_path, blob):
+        """
+        Поместить файл в хранилище (вызывается под блокировкой).
+
+        Если такое содержимое уже есть, source_path удаляется, иначе
+        переносится в хранилище.
+
+        Returns:
+            Путь к содержимому в хранилище
+        """
+        path = self.blob_path(blob)
+        if os.path.exists(path):
+            os.remove(source_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(source_path, path)
+        return path
+
+    def save_download(self, bot, remote_path, dest_path, user_id, file_type):
+        """
+        Скачать файл Telegram в хранилище и сохранить его у пользователя.
+
+        Хэш вычисляется по мере скачивания. Если такое содержимое уже
+        хранится, скачанная копия удаляется и dest_path становится ссылкой
+        на имеющееся содержимое. Файл добавляется в каталог; если он
+        заменил другой файл с тем же именем, ссылка на прежнее содержимое
+        освобождается.
+
+        Args:
+            bot: Экземпляр TeleBot
+            remote_path: Путь к файлу на серверах Telegram (file_info.file_path)
+            dest_path: Путь к файлу в папке пользователя
+            user_id: ID владельца файла
+            file_type: Тип файла (photo, video, document)
+
+        Returns:
+            SHA-256 содержимого
+        """
+        digest = hashlib.sha256()
+        incoming_path = self.new_incoming_path()
+        download_file_to_path(bot, remote_path, incoming_path, digest=digest)
+        blob = digest.hexdigest()
+        self.save_incoming(incoming_path, blob, dest_path, user_id, file_type)
+        return blob
+
+    def new_incoming_path(self):
+        """Путь для скачивания нового файла перед его переносом в хранилище."""
+        return os.path.join(self.incoming_folder, uuid.uuid4().hex)
+
+    def save_incoming(self, incoming_path, blob, dest_path, user_id, file_type):
+        """
+        Перенести скачанный файл в хранилище и сохранить его у пользователя.
+
+        Используется save_download и асинхронной загрузкой (async_bot),
+        которая скачивает файл сама.
+
+        Args:
+            incoming_path: Скачанный файл (из new_incoming_path)
+            blob: SHA-256 его содержимого
+            dest_path: Путь к файлу в папке пользователя
+            user_id: ID владельца файла
+            file_type: Тип файла (photo, video, document)
+        """
+        with self._lock:
+            try:
+                blob_path = self._put(incoming_path, blob)
+            finally:
+                if os.path.exists(incoming_path):
+                    os.remove(incoming_path)
+            previous = self.catalog.get_file_by_path(dest_path)
+            self._link(blob_path, dest_path)
+            self.catalog.add_file(user_id, dest_path, file_type, blob=blob)
+            if previous and previous["blob"] and previous["blob"] != blob:
+                self._release(previous["blob"])
+
+    def adopt(self, file_path):
+        """
+        Перенести в хранилище файл, сохраненный до его появления.
+
+        Если такое содержимое уже хранится, файл заменяется ссылкой на него.
+
+        Returns:
+            Кортеж (SHA-256 содержимого, освобожденное место в байтах)
+        """
+        blob = file_sha256(file_path)
+        freed = 0
+        with self._lock:
+            path = self.blob_path(blob)
+            if os.path.exists(path):
+                if not os.path.samefile(path, file_path):
+                    freed = os.path.getsize(file_path)
+                    self._link(path, file_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._link(file_path, path)
+            self.catalog.set_file_blob(file_path, blob)
+        return blob, freed
+
+    def remove_file(self, file_path):
+        """
+        Удалить файл пользователя и его запись в каталоге.
+
+        Содержимое удаляется из хранилища, если на него больше не ссылается
+        ни один файл.
+        """
+        with self._lock:
+            record = self.catalog.get_file_by_path(file_path)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            self.catalog.remove_file(file_path)
+            if record and record["blob"]:
+                self._release(record["blob"])
+
+    def _release(self, blob):
+        """Удалить содержимое, если на него не осталось ссылок (вызывается под блокировкой)."""
+        if self.catalog.count_blob_refs(blob):
+            return
+        path = self.blob_path(blob)
+        try:
+            os.remove(path)
+            logger.info(f"Содержимое {blob} удалено из хранилища: ссылок не осталось")
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self):
+        """
+        Удалить содержимое, на которое не ссылается ни один файл каталога,
+        и брошенные недокачанные файлы (старше INCOMING_MAX_AGE).
+
+        Returns:
+            Кортеж (количество удаленных файлов, освобожденное место в байтах)
+        """
+        removed = freed = 0
+        incoming_deadline = time.time() - INCOMING_MAX_AGE
+        with self._lock:
+            referenced = self.catalog.referenced_blobs()
+            for root, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                        if root == self.incoming_folder:
+                            if stat.st_mtime > incoming_deadline:
+                                continue
+                        elif filename in referenced:
+                            continue
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    removed += 1
+                    freed += stat.st_size
+        return removed, freed
+
+
+# Создаем глобальный экземпляр хранилища
+blob_store = BlobStore()
@@ -2,6 +2,7 @@ import os
 import logging
 from telebot import types
 from config import SAVE_FOLDER, SUPPORTED_PHOTO_EXTENSIONS, SUPPORTED_VIDEO_EXTENSIONS, FILES_PER_PAGE
+from file_utils import download_file_to_path
 
 logger = logging.getLogger(__name__)
 
@@ -75,12 +76,8 @@ def save_file(bot, file_info, save_folder, file_name):
                 file_path = os.path.join(save_folder, new_name)
                 count += 1
         
-        # Скачать файл
-        downloaded_file = bot.download_file(file_info.file_path)
-        
-        # Сохранить файл
-        with open(file_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+        # Скачать файл на диск по частям
+        download_file_to_path(bot, file_info.file_path, file_path)
         
         return file_path
     
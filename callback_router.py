@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Маршрутизация нажатий inline-кнопок.
+
+callback_data разбирается один раз на команду и аргументы
+("page:2:photo" -> ("page", ["2", "photo"]), "cmd:share:aB3" ->
+("cmd:share", ["aB3"])), и обработчик находится в словаре маршрутов за
+постоянное время. Для каждого маршрута собирается статистика времени
+обработки; медленные нажатия записываются в журнал, а дополнительные
+функции замера можно подключить через add_timing_hook.
+"""
+
+import time
+import logging
+import threading
+
+from config import CALLBACK_SLOW_THRESHOLD_MS
+
+logger = logging.getLogger(__name__)
+
+# Имя маршрута в статистике для нажатий без зарегистрированного обработчика
+UNKNOWN_ROUTE = "<unknown>"
+
+
+class CallbackRouter:
+    """Таблица маршрутов callback_data с замером времени обработки."""
+
+    def __init__(self, namespaces=("cmd",), slow_threshold_ms=CALLBACK_SLOW_THRESHOLD_MS):
+        """
+        Args:
+            namespaces: Префиксы, для которых команда состоит из двух частей
+                ("cmd:menu" - команда "cmd:menu", а не "cmd" с аргументом "menu")
+            slow_threshold_ms: Время обработки, после которого нажатие записывается в журнал
+        """
+        self.namespaces = frozenset(namespaces)
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.fallback = None
+        self._routes = {}
+        self._timing_hooks = []
+        self._stats_lock = threading.Lock()
+        # Команда -> [количество, суммарное время, максимальное время]
+        self._stats = {}
+
+    def parse(self, data):
+        """
+        Разобрать callback_data на команду и аргументы.
+
+        Returns:
+            Кортеж (команда, список аргументов)
+        """
+        parts = (data or "").split(":")
+        if parts[0] in self.namespaces and len(parts) > 1:
+            return f"{parts[0]}:{parts[1]}", parts[2:]
+        return parts[0], parts[1:]
+
+    def add(self, verb, handler):
+        """Зарегистрировать обработчик команды: handler(call, *args)."""
+        if verb in self._routes:
+            raise ValueError(f"Маршрут {verb} уже зарегистрирован")
+        self._routes[verb] = handler
+
+    def route(self, *verbs):
+        """Декоратор для регистрации обработчика одной или нескольких команд."""
+        def decorator(handler):
+            for verb in verbs:
+                self.add(verb, handler)
+            return handler
+        return decorator
+
+    def set_fallback(self, handler):
+        """Обработчик нажатий без маршрута: handler(call, verb, args)."""
+        self.fallback = handler
+        return handler
+
+    def add_timing_hook(self, hook):
+        """Подключить функцию hook(verb, elapsed, call), вызываемую после каждого нажатия."""
+        self._timing_hooks.append(hook)
+        return hook
+
+    def dispatch(self, call):
+        """Вызвать обработчик для нажатия кнопки."""
+        verb, args = self.parse(call.data)
+        handler = self._routes.get(verb)
+        started = time.perf_counter()
+        try:
+            if handler is not None:
+                handler(call, *args)
+            elif self.fallback is not None:
+                self.fallback(call, verb, args)
+            else:
+                logger.warning(f"Нет обработчика для кнопки {call.data!r}")
+        finally:
+            elapsed = time.perf_counter() - started
+            self._record(verb if handler is not None else UNKNOWN_ROUTE, elapsed, call)
+
+    async def dispatch_async(self, call):
+        """Вызвать обработчик-корутину для нажатия кнопки (таблица маршрутов async_bot)."""
+        verb, args = self.parse(call.data)
+        handler = self._routes.get(verb)
+        started = time.perf_counter()
+        try:
+            if handler is not None:
+                await handler(call, *args)
+            elif self.fallback is not None:
+                await self.fallback(call, verb, args)
+            else:
+                logger.warning(f"Нет обработчика для кнопки {call.data!r}")
+        finally:
+            elapsed = time.perf_counter() - started
+            self._record(verb if handler is not None else UNKNOWN_ROUTE, elapsed, call)
+
+    def _record(self, verb, elapsed, call):
+        with self._stats_lock:
+            stats = self._stats.setdefault(verb, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+        if elapsed >= self.slow_threshold:
+            logger.warning(f"Медленная обработка кнопки {verb}: {elapsed * 1000:.0f} мс")
+        for hook in self._timing_hooks:
+            try:
+                hook(verb, elapsed, call)
+            except Exception as e:
+                logger.error(f"Ошибка в функции замера времени кнопок: {e}")
+
+    def timing_stats(self):
+        """
+        Статистика времени обработки по маршрутам.
+
+        Returns:
+            Словарь {команда: {"count", "avg_ms", "max_ms"}}
+        """
+        with self._stats_lock:
+            return {
+                verb: {
+                    "count": count,
+                    "avg_ms": total / count * 1000,
+                    "max_ms": longest * 1000,
+                }
+                for verb, (count, total, longest) in self._stats.items()
+            }
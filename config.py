@@ -37,4 +37,116 @@ SUPPORTED_VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.mkv', '.webm']
 FILES_PER_PAGE = 5
 
 # Время жизни ссылки для обмена файлами (в часах)
-SHARE_LINK_TTL = 24  # 24 часа
\ No newline at end of file
+SHARE_LINK_TTL = 24  # 24 часа
+
+# Бэкенд хранилища пользователей и общих файлов: "json", "journal" или "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+
+# Путь к базе данных SQLite (используется бэкендом "sqlite")
+STORAGE_DB_PATH = os.environ.get("STORAGE_DB_PATH", "storage.db")
+
+# Журнал изменений (используется бэкендом "journal") и порог его компакции в байтах
+STORAGE_JOURNAL_PATH = os.environ.get("STORAGE_JOURNAL_PATH", "storage.journal")
+STORAGE_JOURNAL_COMPACT_BYTES = int(os.environ.get("STORAGE_JOURNAL_COMPACT_BYTES", str(1024 * 1024)))
+
+# Отложенная (фоновая) запись хранилища вместо записи в каждом обработчике
+STORAGE_WRITE_BEHIND = os.environ.get("STORAGE_WRITE_BEHIND", "1") == "1"
+
+# Максимальная задержка фоновой записи (в миллисекундах)
+STORAGE_FLUSH_INTERVAL_MS = int(os.environ.get("STORAGE_FLUSH_INTERVAL_MS", "500"))
+
+# Количество изменений, после которого запись выполняется без ожидания
+STORAGE_FLUSH_MAX_MUTATIONS = int(os.environ.get("STORAGE_FLUSH_MAX_MUTATIONS", "100"))
+
+# Период фоновой очистки истекших ссылок (в секундах)
+SHARE_SWEEP_INTERVAL = int(os.environ.get("SHARE_SWEEP_INTERVAL", "60"))
+
+# Путь к базе данных каталога файлов пользователей
+CATALOG_DB_PATH = os.environ.get("CATALOG_DB_PATH", "file_catalog.db")
+
+# Кэш снимков списков файлов: максимальное число сообщений и время жизни (в секундах)
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get("LISTING_CACHE_MAX_ENTRIES", "1000"))
+LISTING_CACHE_TTL = int(os.environ.get("LISTING_CACHE_TTL", "3600"))
+
+# Размер блока при скачивании файлов (в байтах) - предел памяти на одну загрузку
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+# Таймаут соединения и чтения при скачивании файлов (в секундах)
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", "60"))
+
+# Размер ZIP-архива, до которого он собирается в памяти (дальше - во временном файле)
+ARCHIVE_SPOOL_MAX_MEMORY = int(os.environ.get("ARCHIVE_SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+
+# Уровень сжатия DEFLATE для документов в ZIP-архивах (1 - быстрее, 9 - сильнее)
+ZIP_COMPRESSION_LEVEL = int(os.environ.get("ZIP_COMPRESSION_LEVEL", "6"))
+
+# Проба сжимаемости файла: размер пробы (в байтах) и минимальная степень сжатия,
+# при которой файл сжимается, иначе сохраняется без сжатия
+ZIP_PROBE_SIZE = int(os.environ.get("ZIP_PROBE_SIZE", str(64 * 1024)))
+ZIP_PROBE_MIN_RATIO = float(os.environ.get("ZIP_PROBE_MIN_RATIO", "1.1"))
+
+# Максимальный размер одного тома ZIP-архива (ограничение Telegram на загрузку ботом - 50 МБ)
+ZIP_VOLUME_MAX_SIZE = int(os.environ.get("ZIP_VOLUME_MAX_SIZE", str(49 * 1024 * 1024)))
+
+# Количество собранных томов, ожидающих отправки
+ZIP_VOLUME_PREFETCH = int(os.environ.get("ZIP_VOLUME_PREFETCH", "1"))
+
+# Число процессов для параллельного сжатия ZIP-архивов (0 - по числу ядер, 1 - без пула)
+ZIP_WORKERS = int(os.environ.get("ZIP_WORKERS", "0"))
+
+# Кэш собранных ZIP-архивов: каталог и максимальный общий размер (в байтах)
+ARCHIVE_CACHE_DIR = os.environ.get("ARCHIVE_CACHE_DIR", "archive_cache")
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get("ARCHIVE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Фоновые задания (сборка архивов): число потоков, размер очереди
+# и число одновременных заданий одного пользователя
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "20"))
+JOB_PER_USER_LIMIT = int(os.environ.get("JOB_PER_USER_LIMIT", "1"))
+
+# Минимальный интервал между обновлениями сообщения о ходе задания (в секундах)
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "3"))
+
+# Хранилище содержимого файлов по SHA-256 (должно быть на той же файловой
+# системе, что и папки пользователей, чтобы файлы пользователей были жесткими ссылками)
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", os.path.join(SAVE_FOLDER, "blobs"))
+
+# Режим webhook: публичный адрес сервера (пусто - бот получает обновления опросом getUpdates),
+# путь, на который Telegram отправляет обновления, и секретный токен для проверки запросов
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN", "")
+
+# Файл с параметрами последней регистрации webhook (адрес и хеш секретного токена)
+WEBHOOK_STATE_FILE = os.environ.get("WEBHOOK_STATE_FILE", "webhook_state.json")
+
+# Максимальное число одновременных соединений Telegram с webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Диспетчер обновлений: число потоков обработчиков и максимальная очередь одного чата
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "8"))
+DISPATCH_MAX_LANE_SIZE = int(os.environ.get("DISPATCH_MAX_LANE_SIZE", "20"))
+
+# Асинхронный режим (async_bot.py): максимальное число необработанных обновлений,
+# после которого новые не запрашиваются, и число потоков для работы с диском и хранилищем
+ASYNC_MAX_PENDING_UPDATES = int(os.environ.get("ASYNC_MAX_PENDING_UPDATES", "1000"))
+ASYNC_IO_THREADS = int(os.environ.get("ASYNC_IO_THREADS", "4"))
+
+# Порог времени обработки нажатия кнопки, после которого оно записывается в журнал (в миллисекундах)
+CALLBACK_SLOW_THRESHOLD_MS = int(os.environ.get("CALLBACK_SLOW_THRESHOLD_MS", "1000"))
+
+# Ограничение исходящих запросов к Bot API (отправка и редактирование сообщений):
+# общее число в секунду, число в секунду для одного чата (с запасом на короткие всплески),
+# число в минуту для одной группы и число повторов после ответа 429 Too Many Requests
+RATE_LIMIT_GLOBAL_PER_SECOND = float(os.environ.get("RATE_LIMIT_GLOBAL_PER_SECOND", "30"))
+RATE_LIMIT_CHAT_PER_SECOND = float(os.environ.get("RATE_LIMIT_CHAT_PER_SECOND", "1"))
+RATE_LIMIT_CHAT_BURST = int(os.environ.get("RATE_LIMIT_CHAT_BURST", "3"))
+RATE_LIMIT_GROUP_PER_MINUTE = int(os.environ.get("RATE_LIMIT_GROUP_PER_MINUTE", "20"))
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "3"))
+
+# Максимальное число соединений в общем пуле HTTP-соединений с Bot API
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+
+# Задержка промежуточных сообщений о состоянии ("Загрузка...", "Отправка..."): если за это время
+# сообщение снова редактируется, промежуточное состояние не отправляется (в секундах)
+EDIT_COALESCE_DELAY = float(os.environ.get("EDIT_COALESCE_DELAY", "0.7"))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Перенос сохраненных файлов в хранилище содержимого (blob_store).
+
+Файлы, сохраненные до появления хранилища, хэшируются и заменяются жесткими
+ссылками на содержимое, одинаковые файлы после этого занимают место один раз.
+Затем из хранилища удаляется содержимое, на которое не ссылается ни один файл.
+
+Использование:
+    python dedupe_files.py
+"""
+
+import logging
+import sys
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+from file_catalog import file_catalog
+from blob_store import blob_store
+
+print(f"Сверка каталога {file_catalog.db_path} с папкой {file_catalog.base_folder}...")
+file_catalog.reconcile_all()
+
+adopted = freed = 0
+for record in file_catalog.list_files_without_blob():
+    try:
+        _, saved = blob_store.adopt(record["path"])
+    except OSError as e:
+        print(f"Не удалось перенести {record['path']}: {e}")
+        continue
+    adopted += 1
+    freed += saved
+
+removed, garbage = blob_store.collect_garbage()
+file_catalog.close()
+print(
+    f"Готово! Перенесено файлов: {adopted}, освобождено {(freed + garbage) / (1024 * 1024):.2f} МБ, "
+    f"удалено из хранилища неиспользуемых файлов: {removed}"
+)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Диспетчер обновлений по чатам.
+
+Обновления одного чата выполняются строго по очереди (в порядке получения),
+а обновления разных чатов - параллельно в пуле из DISPATCH_WORKERS потоков.
+У каждого чата своя очередь (полоса) длиной не больше DISPATCH_MAX_LANE_SIZE:
+лишние обновления чата отбрасываются. Поток выполняет одно обновление
+чата и ставит чат в конец общей очереди готовых чатов, поэтому один чат
+занимает не больше одного потока и не может вытеснить остальных.
+
+Для асинхронного режима (async_bot) тот же порядок внутри чата
+обеспечивает AsyncChatLanes: вместо потоков - задачи asyncio.
+"""
+
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from config import DISPATCH_WORKERS, DISPATCH_MAX_LANE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    """
+    Ключ полосы для обновления: ID чата, а для обновлений без чата - ID пользователя.
+
+    Returns:
+        ID чата или пользователя, либо ("update", update_id) для обновлений,
+        порядок которых не важен
+    """
+    for name in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = getattr(update, name, None)
+        if message is not None:
+            return message.chat.id
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    for name in ("inline_query", "chosen_inline_result", "my_chat_member", "chat_member"):
+        event = getattr(update, name, None)
+        if event is not None:
+            chat = getattr(event, "chat", None)
+            return chat.id if chat is not None else event.from_user.id
+    return ("update", update.update_id)
+
+
+class ChatDispatcher:
+    """Пул потоков с последовательным выполнением обновлений внутри чата."""
+
+    def __init__(self, handler, workers=DISPATCH_WORKERS, max_lane_size=DISPATCH_MAX_LANE_SIZE):
+        """
+        Args:
+            handler: Функция обработки одного обновления
+            workers: Число потоков
+            max_lane_size: Максимальное число обновлений в очереди одного чата
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_lane_size = max(1, max_lane_size)
+        self._lock = threading.Lock()
+        # Ключ чата -> очередь (обновление, Future); чат есть в словаре,
+        # пока он стоит в очереди готовых чатов или выполняется
+        self._lanes = {}
+        self._ready = queue.Queue()
+        self._threads = []
+        self.dropped = 0
+
+    def _ensure_workers(self):
+        """Запустить потоки при первом обновлении (вызывается под блокировкой)."""
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._worker, name=f"dispatch-worker-{len(self._threads) + 1}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, update):
+        """
+        Поставить обновление в очередь его чата.
+
+        Returns:
+            Future, который завершается после обработки обновления (результат
+            True) или сразу, если очередь чата заполнена (результат False)
+        """
+        key = chat_key(update)
+        future = Future()
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None and len(lane) >= self.max_lane_size:
+                self.dropped += 1
+                logger.warning(f"Очередь чата {key} заполнена, обновление {update.update_id} отброшено")
+                future.set_result(False)
+                return future
+            schedule = lane is None
+            if schedule:
+                lane = self._lanes[key] = deque()
+            lane.append((update, future))
+            self._ensure_workers()
+        if schedule:
+            self._ready.put(key)
+        return future
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                update, future = self._lanes[key][0]
+            try:
+                # Обновление, Future которого отменен, не обрабатывается
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.handler(update)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+                future.set_exception(e)
+            except BaseException as e:
+                # SystemExit и т.п. завершают поток; на следующем обновлении
+                # submit запустит вместо него новый
+                logger.error(f"Поток диспетчера остановлен при обработке обновления {update.update_id}: {e!r}")
+                future.set_exception(e)
+                with self._lock:
+                    if threading.current_thread() in self._threads:
+                        self._threads.remove(threading.current_thread())
+                raise
+            else:
+                future.set_result(True)
+            finally:
+                # Полоса освобождается при любом исходе, иначе чат остановится навсегда
+                self._release(key)
+
+    def _release(self, key):
+        """Убрать выполненное обновление из полосы чата и поставить чат в очередь снова."""
+        with self._lock:
+            lane = self._lanes[key]
+            lane.popleft()
+            if not lane:
+                del self._lanes[key]
+        # Следующее обновление чата - после уже ожидающих чатов
+        if lane:
+            self._ready.put(key)
+
+    def pending(self):
+        """Количество обновлений в очередях всех чатов (включая выполняющиеся)."""
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def shutdown(self, wait=True):
+        """Остановить потоки после обработки уже поставленных обновлений."""
+        with self._lock:
+            threads = list(self._threads)
+            self._threads = []
+        for _ in threads:
+            self._ready.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+class AsyncChatLanes:
+    """Последовательное выполнение обновлений одного чата в цикле событий asyncio."""
+
+    def __init__(self, max_lane_size=DISPATCH_MAX_LANE_SIZE):
+        """
+        Args:
+            max_lane_size: Максимальное число обновлений в очереди одного чата
+        """
+        self.max_lane_size = max(1, max_lane_size)
+        # Ключ чата -> [asyncio.Lock, число обновлений чата в очереди (включая выполняющееся)]
+        self._lanes = {}
+        self.dropped = 0
+
+    async def run(self, update, handler):
+        """
+        Выполнить корутину handler(update) после уже полученных обновлений того же чата.
+
+        Returns:
+            True или False, если очередь чата заполнена и обновление отброшено
+        """
+        key = chat_key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = [asyncio.Lock(), 0]
+        elif lane[1] >= self.max_lane_size:
+            self.dropped += 1
+            logger.warning(f"Очередь чата {key} заполнена, обновление {update.update_id} отброшено")
+            return False
+        lane[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке очереди
+            async with lane[0]:
+                await handler(update)
+        finally:
+            lane[1] -= 1
+            if not lane[1]:
+                del self._lanes[key]
+        return True
+
+    def pending(self):
+        """Количество обновлений в очередях всех чатов (включая выполняющиеся)."""
+        return sum(count for _, count in self._lanes.values())
+
+
+def install_chat_dispatcher(bot, workers=DISPATCH_WORKERS, max_lane_size=DISPATCH_MAX_LANE_SIZE):
+    """
+    Направить обновления TeleBot через диспетчер по чатам.
+
+    Обработчики бота вызываются в потоках диспетчера, собственный пул
+    потоков TeleBot больше не используется. Подходит для опроса и для
+    webhook (process_new_updates).
+
+    Returns:
+        Объект ChatDispatcher
+    """
+    process_updates = bot.process_new_updates
+    bot.threaded = False
+    dispatcher = ChatDispatcher(lambda update: process_updates([update]), workers, max_lane_size)
+
+    def process_new_updates(updates):
+        for update in updates:
+            # Смещение для следующего getUpdates обновляется сразу, а не после обработки
+            if update.update_id > bot.last_update_id:
+                bot.last_update_id = update.update_id
+            dispatcher.submit(update)
+
+    bot.process_new_updates = process_new_updates
+    bot.chat_dispatcher = dispatcher
+    return dispatcher
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Объединение редактирований сообщений.
+
+Для каждого сообщения запоминается последнее отправленное состояние
+(текст, разметка, параметры). Редактирование, которое ничего не меняет,
+не отправляется, поэтому Telegram не отвечает ошибкой "message is not
+modified", а запрос не расходует лимит.
+
+Промежуточные состояния ("⏳ Загрузка...") отправляются через defer: они
+откладываются на EDIT_COALESCE_DELAY секунд и отбрасываются, если за это
+время сообщение отредактировано снова. Быстрые операции показывают только
+итоговое состояние, а медленные - и промежуточное. Порядок редактирований
+одного сообщения сохраняется.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from telebot.apihelper import ApiTelegramException
+
+from config import EDIT_COALESCE_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Число сообщений, для которых хранится последнее состояние
+MAX_TRACKED_MESSAGES = 2048
+
+
+class _MessageState:
+    """Последнее состояние сообщения и отложенное редактирование."""
+
+    __slots__ = ("lock", "signature", "pending")
+
+    def __init__(self):
+        # Редактирования одного сообщения выполняются по очереди
+        self.lock = threading.Lock()
+        self.signature = None
+        self.pending = None
+
+
+def _signature(text, kwargs):
+    """Состояние сообщения после редактирования: текст, разметка и остальные параметры."""
+    reply_markup = kwargs.get("reply_markup")
+    markup_json = reply_markup.to_json() if reply_markup is not None else None
+    options = tuple(sorted((k, repr(v)) for k, v in kwargs.items() if k != "reply_markup"))
+    return text, markup_json, options
+
+
+class EditCoalescer:
+    """Обертка над edit_message_text, пропускающая лишние редактирования."""
+
+    def __init__(self, edit_message_text, delay=EDIT_COALESCE_DELAY):
+        """
+        Args:
+            edit_message_text: Исходный метод бота
+            delay: Задержка отложенных редактирований в секундах
+        """
+        self._edit_message_text = edit_message_text
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._messages = OrderedDict()
+        self._stats = {"sent": 0, "skipped": 0, "superseded": 0}
+
+    def _state(self, key):
+        with self._lock:
+            state = self._messages.get(key)
+            if state is None:
+                state = self._messages[key] = _MessageState()
+                if len(self._messages) > MAX_TRACKED_MESSAGES:
+                    self._evict()
+            else:
+                self._messages.move_to_end(key)
+            return state
+
+    def _evict(self):
+        """Забыть самое давнее сообщение без отложенного редактирования (вызывается под _lock).
+
+        Сообщение с отложенным редактированием не вытесняется: новое состояние
+        этого сообщения не смогло бы отменить таймер, и промежуточный текст
+        перезаписал бы итоговый.
+        """
+        for key, state in self._messages.items():
+            if state.pending is None:
+                del self._messages[key]
+                return
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def edit(self, text=None, chat_id=None, message_id=None, **kwargs):
+        """
+        Отредактировать сообщение сразу (заменяет bot.edit_message_text).
+
+        Отложенное редактирование этого сообщения отменяется.
+
+        Returns:
+            Результат edit_message_text или None, если сообщение не изменилось
+        """
+        if chat_id is None or message_id is None:
+            # Сообщения inline-режима не отслеживаются
+            return self._edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+        state = self._state((chat_id, message_id))
+        with state.lock:
+            self._cancel_pending(state)
+            return self._send(state, text, chat_id, message_id, kwargs)
+
+    def defer(self, text=None, chat_id=None, message_id=None, **kwargs):
+        """
+        Отредактировать сообщение через delay секунд, если до этого его не отредактируют снова.
+
+        Ошибки отложенного редактирования записываются в журнал.
+        """
+        state = self._state((chat_id, message_id))
+        with state.lock:
+            self._cancel_pending(state)
+            timer = threading.Timer(
+                self.delay, self._flush, args=(state, text, chat_id, message_id, kwargs)
+            )
+            timer.daemon = True
+            state.pending = timer
+            timer.start()
+
+    def _flush(self, state, text, chat_id, message_id, kwargs):
+        with state.lock:
+            # Редактирование уже заменено более новым
+            if state.pending is not threading.current_thread():
+                return
+            state.pending = None
+            try:
+                self._send(state, text, chat_id, message_id, kwargs)
+            except Exception as e:
+                logger.error(f"Ошибка отложенного редактирования сообщения {message_id}: {e}")
+
+    def _cancel_pending(self, state):
+        if state.pending is not None:
+            state.pending.cancel()
+            state.pending = None
+            self._count("superseded")
+
+    def _send(self, state, text, chat_id, message_id, kwargs):
+        signature = _signature(text, kwargs)
+        if signature == state.signature:
+            self._count("skipped")
+            return None
+        try:
+            result = self._edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+        except ApiTelegramException as e:
+            if "message is not modified" in str(e).lower():
+                state.signature = signature
+                self._count("skipped")
+                return None
+            # Состояние сообщения после ошибки неизвестно
+            state.signature = None
+            raise
+        state.signature = signature
+        self._count("sent")
+        return result
+
+    def stats(self):
+        """
+        Счетчики редактирований.
+
+        Returns:
+            Словарь: sent - отправлено, skipped - пропущено без изменений,
+            superseded - отложенных отброшено, tracked - отслеживаемых сообщений
+        """
+        with self._lock:
+            return dict(self._stats, tracked=len(self._messages))
+
+
+def install_edit_coalescer(bot, delay=EDIT_COALESCE_DELAY):
+    """
+    Направить bot.edit_message_text через объединитель редактирований.
+
+    Returns:
+        Объект EditCoalescer (отложенные редактирования - его метод defer)
+    """
+    coalescer = EditCoalescer(bot.edit_message_text, delay)
+    bot.edit_message_text = coalescer.edit
+    bot.edit_coalescer = coalescer
+    return coalescer
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Каталог файлов пользователей.
+
+Хранит для каждого сохраненного файла стабильный идентификатор, имя, тип,
+размер, время изменения и добавления и хэш содержимого в хранилище
+(blob_store) в базе SQLite. По хэшам считаются ссылки на содержимое. Списки файлов и пагинация строятся
+запросами к каталогу, без обхода папок и вызовов stat на каждый файл.
+Каталог обновляется при сохранении и удалении файлов и может быть
+восстановлен по содержимому диска (reconcile).
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from config import CATALOG_DB_PATH, USER_FILES_BASE_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# Подпапки пользователя и соответствующие им типы файлов
+TYPE_FOLDERS = {
+    "photo": "photos",
+    "video": "videos",
+    "document": "documents",
+}
+
+FILE_COLUMNS = ("id", "user_id", "path", "name", "file_type", "size", "mtime", "added_at", "blob")
+SELECT_FILES = f"SELECT {', '.join(FILE_COLUMNS)} FROM files"
+
+# Алфавит для компактной записи идентификаторов файлов в callback_data
+BASE62_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def encode_file_key(file_id):
+    """Записать идентификатор файла в каталоге в виде короткой строки base62."""
+    if file_id == 0:
+        return BASE62_ALPHABET[0]
+    digits = []
+    while file_id:
+        file_id, remainder = divmod(file_id, 62)
+        digits.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(digits))
+
+
+def decode_file_key(file_key):
+    """Получить идентификатор файла из строки base62 или None, если строка некорректна."""
+    if not file_key or len(file_key) > 11:
+        return None
+    file_id = 0
+    for char in file_key:
+        value = BASE62_ALPHABET.find(char)
+        if value < 0:
+            return None
+        file_id = file_id * 62 + value
+    return file_id
+
+
+def _file_record(row):
+    """Запись о файле из строки таблицы, с ключом для callback_data."""
+    record = dict(zip(FILE_COLUMNS, row))
+    record["key"] = encode_file_key(record["id"])
+    return record
+
+
+class FileCatalog:
+    """Каталог файлов пользователей в базе SQLite (режим WAL)."""
+
+    def __init__(self, db_path=CATALOG_DB_PATH, base_folder=USER_FILES_BASE_FOLDER):
+        self.db_path = db_path
+        self.base_folder = base_folder
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        # Пользователи, каталог которых уже сверен с диском в этом процессе
+        self._reconciled = set()
+
+    def _create_schema(self):
+        with self._conn:
+            # added_at - время сохранения файла пользователем: у жестких ссылок
+            # на одно содержимое общее время изменения, поэтому списки
+            # сортируются по времени добавления. blob - SHA-256 содержимого
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                "path TEXT NOT NULL UNIQUE, name TEXT NOT NULL, file_type TEXT NOT NULL, "
+                "size INTEGER NOT NULL, mtime REAL NOT NULL, added_at REAL NOT NULL DEFAULT 0, blob TEXT)"
+            )
+            # Каталоги, созданные до появления хранилища содержимого
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+            if "added_at" not in columns:
+                self._conn.execute("ALTER TABLE files ADD COLUMN added_at REAL NOT NULL DEFAULT 0")
+                self._conn.execute("UPDATE files SET added_at = mtime")
+            if "blob" not in columns:
+                self._conn.execute("ALTER TABLE files ADD COLUMN blob TEXT")
+            self._conn.execute("DROP INDEX IF EXISTS idx_files_user_mtime")
+            self._conn.execute("DROP INDEX IF EXISTS idx_files_user_type_mtime")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_files_user_added ON files (user_id, added_at DESC, id DESC)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_files_user_type_added "
+                "ON files (user_id, file_type, added_at DESC, id DESC)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_blob ON files (blob)")
+            # file_id Telegram для повторной отправки без загрузки содержимого.
+            # size и mtime фиксируют версию файла, для которой получен file_id
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS telegram_files ("
+                "path TEXT NOT NULL, kind TEXT NOT NULL, tg_file_id TEXT NOT NULL, "
+                "size INTEGER NOT NULL, mtime REAL NOT NULL, PRIMARY KEY (path, kind))"
+            )
+
+    def user_folder(self, user_id):
+        """Путь к папке пользователя."""
+        return os.path.join(self.base_folder, str(user_id))
+
+    def add_file(self, user_id, file_path, file_type, blob=None):
+        """Добавить или обновить файл в каталоге.
+
+        Args:
+            user_id: ID владельца файла
+            file_path: Путь к сохраненному файлу
+            file_type: Тип файла (photo, video, document)
+            blob: SHA-256 содержимого в хранилище или None, если файл хранится отдельно
+
+        Returns:
+            Идентификатор файла в каталоге или None, если файл не найден на диске
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Не удалось добавить файл {file_path} в каталог: {e}")
+            return None
+
+        with self._lock, self._conn:
+            self._upsert(str(user_id), file_path, file_type, stat, time.time(), blob)
+            row = self._conn.execute("SELECT id FROM files WHERE path = ?", (file_path,)).fetchone()
+        return row[0]
+
+    def _upsert(self, user_id_str, file_path, file_type, stat, added_at, blob=None):
+        self._conn.execute(
+            "INSERT INTO files (user_id, path, name, file_type, size, mtime, added_at, blob) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET user_id = excluded.user_id, name = excluded.name, "
+            "file_type = excluded.file_type, size = excluded.size, mtime = excluded.mtime, "
+            "added_at = excluded.added_at, blob = excluded.blob",
+            (user_id_str, file_path, os.path.basename(file_path), file_type, stat.st_size, stat.st_mtime,
+             added_at, blob)
+        )
+
+    def set_file_blob(self, file_path, blob):
+        """Связать файл каталога с содержимым в хранилище и обновить его размер и время изменения."""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE files SET blob = ?, size = ?, mtime = ? WHERE path = ?",
+                (blob, stat.st_size, stat.st_mtime, file_path)
+            )
+
+    def count_blob_refs(self, blob):
+        """Количество файлов каталога, ссылающихся на содержимое."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files WHERE blob = ?", (blob,)).fetchone()[0]
+
+    def list_files_without_blob(self):
+        """Файлы всех пользователей, содержимое которых хранится вне хранилища."""
+        with self._lock:
+            rows = self._conn.execute(f"{SELECT_FILES} WHERE blob IS NULL ORDER BY id").fetchall()
+        return [_file_record(row) for row in rows]
+
+    def referenced_blobs(self):
+        """Множество хэшей содержимого, на которые ссылаются файлы каталога."""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT DISTINCT blob FROM files WHERE blob IS NOT NULL")}
+
+    def remove_file(self, file_path):
+        """Удалить файл из каталога.
+
+        Returns:
+            True, если запись была удалена
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM files WHERE path = ?", (file_path,))
+            self._conn.execute("DELETE FROM telegram_files WHERE path = ?", (file_path,))
+        return cursor.rowcount > 0
+
+    def get_telegram_file_id(self, file_path, kind):
+        """Получить сохраненный file_id Telegram для файла.
+
+        Args:
+            file_path: Путь к файлу
+            kind: Способ отправки (photo, video, document)
+
+        Returns:
+            file_id или None, если его нет или файл изменился после отправки
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tg_file_id, size, mtime FROM telegram_files WHERE path = ? AND kind = ?",
+                (file_path, kind)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime) != (row[1], row[2]):
+            return None
+        return row[0]
+
+    def set_telegram_file_id(self, file_path, kind, tg_file_id):
+        """Запомнить file_id Telegram для текущей версии файла."""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO telegram_files (path, kind, tg_file_id, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (file_path, kind, tg_file_id, stat.st_size, stat.st_mtime)
+            )
+
+    def forget_telegram_file_id(self, file_path, kind=None):
+        """Удалить сохраненные file_id Telegram для файла (для всех способов отправки или одного)."""
+        with self._lock, self._conn:
+            if kind is None:
+                self._conn.execute("DELETE FROM telegram_files WHERE path = ?", (file_path,))
+            else:
+                self._conn.execute(
+                    "DELETE FROM telegram_files WHERE path = ? AND kind = ?", (file_path, kind)
+                )
+
+    def get_file(self, file_id):
+        """Получить запись о файле по идентификатору."""
+        with self._lock:
+            row = self._conn.execute(f"{SELECT_FILES} WHERE id = ?", (file_id,)).fetchone()
+        return _file_record(row) if row else None
+
+    def get_file_by_key(self, file_key):
+        """Получить запись о файле по ключу из callback_data (base62)."""
+        file_id = decode_file_key(file_key)
+        if file_id is None:
+            return None
+        return self.get_file(file_id)
+
+    def get_file_by_path(self, file_path):
+        """Получить запись о файле по пути."""
+        with self._lock:
+            row = self._conn.execute(f"{SELECT_FILES} WHERE path = ?", (file_path,)).fetchone()
+        return _file_record(row) if row else None
+
+    def count_files(self, user_id, file_type=None):
+        """Количество файлов пользователя (всех или указанного типа)."""
+        self._ensure_reconciled(user_id)
+        query = "SELECT COUNT(*) FROM files WHERE user_id = ?"
+        params = [str(user_id)]
+        if file_type:
+            query += " AND file_type = ?"
+            params.append(file_type)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def list_files(self, user_id, file_type=None, limit=None, offset=0):
+        """Получить файлы пользователя, отсортированные по времени добавления (сначала новые).
+
+        Args:
+            user_id: ID пользователя
+            file_type: Тип файла (photo, video, document) или None для всех файлов
+            limit: Максимальное количество записей (None - без ограничения)
+            offset: Смещение от начала списка
+
+        Returns:
+            Список словарей с полями id, key, user_id, path, name, file_type, size, mtime, added_at, blob
+        """
+        self._ensure_reconciled(user_id)
+        query = f"{SELECT_FILES} WHERE user_id = ?"
+        params = [str(user_id)]
+        if file_type:
+            query += " AND file_type = ?"
+            params.append(file_type)
+        query += " ORDER BY added_at DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([-1 if limit is None else limit, offset])
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [_file_record(row) for row in rows]
+
+    def _ensure_reconciled(self, user_id):
+        """Сверить каталог пользователя с диском при первом обращении в процессе."""
+        user_id_str = str(user_id)
+        if user_id_str not in self._reconciled:
+            self.reconcile_user(user_id_str)
+
+    def reconcile_user(self, user_id):
+        """Привести каталог пользователя в соответствие с содержимым его папок.
+
+        Returns:
+            Кортеж (добавлено, обновлено, удалено)
+        """
+        user_id_str = str(user_id)
+        user_folder = self.user_folder(user_id_str)
+
+        # Файлы на диске: путь -> (тип, stat)
+        on_disk = {}
+        for file_type, subfolder in TYPE_FOLDERS.items():
+            folder = os.path.join(user_folder, subfolder)
+            for root, _, filenames in os.walk(folder):
+                for filename in filenames:
+                    file_path = os.path.join(root, filename)
+                    try:
+                        on_disk[file_path] = (file_type, os.stat(file_path))
+                    except OSError:
+                        continue
+
+        added = updated = removed = 0
+        with self._lock, self._conn:
+            in_catalog = {
+                row[0]: row[1:]
+                for row in self._conn.execute(
+                    "SELECT path, file_type, size, mtime FROM files WHERE user_id = ?", (user_id_str,)
+                )
+            }
+
+            for file_path in in_catalog.keys() - on_disk.keys():
+                self._conn.execute("DELETE FROM files WHERE path = ?", (file_path,))
+                self._conn.execute("DELETE FROM telegram_files WHERE path = ?", (file_path,))
+                removed += 1
+
+            for file_path, (file_type, stat) in on_disk.items():
+                current = in_catalog.get(file_path)
+                if current == (file_type, stat.st_size, stat.st_mtime):
+                    continue
+                if current is None:
+                    # Файл, появившийся на диске в обход бота, хранится отдельно от хранилища
+                    self._upsert(user_id_str, file_path, file_type, stat, stat.st_mtime)
+                    added += 1
+                else:
+                    # Содержимое изменилось, поэтому связь с хранилищем больше не верна
+                    self._conn.execute(
+                        "UPDATE files SET file_type = ?, size = ?, mtime = ?, blob = NULL WHERE path = ?",
+                        (file_type, stat.st_size, stat.st_mtime, file_path)
+                    )
+                    updated += 1
+
+        self._reconciled.add(user_id_str)
+        if added or updated or removed:
+            logger.info(
+                f"Каталог пользователя {user_id_str} сверен с диском: "
+                f"добавлено {added}, обновлено {updated}, удалено {removed}"
+            )
+        return added, updated, removed
+
+    def reconcile_all(self):
+        """Сверить с диском каталоги всех пользователей, включая удаленные папки.
+
+        Returns:
+            Кортеж (добавлено, обновлено, удалено) суммарно по всем пользователям
+        """
+        user_ids = set()
+        if os.path.isdir(self.base_folder):
+            user_ids.update(
+                name for name in os.listdir(self.base_folder)
+                if os.path.isdir(os.path.join(self.base_folder, name))
+            )
+        with self._lock:
+            user_ids.update(row[0] for row in self._conn.execute("SELECT DISTINCT user_id FROM files"))
+
+        totals = [0, 0, 0]
+        for user_id in sorted(user_ids):
+            for i, value in enumerate(self.reconcile_user(user_id)):
+                totals[i] += value
+        return tuple(totals)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Создаем глобальный экземпляр каталога
+file_catalog = FileCatalog()
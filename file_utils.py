@@ -1,9 +1,16 @@
 import os
 import logging
+import tempfile
+import requests
+from telebot import apihelper
 from telebot.types import File
+from config import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
+# Адрес файлов Bot API, если apihelper.FILE_URL не переопределен
+DEFAULT_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+
 def sanitize_filename(filename):
     """Сделать имя файла безопасным для сохранения в файловой системе."""
     # Заменить проблемные символы
@@ -53,6 +60,59 @@ def get_file_list(folder_path):
         logger.error(f"Ошибка при получении списка файлов: {e}")
         return []
 
+def download_file_to_path(bot, remote_path, dest_path, chunk_size=DOWNLOAD_CHUNK_SIZE, digest=None):
+    """
+    Скачать файл Telegram на диск по частям.
+    
+    Содержимое пишется во временный файл в папке назначения блоками по
+    chunk_size байт и затем атомарно переименовывается в dest_path, поэтому
+    в памяти одновременно находится не больше одного блока, а в папке
+    пользователя не остаются недокачанные файлы.
+    
+    Args:
+        bot: Экземпляр TeleBot
+        remote_path: Путь к файлу на серверах Telegram (file_info.file_path)
+        dest_path: Путь для сохранения файла
+        chunk_size: Размер блока в байтах
+        digest: Объект hashlib, который обновляется содержимым по мере скачивания
+        
+    Returns:
+        Количество записанных байт
+    """
+    file_url = apihelper.FILE_URL or DEFAULT_FILE_URL
+    url = file_url.format(bot.token, remote_path)
+    
+    # Общая сессия ограничителя запросов (install_rate_limiter), если он установлен, иначе отдельное соединение
+    http = apihelper.session or requests
+    
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path) or ".", prefix=".download_", suffix=".part")
+    try:
+        with http.get(
+            url, stream=True, proxies=apihelper.proxy, timeout=DOWNLOAD_TIMEOUT
+        ) as response:
+            if response.status_code != 200:
+                raise apihelper.ApiHTTPException('Download file', response)
+            
+            written = 0
+            temp_file = os.fdopen(fd, 'wb')
+            # Дальше дескриптор закрывает объект файла
+            fd = None
+            with temp_file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    temp_file.write(chunk)
+                    written += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+        
+        os.replace(temp_path, dest_path)
+        return written
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 def save_file(bot, file_info, save_folder, file_name):
     """Загрузить и сохранить файл, отправленный пользователем."""
     try:
@@ -76,12 +136,8 @@ def save_file(bot, file_info, save_folder, file_name):
                 file_path = os.path.join(save_folder, new_name)
                 count += 1
         
-        # Скачать файл
-        downloaded_file = bot.download_file(file_info.file_path)
-        
-        # Сохранить файл
-        with open(file_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+        # Скачать файл на диск по частям
+        download_file_to_path(bot, file_info.file_path, file_path)
         
         return file_path
     
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Однократный импорт данных из users_data.json и shared_files.json в SQLite.
+
+Использование:
+    python import_json_storage.py [путь_к_базе]
+"""
+
+import logging
+import sys
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+from config import STORAGE_DB_PATH
+from storage_backends import SqliteStorageBackend, import_json_data
+
+# Те же файлы, что использует user_storage (сам модуль не импортируем,
+# чтобы не запускать очистку ссылок при импорте)
+USERS_DATA_FILE = "users_data.json"
+SHARED_FILES_DATA = "shared_files.json"
+
+db_path = sys.argv[1] if len(sys.argv) > 1 else STORAGE_DB_PATH
+
+print(f"Импорт данных из {USERS_DATA_FILE} и {SHARED_FILES_DATA} в {db_path}...")
+backend = SqliteStorageBackend(db_path)
+users_count, shares_count = import_json_data(USERS_DATA_FILE, SHARED_FILES_DATA, backend)
+backend.close()
+print(f"Готово! Пользователей: {users_count}, общих файлов: {shares_count}")
+print("Чтобы бот использовал базу, установите STORAGE_BACKEND=sqlite")
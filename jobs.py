@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Фоновые задания.
+
+Долгие операции (сборка и отправка архивов) выполняются не в потоках
+обработчиков telebot, а в отдельном пуле потоков заданий, поэтому они не
+занимают обработчики и не мешают обычной навигации. Очередь заданий
+ограничена, у одного пользователя одновременно может быть не больше
+JOB_PER_USER_LIMIT заданий (в очереди или в работе). Задание можно
+отменить: из очереди оно удаляется сразу, а выполняющееся задание
+прерывается в ближайшей контрольной точке (check_cancelled или advance).
+"""
+
+import time
+import queue
+import logging
+import itertools
+import threading
+
+from config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_PER_USER_LIMIT, JOB_PROGRESS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Задание отменено пользователем."""
+
+
+class JobRejected(Exception):
+    """Задание не принято в очередь."""
+
+    # Причины отказа
+    USER_LIMIT = "user_limit"
+    QUEUE_FULL = "queue_full"
+
+    def __init__(self, reason, active_job=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.active_job = active_job
+
+
+class Job:
+    """
+    Фоновое задание с отменой и учетом хода выполнения.
+
+    Функция задания получает объект Job первым аргументом. Ход выполнения
+    задается через set_totals и advance; обработчик on_progress вызывается
+    не чаще одного раза в progress_interval секунд.
+    """
+
+    def __init__(self, job_id, user_id, func, args, kwargs, description="",
+                 progress_interval=JOB_PROGRESS_INTERVAL):
+        self.id = job_id
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description
+        self.progress_interval = progress_interval
+        # queued -> running -> done / failed / cancelled
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.on_progress = None
+        self._cancel_event = threading.Event()
+        self._progress_lock = threading.Lock()
+        self._last_report = 0.0
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Запросить отмену задания."""
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        """Прервать задание исключением JobCancelled, если запрошена отмена."""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def set_totals(self, files, nbytes):
+        """Задать общий объем работы: количество файлов и байт."""
+        with self._progress_lock:
+            self.files_total = files
+            self.bytes_total = nbytes
+
+    def advance(self, files=0, nbytes=0):
+        """
+        Учесть выполненную часть работы и при необходимости сообщить о ходе задания.
+
+        Может вызываться из любого потока; проверяет отмену задания.
+        """
+        with self._progress_lock:
+            self.files_done += files
+            self.bytes_done += nbytes
+        self.check_cancelled()
+        self.report_progress()
+
+    def progress(self):
+        """
+        Текущий ход задания.
+
+        Returns:
+            Словарь с полями files_done, files_total, bytes_done, bytes_total,
+            elapsed и eta (оставшееся время в секундах или None, если его
+            пока нельзя оценить)
+        """
+        with self._progress_lock:
+            snapshot = {
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+            }
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        eta = None
+        if snapshot["bytes_done"] and elapsed > 0:
+            remaining = max(snapshot["bytes_total"] - snapshot["bytes_done"], 0)
+            eta = elapsed * remaining / snapshot["bytes_done"]
+        snapshot["elapsed"] = elapsed
+        snapshot["eta"] = eta
+        return snapshot
+
+    def report_progress(self, force=False):
+        """Вызвать on_progress, если с прошлого вызова прошло не меньше progress_interval секунд."""
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        with self._progress_lock:
+            if not force and now - self._last_report < self.progress_interval:
+                return
+            self._last_report = now
+        try:
+            self.on_progress(self, self.progress())
+        except Exception as e:
+            logger.warning(f"Ошибка при обновлении хода задания {self.id}: {e}")
+
+
+class JobManager:
+    """Очередь фоновых заданий с ограничением числа потоков и заданий на пользователя."""
+
+    def __init__(self, workers=JOB_WORKERS, max_queue=JOB_QUEUE_SIZE, per_user_limit=JOB_PER_USER_LIMIT):
+        self.workers = max(1, workers)
+        self.per_user_limit = max(1, per_user_limit)
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # user_id -> задания пользователя в очереди и в работе
+        self._active = {}
+        self._threads = []
+
+    def _ensure_workers(self):
+        """Запустить потоки заданий при первой постановке задания (вызывается под блокировкой)."""
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._worker, name=f"job-worker-{len(self._threads) + 1}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, user_id, func, *args, description="", **kwargs):
+        """
+        Поставить задание в очередь.
+
+        Args:
+            user_id: ID пользователя, от имени которого выполняется задание
+            func: Функция задания, вызывается как func(job, *args, **kwargs)
+            description: Описание задания для журнала
+
+        Returns:
+            Объект Job
+
+        Raises:
+            JobRejected: у пользователя уже есть задание или очередь заполнена
+        """
+        with self._lock:
+            active = self._active.get(user_id, [])
+            if len(active) >= self.per_user_limit:
+                raise JobRejected(JobRejected.USER_LIMIT, active[0])
+            job = Job(next(self._ids), user_id, func, args, kwargs, description)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobRejected(JobRejected.QUEUE_FULL)
+            self._active.setdefault(user_id, []).append(job)
+            self._ensure_workers()
+        logger.info(f"Задание {job.id} ({description}) пользователя {user_id} поставлено в очередь")
+        return job
+
+    def queue_position(self, job):
+        """Количество заданий в очереди перед заданием (приблизительно)."""
+        with self._lock:
+            queued = [
+                other for jobs in self._active.values() for other in jobs
+                if other.state == "queued" and not other.cancelled
+            ]
+        return sum(1 for other in queued if other.id < job.id)
+
+    def active_jobs(self, user_id):
+        """Задания пользователя в очереди и в работе."""
+        with self._lock:
+            return list(self._active.get(user_id, []))
+
+    def cancel_user_jobs(self, user_id):
+        """
+        Отменить все задания пользователя.
+
+        Returns:
+            Список кортежей (задание, состояние в момент отмены). Задание в
+            состоянии "queued" гарантированно не будет запущено
+        """
+        with self._lock:
+            cancelled = []
+            jobs = self._active.get(user_id, [])
+            for job in jobs:
+                job.cancel()
+                cancelled.append((job, job.state))
+                if job.state == "queued":
+                    # Задание остается в очереди до выборки потоком, но уже не
+                    # занимает место пользователя: поток его пропустит
+                    job.state = "cancelled"
+            jobs[:] = [job for job in jobs if job.state != "cancelled"]
+            if not jobs:
+                self._active.pop(user_id, None)
+        for job, state in cancelled:
+            logger.info(f"Задание {job.id} пользователя {user_id} отменено ({state})")
+        return cancelled
+
+    def _finish(self, job, state):
+        with self._lock:
+            job.state = state
+            jobs = self._active.get(job.user_id)
+            if jobs and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self._active[job.user_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                with self._lock:
+                    # Задание отменено, пока ждало в очереди
+                    if job.cancelled:
+                        skip = True
+                    else:
+                        skip = False
+                        job.state = "running"
+                        job.started_at = time.monotonic()
+                if skip:
+                    self._finish(job, "cancelled")
+                    continue
+
+                started = time.monotonic()
+                try:
+                    job.func(job, *job.args, **job.kwargs)
+                except JobCancelled:
+                    self._finish(job, "cancelled")
+                except Exception as e:
+                    logger.error(f"Ошибка в задании {job.id} ({job.description}): {e}")
+                    self._finish(job, "failed")
+                else:
+                    self._finish(job, "done")
+                logger.info(
+                    f"Задание {job.id} ({job.description}) завершено за "
+                    f"{time.monotonic() - started:.2f} с: {job.state}"
+                )
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, wait=True):
+        """Отменить все задания и остановить потоки."""
+        with self._lock:
+            for jobs in self._active.values():
+                for job in jobs:
+                    job.cancel()
+            threads = list(self._threads)
+            self._threads = []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+# Создаем глобальный менеджер заданий
+job_manager = JobManager()
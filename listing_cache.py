@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Кэш снимков списков файлов, показанных пользователям.
+
+Каждый снимок привязан к сообщению (chat_id, message_id), в котором были
+нарисованы кнопки, поэтому обратные вызовы этого сообщения разрешаются
+ровно в те файлы, которые видел пользователь, независимо от списков,
+показанных в других чатах. Размер кэша ограничен числом записей и
+временем жизни записи.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from config import LISTING_CACHE_MAX_ENTRIES, LISTING_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class ListingCache:
+    """LRU-кэш с ограничением времени жизни для снимков списков файлов."""
+
+    def __init__(self, max_entries=LISTING_CACHE_MAX_ENTRIES, ttl=LISTING_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (chat_id, message_id) -> (время сохранения, снимок)
+        self._entries = OrderedDict()
+
+    def put(self, chat_id, message_id, listing):
+        """Сохранить снимок списка для сообщения.
+
+        Args:
+            chat_id: ID чата
+            message_id: ID сообщения с кнопками списка
+            listing: Словарь {ключ файла: путь к файлу}
+
+        Returns:
+            Неизменяемый снимок списка
+        """
+        snapshot = MappingProxyType(dict(listing))
+        key = (chat_id, message_id)
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            # Вытесняем устаревшие записи с начала очереди
+            while self._entries:
+                stored_at, _ = next(iter(self._entries.values()))
+                if now - stored_at <= self.ttl:
+                    break
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def get(self, chat_id, message_id):
+        """Получить снимок списка для сообщения или None, если его нет или он устарел."""
+        key = (chat_id, message_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, snapshot = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def resolve(self, chat_id, message_id, file_key):
+        """Получить путь к файлу по ключу в снимке сообщения или None."""
+        snapshot = self.get(chat_id, message_id)
+        if snapshot is None:
+            return None
+        return snapshot.get(file_key)
+
+    def discard(self, chat_id, message_id):
+        """Удалить снимок сообщения."""
+        with self._lock:
+            self._entries.pop((chat_id, message_id), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# Создаем глобальный экземпляр кэша
+listing_cache = ListingCache()
@@ -90,6 +90,10 @@ for folder in [photos_folder, videos_folder, documents_folder]:
 bot = TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=True)
 logger.info(f"Бот @{BOT_USERNAME} инициализирован")
 
+# Обновления одного чата обрабатываются по очереди, разных чатов - параллельно
+from dispatcher import install_chat_dispatcher
+chat_dispatcher = install_chat_dispatcher(bot)
+
 # Загружаем данные о пользователях
 USER_DATA_FILE = "users_data.json"
 shared_files_file = "shared_files.json"
@@ -169,6 +173,13 @@ def register_handlers():
 
 def run_bot_with_restart():
     """Функция для запуска бота с автоматическим перезапуском при сбоях."""
+    # Пока установлен webhook, getUpdates завершается ошибкой 409,
+    # поэтому при переходе с webhook на опрос удаляем его
+    try:
+        bot.remove_webhook()
+    except Exception as e:
+        logger.warning(f"Не удалось удалить webhook: {e}")
+    
     while True:
         try:
             # Регистрируем обработчики
@@ -195,4 +206,7 @@ def run_bot_with_restart():
 
 if __name__ == "__main__":
     logger.info("Запуск бота...")
+    # Импортируем хранилище в главном потоке, чтобы сохранить данные по SIGTERM
+    from user_storage import install_shutdown_handlers
+    install_shutdown_handlers()
     run_bot_with_restart()
\ No newline at end of file
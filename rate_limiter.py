@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Ограничение частоты исходящих запросов к Bot API.
+
+Все синхронные запросы бота проходят через apihelper.CUSTOM_REQUEST_SENDER.
+Методы отправки и редактирования сообщений (send*, edit*, forward*, copy*)
+перед запросом ждут токен в корзинах: общей (RATE_LIMIT_GLOBAL_PER_SECOND),
+корзине чата (RATE_LIMIT_CHAT_PER_SECOND) и для групп - корзине группы
+(RATE_LIMIT_GROUP_PER_MINUTE). Запрос сверх лимита не завершается ошибкой,
+а ждет своей очереди в потоке обработчика.
+
+Если Telegram все же ответил 429 Too Many Requests, корзина чата (или общая
+корзина) блокируется на retry_after секунд, и запрос повторяется. Остальные
+запросы к этому чату ждут окончания блокировки, а не получают такой же ответ.
+
+Отдельной очереди запросов нет: запрос ждет в вызвавшем его потоке
+(обработчика, диспетчера или задания). Поэтому stats()["blocked_threads"] -
+это число потоков, ожидающих токен, а не длина очереди. Ожидание одного чата
+занимает только поток, обрабатывающий этот чат; при всплеске 429 у многих
+чатов сразу ждущие потоки могут временно занять весь пул диспетчера.
+
+Запросы отправляются через собственную сессию requests планировщика с
+общим пулом соединений (HTTP_POOL_SIZE).
+
+Асинхронный режим (async_bot) использует те же корзины через call_async:
+там запрос ждет токен в asyncio.sleep и не занимает поток.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+from config import (
+    RATE_LIMIT_GLOBAL_PER_SECOND, RATE_LIMIT_CHAT_PER_SECOND, RATE_LIMIT_CHAT_BURST,
+    RATE_LIMIT_GROUP_PER_MINUTE, RATE_LIMIT_MAX_RETRIES, HTTP_POOL_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Методы, на которые распространяются лимиты Telegram на отправку сообщений
+LIMITED_METHOD_PREFIXES = ("send", "edit", "forward", "copy")
+
+# Число корзин чатов, после которого удаляются корзины неактивных чатов
+MAX_IDLE_BUCKETS = 1024
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: запрос занимает токен сразу и ждет его появления."""
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Емкость корзины (допустимый всплеск запросов)
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        # Время, до которого Telegram попросил не отправлять запросы
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, now):
+        """
+        Занять токен.
+
+        Returns:
+            Сколько секунд нужно подождать до отправки запроса
+        """
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def block(self, until):
+        """Не выдавать токены до указанного времени (time.monotonic)."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now):
+        """Корзина полна и не заблокирована - ее можно удалить без потери состояния."""
+        with self._lock:
+            refilled = self.tokens + (now - self.updated) * self.rate
+            return refilled >= self.capacity and now >= self.blocked_until
+
+
+class RateLimiter:
+    """Планировщик исходящих запросов с корзинами токенов и обработкой 429."""
+
+    def __init__(
+        self,
+        global_rate=RATE_LIMIT_GLOBAL_PER_SECOND,
+        chat_rate=RATE_LIMIT_CHAT_PER_SECOND,
+        chat_burst=RATE_LIMIT_CHAT_BURST,
+        group_per_minute=RATE_LIMIT_GROUP_PER_MINUTE,
+        max_retries=RATE_LIMIT_MAX_RETRIES,
+        pool_size=HTTP_POOL_SIZE
+    ):
+        self.session = create_session(pool_size)
+        self.global_bucket = TokenBucket(global_rate, int(global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self._buckets_lock = threading.Lock()
+        # ID чата -> корзина чата; ("group", ID чата) -> корзина группы
+        self._buckets = {}
+
+        self._stats_lock = threading.Lock()
+        self._blocked = 0
+        self._max_blocked = 0
+        self._requests = 0
+        self._delayed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._too_many_requests = 0
+
+    def _bucket(self, key, rate, capacity, now):
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                    for idle_key in [k for k, b in self._buckets.items() if b.is_idle(now)]:
+                        del self._buckets[idle_key]
+                bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            return bucket
+
+    def _chat_buckets(self, chat_id, now):
+        """Корзины, через которые проходят запросы к чату."""
+        buckets = [self._bucket(chat_id, self.chat_rate, self.chat_burst, now)]
+        # ID групп, супергрупп и каналов отрицательные
+        if isinstance(chat_id, int) and chat_id < 0:
+            buckets.append(self._bucket(
+                ("group", chat_id), self.group_per_minute / 60, self.group_per_minute, now
+            ))
+        return buckets
+
+    def acquire(self, chat_id=None):
+        """
+        Дождаться разрешения на запрос к чату.
+
+        Сначала ждем корзины чата, а токен общей корзины занимаем, только когда
+        чат готов, чтобы ожидающий чат не расходовал общий лимит других чатов.
+
+        Returns:
+            Время ожидания в секундах
+        """
+        started = self._start_wait()
+        try:
+            if chat_id is not None:
+                wait = self._reserve_chat(chat_id)
+                if wait > 0:
+                    time.sleep(wait)
+            wait = self.global_bucket.reserve(time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            waited = self._finish_wait(started)
+        return waited
+
+    async def acquire_async(self, chat_id=None):
+        """То же, что acquire, но ожидание не блокирует цикл событий."""
+        started = self._start_wait()
+        try:
+            if chat_id is not None:
+                wait = self._reserve_chat(chat_id)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            wait = self.global_bucket.reserve(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+        finally:
+            waited = self._finish_wait(started)
+        return waited
+
+    def _reserve_chat(self, chat_id):
+        """Занять токены корзин чата и вернуть время ожидания."""
+        now = time.monotonic()
+        return max(bucket.reserve(now) for bucket in self._chat_buckets(chat_id, now))
+
+    def _start_wait(self):
+        with self._stats_lock:
+            self._blocked += 1
+            self._max_blocked = max(self._max_blocked, self._blocked)
+        return time.monotonic()
+
+    def _finish_wait(self, started):
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self._blocked -= 1
+            self._requests += 1
+            if waited > 0.001:
+                self._delayed += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return waited
+
+    def block(self, chat_id, retry_after):
+        """Заблокировать чат (или все запросы, если чат не указан) на retry_after секунд."""
+        until = time.monotonic() + retry_after
+        if chat_id is None:
+            self.global_bucket.block(until)
+        else:
+            for bucket in self._chat_buckets(chat_id, time.monotonic()):
+                bucket.block(until)
+
+    def send_request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        """Отправить запрос к Bot API (подставляется в apihelper.CUSTOM_REQUEST_SENDER)."""
+        method_name = url.rsplit("/", 1)[-1]
+        if not method_name.startswith(LIMITED_METHOD_PREFIXES):
+            return self.session.request(
+                method, url, params=params, files=files, timeout=timeout, proxies=proxies
+            )
+
+        chat_id = _normalize_chat_id((params or {}).get("chat_id"))
+        positions = _file_positions(files)
+        attempt = 0
+        while True:
+            self.acquire(chat_id)
+            response = self.session.request(
+                method, url, params=params, files=files, timeout=timeout, proxies=proxies
+            )
+            if response.status_code != 429:
+                return response
+
+            retry_after = _retry_after(response)
+            with self._stats_lock:
+                self._too_many_requests += 1
+            self.block(chat_id, retry_after)
+            # Загружаемые файлы уже прочитаны, повторить можно, только вернувшись в начало
+            if attempt >= self.max_retries or positions is None or not _rewind_files(files, positions):
+                logger.warning(f"{method_name} для чата {chat_id}: 429, повторы исчерпаны")
+                return response
+            attempt += 1
+            logger.warning(
+                f"{method_name} для чата {chat_id}: 429, повтор через {retry_after} с "
+                f"(попытка {attempt} из {self.max_retries})"
+            )
+
+    async def call_async(self, chat_id, request, /, *args, **kwargs):
+        """
+        Выполнить запрос асинхронного бота с учетом лимитов.
+
+        Args:
+            chat_id: Чат, к которому относится запрос (None - только общий лимит)
+            request: Метод AsyncTeleBot (send_message, edit_message_text, ...)
+
+        После ответа 429 чат блокируется на retry_after секунд и запрос
+        повторяется (не больше max_retries раз), как в send_request.
+        """
+        chat_id = _normalize_chat_id(chat_id)
+        attempt = 0
+        while True:
+            await self.acquire_async(chat_id)
+            try:
+                return await request(*args, **kwargs)
+            except Exception as e:
+                # Исключение asyncio_helper.ApiTelegramException: сравниваем код ошибки,
+                # чтобы планировщик не зависел от aiohttp
+                if getattr(e, "error_code", None) != 429:
+                    raise
+                retry_after = _retry_after_from_json(getattr(e, "result_json", None))
+                with self._stats_lock:
+                    self._too_many_requests += 1
+                self.block(chat_id, retry_after)
+                if attempt >= self.max_retries:
+                    logger.warning(f"{request.__name__} для чата {chat_id}: 429, повторы исчерпаны")
+                    raise
+                attempt += 1
+                logger.warning(
+                    f"{request.__name__} для чата {chat_id}: 429, повтор через {retry_after} с "
+                    f"(попытка {attempt} из {self.max_retries})"
+                )
+
+    def stats(self):
+        """
+        Метрики планировщика.
+
+        Returns:
+            Словарь: blocked_threads - потоков (и задач call_async) ждут токен сейчас,
+            max_blocked_threads - максимум одновременно ждавших,
+            requests - всего запросов с лимитом, delayed - из них ждали,
+            avg_wait_ms/max_wait_ms - время ожидания, too_many_requests - ответов 429
+        """
+        with self._stats_lock:
+            return {
+                "blocked_threads": self._blocked,
+                "max_blocked_threads": self._max_blocked,
+                "requests": self._requests,
+                "delayed": self._delayed,
+                "avg_wait_ms": self._total_wait / self._requests * 1000 if self._requests else 0.0,
+                "max_wait_ms": self._max_wait * 1000,
+                "too_many_requests": self._too_many_requests,
+            }
+
+
+def create_session(pool_size=HTTP_POOL_SIZE):
+    """Сессия requests с одним пулом не больше pool_size соединений."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _normalize_chat_id(chat_id):
+    """ID чата из параметров запроса: число или имя канала (@channel)."""
+    if chat_id is None:
+        return None
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return str(chat_id)
+
+
+def _retry_after(response):
+    """Время ожидания из ответа 429 (parameters.retry_after)."""
+    try:
+        return _retry_after_from_json(response.json())
+    except ValueError:
+        return 1
+
+
+def _retry_after_from_json(result_json):
+    try:
+        return max(1, int(result_json["parameters"]["retry_after"]))
+    except (ValueError, KeyError, TypeError):
+        return 1
+
+
+def _file_objects(files):
+    for value in (files or {}).values():
+        # Файл передается объектом или кортежем (имя, объект[, тип])
+        yield value[1] if isinstance(value, tuple) else value
+
+
+def _file_positions(files):
+    """Позиции загружаемых файлов до отправки или None, если файлы нельзя перечитать."""
+    try:
+        return [obj.tell() if hasattr(obj, "read") else None for obj in _file_objects(files)]
+    except (OSError, ValueError):
+        return None
+
+
+def _rewind_files(files, positions):
+    try:
+        for obj, position in zip(_file_objects(files), positions):
+            if position is not None:
+                obj.seek(position)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def install_rate_limiter():
+    """
+    Направить запросы всех синхронных ботов процесса через общий планировщик.
+
+    Сессия планировщика становится apihelper.session, поэтому скачивание
+    файлов (file_utils) использует тот же пул соединений.
+    """
+    apihelper.CUSTOM_REQUEST_SENDER = rate_limiter.send_request
+    apihelper.session = rate_limiter.session
+    return rate_limiter
+
+
+# Глобальный экземпляр планировщика
+rate_limiter = RateLimiter()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Восстановление каталога файлов по содержимому папок пользователей.
+
+Использование:
+    python reconcile_catalog.py [ID_пользователя ...]
+
+Без аргументов сверяются каталоги всех пользователей.
+"""
+
+import logging
+import sys
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+from file_catalog import file_catalog
+
+user_ids = sys.argv[1:]
+
+print(f"Сверка каталога {file_catalog.db_path} с папкой {file_catalog.base_folder}...")
+if user_ids:
+    totals = [0, 0, 0]
+    for user_id in user_ids:
+        for i, value in enumerate(file_catalog.reconcile_user(user_id)):
+            totals[i] += value
+    added, updated, removed = totals
+else:
+    added, updated, removed = file_catalog.reconcile_all()
+file_catalog.close()
+print(f"Готово! Добавлено: {added}, обновлено: {updated}, удалено: {removed}")
@@ -7,9 +7,7 @@ import re
 import time
 import logging
 import datetime
-import zipfile
 import tempfile
-import shutil
 
 # Пытаемся импортировать telebot (PyTelegramBotAPI)
 try:
@@ -36,6 +34,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Каталог файлов и кэш списков импортируем после настройки логирования
+from file_catalog import file_catalog
+from listing_cache import listing_cache
+from file_utils import download_file_to_path
+from telebot.apihelper import ApiTelegramException
+from archive_utils import write_zip, plan_volumes, VolumeBuilder
+from archive_cache import archive_cache
+from jobs import job_manager, JobCancelled, JobRejected
+from blob_store import blob_store
+from dispatcher import install_chat_dispatcher
+from callback_router import CallbackRouter
+from rate_limiter import install_rate_limiter
+from edit_coalescer import install_edit_coalescer
+from ui_templates import (
+    ButtonRow, FrozenMarkup, paging_row, FILTER_ROW, FILTER_MARKUP, MENU_MARKUP,
+    JOB_CANCEL_MARKUP, JOB_CANCEL_MENU_MARKUP, MAIN_MENU_MARKUP, MAIN_MENU_COMPACT_MARKUP,
+    START_TEXT, MAIN_MENU_TEXT, HELP_MARKUP, HELP_COMPACT_MARKUP, HELP_TEXT, HELP_COMPACT_TEXT,
+    ABOUT_MARKUP, ABOUT_TEXT, ABOUT_COMPACT_TEXT, DOWNLOAD_ZIP_MARKUP, DOWNLOAD_ZIP_TEXT
+)
+
 # Токен бота из переменной окружения
 BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 if not BOT_TOKEN:
@@ -45,9 +63,6 @@ if not BOT_TOKEN:
 # Папка, где будут сохраняться файлы
 SAVE_FOLDER = "saved_files"
 
-# Словарь для кэширования путей файлов (для операций удаления)
-# Ключ: короткий идентификатор, Значение: полный путь к файлу
-file_path_cache = {}
 if not os.path.exists(SAVE_FOLDER):
     os.makedirs(SAVE_FOLDER)
     logger.info(f"Создана папка сохранения: {SAVE_FOLDER}")
@@ -127,6 +142,16 @@ except Exception as e:
         logger.error(f"Критическая ошибка при инициализации бота: {e}")
         sys.exit(1)
 
+# Обновления одного чата обрабатываются по очереди, разных чатов - параллельно
+chat_dispatcher = install_chat_dispatcher(bot)
+
+# Отправка сообщений ограничивается лимитами Telegram, ответы 429 повторяются после паузы
+rate_limiter = install_rate_limiter()
+
+# Редактирования, не меняющие сообщение, не отправляются; промежуточные состояния
+# отправляются через edit_coalescer.defer и отбрасываются, если их сразу сменило итоговое
+edit_coalescer = install_edit_coalescer(bot)
+
 # Функция-декоратор для проверки верификации пользователя
 def require_verification(func):
     """Декоратор для проверки верификации пользователя перед выполнением команды."""
@@ -218,39 +243,23 @@ def create_zip_archive(files, user_id, archive_type="all"):
         archive_type: Тип создаваемого архива ("all", "photos", "videos", "documents")
         
     Returns:
-        Путь к созданному архиву
+        Путь к созданному архиву (удаляется вызывающей стороной)
     """
-    temp_dir = None
+    archive_path = None
     try:
         # Проверяем, что есть файлы для архивации
         if not files:
             logger.warning(f"Нет файлов для создания архива для пользователя {user_id}")
             return None
         
-        # Создаем временную директорию для архива
-        temp_dir = tempfile.mkdtemp()
-        archive_name = f"user_{user_id}_{archive_type}_{int(time.time())}.zip"
-        archive_path = os.path.join(temp_dir, archive_name)
-        
-        # Логируем информацию о создании архива
-        logger.info(f"Создание архива {archive_path} с {len(files)} файлами")
-        
-        # Создаем ZIP-архив
-        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in files:
-                if not os.path.exists(file_path):
-                    logger.warning(f"Файл {file_path} не существует, пропускаем")
-                    continue
-                
-                # Добавляем файл в архив с путем относительно базовой директории
-                arcname = os.path.basename(file_path)
-                zipf.write(file_path, arcname=arcname)
-                logger.debug(f"Добавлен файл {arcname} в архив")
-        
-        # Проверяем, что архив создан успешно
-        if not os.path.exists(archive_path):
-            logger.error(f"Архив {archive_path} не был создан")
-            return None
+        # Создаем временный файл архива (без отдельной временной директории)
+        prefix = f"user_{user_id}_{archive_type}_{int(time.time())}_"
+        with tempfile.NamedTemporaryFile(prefix=prefix, suffix=".zip", delete=False) as archive_file:
+            archive_path = archive_file.name
+            
+            # Логируем информацию о создании архива
+            logger.info(f"Создание архива {archive_path} с {len(files)} файлами")
+            write_zip(files, archive_file)
         
         # Получаем размер архива
         archive_size = os.path.getsize(archive_path)
@@ -259,9 +268,9 @@ def create_zip_archive(files, user_id, archive_type="all"):
         return archive_path
     except Exception as e:
         logger.error(f"Ошибка при создании архива: {e}")
-        # Удаляем временную директорию в случае ошибки
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        # Удаляем недописанный архив в случае ошибки
+        if archive_path and os.path.exists(archive_path):
+            os.remove(archive_path)
         return None
 
 def save_file(file_info, save_folder, file_name):
@@ -287,12 +296,8 @@ def save_file(file_info, save_folder, file_name):
                 file_path = os.path.join(save_folder, new_name)
                 count += 1
         
-        # Скачать файл
-        downloaded_file = bot.download_file(file_info.file_path)
-        
-        # Сохранить файл
-        with open(file_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+        # Скачать файл на диск по частям
+        download_file_to_path(bot, file_info.file_path, file_path)
         
         return file_path
     
@@ -300,6 +305,56 @@ def save_file(file_info, save_folder, file_name):
         logger.error(f"Ошибка при сохранении файла: {e}")
         return None
 
+def get_sent_file_id(sent_message, kind):
+    """Получить file_id Telegram из отправленного сообщения, если оно содержит файл нужного типа."""
+    if kind == "photo":
+        return sent_message.photo[-1].file_id if sent_message.photo else None
+    media = sent_message.video if kind == "video" else sent_message.document
+    return media.file_id if media else None
+
+def send_stored_file(chat_id, file_path, file_type, **kwargs):
+    """
+    Отправить сохраненный файл, по возможности без повторной загрузки содержимого.
+    
+    Если для файла известен file_id Telegram, отправляется он. Если Telegram
+    отклоняет file_id, файл загружается с диска, и новый file_id сохраняется
+    в каталоге для следующих отправок.
+    
+    Args:
+        chat_id: ID чата
+        file_path: Путь к файлу
+        file_type: Способ отправки (photo, video, document)
+        **kwargs: Дополнительные параметры (caption, reply_markup, parse_mode)
+        
+    Returns:
+        Отправленное сообщение
+    """
+    if file_type == "photo":
+        send_method, field = bot.send_photo, "photo"
+    elif file_type == "video":
+        send_method, field = bot.send_video, "video"
+    else:
+        file_type = "document"
+        send_method, field = bot.send_document, "document"
+    
+    tg_file_id = file_catalog.get_telegram_file_id(file_path, file_type)
+    if tg_file_id:
+        try:
+            return send_method(chat_id=chat_id, **{field: tg_file_id}, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            logger.warning(f"Telegram отклонил file_id для {file_path}, отправляем файл заново: {e}")
+            file_catalog.forget_telegram_file_id(file_path, file_type)
+    
+    with open(file_path, 'rb') as file:
+        sent_message = send_method(chat_id=chat_id, **{field: file}, **kwargs)
+    
+    tg_file_id = get_sent_file_id(sent_message, file_type)
+    if tg_file_id:
+        file_catalog.set_telegram_file_id(file_path, file_type, tg_file_id)
+    return sent_message
+
 # Команды бота
 @bot.message_handler(commands=['start'])
 def start(message):
@@ -371,33 +426,14 @@ def start(message):
                 
                 # Отправляем файл в зависимости от типа
                 try:
-                    if file_type == "photo":
-                        with open(file_path, 'rb') as file:
-                            sent_message = bot.send_photo(
-                                chat_id=message.chat.id,
-                                photo=file,
-                                caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
-                                reply_markup=markup,
-                                parse_mode="HTML"
-                            )
-                    elif file_type == "video":
-                        with open(file_path, 'rb') as file:
-                            sent_message = bot.send_video(
-                                chat_id=message.chat.id,
-                                video=file,
-                                caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
-                                reply_markup=markup,
-                                parse_mode="HTML"
-                            )
-                    else:
-                        with open(file_path, 'rb') as file:
-                            sent_message = bot.send_document(
-                                chat_id=message.chat.id,
-                                document=file,
-                                caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
-                                reply_markup=markup,
-                                parse_mode="HTML"
-                            )
+                    sent_message = send_stored_file(
+                        message.chat.id,
+                        file_path,
+                        file_type,
+                        caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
+                        reply_markup=markup,
+                        parse_mode="HTML"
+                    )
                     
                     # Обновляем статус
                     bot.edit_message_text(
@@ -449,50 +485,12 @@ def start(message):
         return  # Прерываем выполнение функции до ввода пароля
     
     # Пользователь верифицирован, показываем главное меню
-    # Создаем красивую разметку с кнопками главного меню
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    
-    # Кнопки для разных типов файлов
-    btn_photos = types.InlineKeyboardButton("🖼️ Фотографии", callback_data="cmd:photos")
-    btn_videos = types.InlineKeyboardButton("🎬 Видеофайлы", callback_data="cmd:videos")
-    btn_docs = types.InlineKeyboardButton("📄 Документы", callback_data="cmd:documents")
-    btn_all_files = types.InlineKeyboardButton("📁 Все файлы", callback_data="files")
-    
-    # Кнопки обмена файлами
-    btn_shared_files = types.InlineKeyboardButton("📤 Мои общие файлы", callback_data="cmd:myshared")
-    btn_received_files = types.InlineKeyboardButton("📥 Полученные файлы", callback_data="cmd:received")
-    
-    # Кнопка скачивания архива
-    btn_download_zip = types.InlineKeyboardButton("🗃️ Скачать ZIP-архив", callback_data="cmd:download_zip")
-    
-    # Кнопки функций
-    btn_help = types.InlineKeyboardButton("❓ Помощь", callback_data="cmd:help")
-    btn_info = types.InlineKeyboardButton("ℹ️ О боте", callback_data="cmd:about")
-    
-    # Добавляем кнопки в разметку
-    markup.add(btn_photos, btn_videos)
-    markup.add(btn_docs, btn_all_files)
-    markup.add(btn_shared_files, btn_received_files)
-    markup.add(btn_download_zip)
-    markup.add(btn_help, btn_info)
-    
-    # Информационный баннер с инструкцией
-    upload_banner = "📤 Отправьте мне файл, чтобы сохранить его!"
-    
-    # Отправляем приветственное сообщение с кнопками
+    # Отправляем приветственное сообщение с готовой клавиатурой главного меню
     bot.send_message(
         message.chat.id,
-        f"👋 <b>Привет, {message.from_user.first_name}!</b>\n\n"
-        f"🤖 Я <b>File Storage Bot</b> - ваш помощник для хранения и организации файлов.\n\n"
-        f"📌 <b>Основные возможности:</b>\n"
-        f"• Сохранение фото, видео и документов\n"
-        f"• Удобная организация по категориям\n"
-        f"• Простой поиск и просмотр\n"
-        f"• Обмен файлами с другими пользователями\n"
-        f"• Скачивание всех файлов в ZIP-архиве\n\n"
-        f"{upload_banner}",
+        START_TEXT.format(first_name=message.from_user.first_name),
         parse_mode="HTML",
-        reply_markup=markup
+        reply_markup=MAIN_MENU_MARKUP
     )
     
     # Регистрируем пользователя в логах
@@ -501,65 +499,12 @@ def start(message):
 @bot.message_handler(commands=['help'])
 def help_command(message):
     """Отправить подробную справку с интерактивными кнопками."""
-    # Создаем клавиатуру с кнопками
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    
-    # Кнопки разделов файлов
-    btn_photos = types.InlineKeyboardButton("🖼️ Просмотр фото", callback_data="cmd:photos")
-    btn_videos = types.InlineKeyboardButton("🎬 Просмотр видео", callback_data="cmd:videos")
-    btn_docs = types.InlineKeyboardButton("📄 Просмотр документов", callback_data="cmd:documents")
-    btn_all = types.InlineKeyboardButton("📁 Все файлы", callback_data="files")
-    
-    # Кнопки обмена файлами
-    btn_shared = types.InlineKeyboardButton("📤 Мои общие файлы", callback_data="cmd:myshared")
-    btn_received = types.InlineKeyboardButton("📥 Полученные файлы", callback_data="cmd:received")
-    
-    # Кнопка возврата в главное меню
-    btn_menu = types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-    
-    # Добавляем кнопку скачивания архива
-    btn_download_zip = types.InlineKeyboardButton("🗃️ Скачать ZIP-архив", callback_data="cmd:download_zip")
-    
-    # Формируем разметку кнопок
-    markup.add(btn_photos, btn_videos)
-    markup.add(btn_docs, btn_all)
-    markup.add(btn_shared, btn_received)
-    markup.add(btn_download_zip)
-    markup.add(btn_menu)
-    
     # Отправляем сообщение помощи с форматированием HTML
     bot.send_message(
         message.chat.id,
-        "<b>📚 Справка по использованию бота</b>\n\n"
-        "<b>📋 Доступные команды:</b>\n"
-        "• /start - Запустить бота и показать главное меню\n"
-        "• /help - Показать эту справку\n"
-        "• /files - Показать все сохраненные файлы\n"
-        "• /photos - Показать только фотографии\n"
-        "• /videos - Показать только видеофайлы\n"
-        "• /documents - Показать только документы\n"
-        "• /share_ID - Получить доступ к общему файлу\n\n"
-        
-        "<b>💾 Как сохранить файл:</b>\n"
-        "Просто отправьте мне фото, видео или документ, и я автоматически сохраню его в соответствующей категории.\n\n"
-        
-        "<b>🔍 Как найти файлы:</b>\n"
-        "Используйте кнопки ниже для просмотра файлов по категориям. При просмотре доступны кнопки навигации и фильтрации.\n\n"
-        
-        "<b>📤 Обмен файлами:</b>\n"
-        "1. Откройте файл через меню просмотра файлов\n"
-        "2. Нажмите кнопку \"Поделиться файлом\"\n"
-        "3. Отправьте полученную команду другому пользователю\n"
-        "4. Пользователь может получить доступ к файлу, отправив эту команду боту\n\n"
-        
-        "<b>✨ Дополнительные возможности:</b>\n"
-        "• Просмотр подробной информации о файле\n"
-        "• Удобная навигация между категориями\n"
-        "• Обмен файлами между пользователями\n"
-        "• Управление своими общими файлами\n"
-        "• Скачивание всех файлов в ZIP-архиве",
+        HELP_TEXT,
         parse_mode="HTML",
-        reply_markup=markup
+        reply_markup=HELP_MARKUP
     )
 
 @bot.message_handler(commands=['files'])
@@ -595,15 +540,6 @@ def menu_command(message):
 @bot.message_handler(commands=['about'])
 def about_command(message):
     """Показать информацию о боте."""
-    # Создаем клавиатуру с кнопками
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    
-    # Добавляем кнопки
-    markup.add(
-        types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu"),
-        types.InlineKeyboardButton("📚 Справка", callback_data="cmd:help")
-    )
-    
     # Получаем статистику
     photos_count = len(get_file_list(PHOTOS_FOLDER))
     videos_count = len(get_file_list(VIDEOS_FOLDER))
@@ -625,78 +561,55 @@ def about_command(message):
     # Отправляем информацию о боте
     bot.send_message(
         message.chat.id,
-        f"<b>🤖 File Storage Bot v1.0</b>\n\n"
-        f"<b>О боте:</b>\n"
-        f"Бот для хранения и организации файлов в удобном формате.\n\n"
-        
-        f"<b>📊 Статистика файлов:</b>\n"
-        f"• 🖼️ Фотографии: {photos_count}\n"
-        f"• 🎬 Видеофайлы: {videos_count}\n"
-        f"• 📄 Документы: {docs_count}\n"
-        f"• 📁 Всего файлов: {total_count}\n\n"
-        
-        f"<b>🔄 Обмен файлами:</b>\n"
-        f"• 📤 Вы поделились: {len(shared_files)} файлами\n"
-        f"• 📥 Вы получили: {len(received_files)} файлов\n\n"
-        
-        f"<b>💻 Техническая информация:</b>\n"
-        f"• Разработан с использованием pyTelegramBotAPI\n"
-        f"• Имеет удобную категоризацию файлов\n"
-        f"• Поддерживает фото, видео и документы\n"
-        f"• Поддерживает обмен файлами\n"
-        f"• Скачивание всех файлов в ZIP-архиве\n"
-        f"• Максимальный размер файла: 50 МБ\n\n"
-        
-        f"<b>Используйте /help для получения справки по командам.</b>",
+        ABOUT_TEXT.format(
+            photos_count=photos_count,
+            videos_count=videos_count,
+            docs_count=docs_count,
+            total_count=total_count,
+            shared_count=len(shared_files),
+            received_count=len(received_files)
+        ),
         parse_mode="HTML",
-        reply_markup=markup
+        reply_markup=ABOUT_MARKUP
     )
 
-def show_files(message, page=0, edit=False, file_type=None):
-    """Показать список сохраненных файлов с пагинацией."""
-    # Получаем ID пользователя
-    user_id = message.from_user.id if hasattr(message, 'from_user') else message.chat.id
-    
-    # Получаем пользовательские папки
-    user_photos_folder, user_videos_folder, user_docs_folder, _ = get_user_folders(user_id)
+def build_file_listing(user_id, page=0, file_type=None):
+    """
+    Собрать страницу списка файлов пользователя.
     
-    # Получить список файлов
-    all_files = []
+    Returns:
+        Кортеж (текст, клавиатура, файлы страницы {ключ каталога: путь})
+    """
+    # Создаем папки пользователя, если их еще нет
+    get_user_folders(user_id)
     
     # Если указан конкретный тип файла
     if file_type == "photo":
-        all_files = get_file_list(user_photos_folder)  # Используем папку пользователя
         header = "🖼️ <b>Ваши фотографии</b>"
         empty_text = "В вашей папке не найдено фотографий."
     elif file_type == "video":
-        all_files = get_file_list(user_videos_folder)  # Используем папку пользователя
         header = "🎬 <b>Ваши видео</b>"
         empty_text = "В вашей папке не найдено видеофайлов."
     elif file_type == "document":
-        all_files = get_file_list(user_docs_folder)  # Используем папку пользователя
         header = "📄 <b>Ваши документы</b>"
         empty_text = "В вашей папке не найдено документов."
     else:
-        # Получаем все файлы из папок пользователя
-        for folder in [user_photos_folder, user_videos_folder, user_docs_folder]:
-            all_files.extend(get_file_list(folder))
+        file_type = None
         header = "📁 <b>Ваши сохраненные файлы</b>"
         empty_text = "В вашем хранилище не найдено файлов."
     
-    # Сортируем все файлы по дате изменения (новые сверху)
-    all_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
+    # Количество файлов и текущая страница берутся из каталога (сначала новые)
+    total_files = file_catalog.count_files(user_id, file_type)
     
-    if not all_files:
+    # Файлы текущей страницы по ключу каталога; снимок привязывается к сообщению со списком
+    page_files = {}
+    
+    if not total_files:
         text = empty_text
-        markup = types.InlineKeyboardMarkup()
-        markup.row(
-            types.InlineKeyboardButton("📷 Фото", callback_data="cmd:photos"),
-            types.InlineKeyboardButton("🎥 Видео", callback_data="cmd:videos"),
-            types.InlineKeyboardButton("📑 Документы", callback_data="cmd:documents")
-        )
+        markup = FILTER_MARKUP
     else:
         # Рассчитать пагинацию
-        total_pages = max(1, (len(all_files) + FILES_PER_PAGE - 1) // FILES_PER_PAGE)
+        total_pages = max(1, (total_files + FILES_PER_PAGE - 1) // FILES_PER_PAGE)
         
         # Проверка, что страница в допустимом диапазоне
         if page >= total_pages:
@@ -705,57 +618,46 @@ def show_files(message, page=0, edit=False, file_type=None):
             page = 0
             
         start_idx = page * FILES_PER_PAGE
-        end_idx = min(start_idx + FILES_PER_PAGE, len(all_files))
-        current_files = all_files[start_idx:end_idx]
+        end_idx = min(start_idx + FILES_PER_PAGE, total_files)
+        current_files = file_catalog.list_files(user_id, file_type, limit=FILES_PER_PAGE, offset=start_idx)
         
         # Создать сообщение и клавиатуру
-        text = f"{header} (Страница {page+1}/{total_pages})\n\nВсего файлов: {len(all_files)}"
+        text = f"{header} (Страница {page+1}/{total_pages})\n\nВсего файлов: {total_files}"
         
-        markup = types.InlineKeyboardMarkup(row_width=1)
+        rows = []
         for file in current_files:
-            current_type = get_file_type(file)
+            current_type = get_file_type(file["path"])
             icon = "🖼️" if current_type == "photo" else "🎬" if current_type == "video" else "📄"
-            display_name = os.path.basename(file)
+            display_name = file["name"]
             if len(display_name) > 30:
                 display_name = display_name[:27] + "..."
             
-            # Использовать более короткие идентификаторы для callback_data (Telegram имеет лимит 64 байта)
-            short_path = f"{all_files.index(file)}"
+            # Ключ файла в каталоге (base62) укладывается в лимит callback_data (64 байта)
+            short_path = file["key"]
+            page_files[short_path] = file["path"]
             
-            markup.add(
-                types.InlineKeyboardButton(f"{icon} {display_name}", callback_data=f"view:{short_path}")
-            )
-        
-        # Добавить кнопки фильтров
-        filter_buttons = []
-        filter_buttons.append(types.InlineKeyboardButton("📷 Фото", callback_data="cmd:photos"))
-        filter_buttons.append(types.InlineKeyboardButton("🎥 Видео", callback_data="cmd:videos"))
-        filter_buttons.append(types.InlineKeyboardButton("📑 Документы", callback_data="cmd:documents"))
-        markup.row(*filter_buttons)
-        
-        # Добавить кнопки навигации
-        nav_buttons = []
+            rows.append(ButtonRow((f"{icon} {display_name}", f"view:{short_path}")))
         
-        if page > 0:
-            nav_buttons.append(
-                types.InlineKeyboardButton("⬅️ Назад", callback_data=f"page:{page-1}:{file_type or 'all'}")
-            )
-            
-        if end_idx < len(all_files):
-            nav_buttons.append(
-                types.InlineKeyboardButton("Вперед ➡️", callback_data=f"page:{page+1}:{file_type or 'all'}")
-            )
-            
-        if nav_buttons:
-            markup.row(*nav_buttons)
+        # Добавить готовую строку фильтров и кэшированную строку навигации
+        rows.append(FILTER_ROW)
+        nav_row = paging_row(page, file_type, page > 0, end_idx < total_files)
+        if nav_row:
+            rows.append(nav_row)
+        markup = FrozenMarkup(*rows)
     
-    # Сохраняем список файлов в глобальную переменную для доступа по индексу
-    global file_list_cache
-    file_list_cache = all_files
+    return text, markup, page_files
+
+def show_files(message, page=0, edit=False, file_type=None):
+    """Показать список сохраненных файлов с пагинацией."""
+    # Получаем ID пользователя
+    user_id = message.from_user.id if hasattr(message, 'from_user') else message.chat.id
+    text, markup, page_files = build_file_listing(user_id, page, file_type)
     
     # Отправить или отредактировать сообщение
     try:
         if edit and hasattr(message, 'message'):
+            # Снимок сохраняем до редактирования, чтобы кнопки сразу разрешались
+            listing_cache.put(message.message.chat.id, message.message.message_id, page_files)
             bot.edit_message_text(
                 chat_id=message.message.chat.id,
                 message_id=message.message.message_id,
@@ -764,12 +666,13 @@ def show_files(message, page=0, edit=False, file_type=None):
                 parse_mode="HTML"
             )
         else:
-            bot.send_message(
+            sent_message = bot.send_message(
                 chat_id=message.chat.id,
                 text=text,
                 reply_markup=markup,
                 parse_mode="HTML"
             )
+            listing_cache.put(sent_message.chat.id, sent_message.message_id, page_files)
     except Exception as e:
         logger.error(f"Ошибка при отображении файлов: {e}")
         # Если ошибка связана с тем, что сообщение не изменилось
@@ -785,6 +688,25 @@ def show_files(message, page=0, edit=False, file_type=None):
             except:
                 pass
 
+def resolve_listed_file(call, file_key):
+    """
+    Получить путь к файлу по ключу из кнопки.
+    
+    Сначала ищем в снимке списка сообщения, затем в каталоге (после перезапуска
+    или вытеснения снимка). Файлы из каталога доступны только их владельцу.
+    
+    Returns:
+        Путь к файлу или None
+    """
+    file_path = listing_cache.resolve(call.message.chat.id, call.message.message_id, file_key)
+    if file_path:
+        return file_path
+    
+    record = file_catalog.get_file_by_key(file_key)
+    if record and record["user_id"] == str(call.from_user.id):
+        return record["path"]
+    return None
+
 def view_file(call, file_path):
     """Отправить файл пользователю для просмотра."""
     try:
@@ -851,47 +773,34 @@ def view_file(call, file_path):
         if share_id:
             markup.add(types.InlineKeyboardButton("📤 Получить ссылку для обмена", callback_data=f"view_share:{share_id}"))
         
-        # Добавляем кнопку удаления файла с использованием кэширования пути
-        file_id = str(hash(file_path))[:8]  # Используем только первые 8 символов хеша как идентификатор
-        file_path_cache[file_id] = file_path  # Сохраняем путь в кэше
-        markup.add(types.InlineKeyboardButton("🗑️ Удалить файл", callback_data=f"delete_file:{file_id}"))
+        # Добавляем кнопку удаления файла по ключу из каталога
+        record = file_catalog.get_file_by_path(file_path)
+        if record:
+            markup.add(types.InlineKeyboardButton("🗑️ Удалить файл", callback_data=f"delete_file:{record['key']}"))
         
-        # Сообщение о загрузке
-        loading_message = bot.edit_message_text(
+        # Сообщение о загрузке (не показывается, если файл отправится быстрее)
+        edit_coalescer.defer(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=f"⏳ <b>Загрузка файла...</b>\n\n📄 {file_name}\n📦 {file_size_str}",
             parse_mode="HTML"
         )
         
-        # Отправить файл в зависимости от типа
+        # Отправить файл в зависимости от типа (по сохраненному file_id, если он есть)
         if file_type == "photo":
-            with open(file_path, 'rb') as file:
-                sent_message = bot.send_photo(
-                    chat_id=call.message.chat.id,
-                    photo=file,
-                    caption=f"📷 <b>Фото:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}",
-                    reply_markup=markup,
-                    parse_mode="HTML"
-                )
+            caption = f"📷 <b>Фото:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}"
         elif file_type == "video":
-            with open(file_path, 'rb') as file:
-                sent_message = bot.send_video(
-                    chat_id=call.message.chat.id,
-                    video=file,
-                    caption=f"🎬 <b>Видео:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}",
-                    reply_markup=markup,
-                    parse_mode="HTML"
-                )
+            caption = f"🎬 <b>Видео:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}"
         else:
-            with open(file_path, 'rb') as file:
-                sent_message = bot.send_document(
-                    chat_id=call.message.chat.id,
-                    document=file,
-                    caption=f"📄 <b>Документ:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}",
-                    reply_markup=markup,
-                    parse_mode="HTML"
-                )
+            caption = f"📄 <b>Документ:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}"
+        sent_message = send_stored_file(
+            call.message.chat.id,
+            file_path,
+            file_type,
+            caption=caption,
+            reply_markup=markup,
+            parse_mode="HTML"
+        )
         
         # Получаем дату создания и изменения файла
         file_created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getctime(file_path)))
@@ -936,16 +845,13 @@ def view_file(call, file_path):
             except:
                 pass
 
-# Глобальная переменная для хранения списка файлов
-file_list_cache = []
-
 # Функции для обмена файлами
-def share_file(call, file_index):
+def share_file(call, file_key):
     """Поделиться файлом с другими пользователями."""
     try:
-        # Получаем файл из кэша
-        if 0 <= file_index < len(file_list_cache):
-            file_path = file_list_cache[file_index]
+        # Получаем файл по ключу из кнопки сообщения
+        file_path = resolve_listed_file(call, file_key)
+        if file_path:
             file_name = os.path.basename(file_path)
             file_type = get_file_type(file_path)
             
@@ -957,7 +863,8 @@ def share_file(call, file_index):
                 call.from_user.id,
                 file_path,
                 file_type,
-                file_name
+                file_name,
+                extend_ttl=True
             )
             
             if not share_id:
@@ -1338,9 +1245,10 @@ def show_received_files(call, page=0):
 def delete_file(call, file_id):
     """Удалить файл пользователя."""
     try:
-        # Получаем путь к файлу из кэша
-        if file_id in file_path_cache:
-            file_path = file_path_cache[file_id]
+        # Получаем путь к файлу из каталога по ключу
+        record = file_catalog.get_file_by_key(file_id)
+        if record:
+            file_path = record["path"]
         else:
             # Если идентификатор не найден в кэше
             text = "❌ <b>Файл не найден.</b>\n\nИнформация о файле устарела."
@@ -1399,15 +1307,8 @@ def delete_file(call, file_id):
         # Получаем ID пользователя
         user_id = call.from_user.id
         
-        # Получаем пользовательские папки
-        user_photos_folder, user_videos_folder, user_docs_folder, user_folder = get_user_folders(user_id)
-        
-        # Проверяем, принадлежит ли файл пользователю
-        is_user_file = False
-        
-        # Проверяем, находится ли файл в папке пользователя
-        if file_path.startswith(user_folder):
-            is_user_file = True
+        # Проверяем, принадлежит ли файл пользователю: владелец записан в каталоге
+        is_user_file = record["user_id"] == str(user_id)
         
         if not is_user_file:
             # Если файл не принадлежит пользователю, отказываем в удалении
@@ -1514,9 +1415,10 @@ def delete_file(call, file_id):
 def confirm_delete_file(call, file_id):
     """Подтвердить и выполнить удаление файла."""
     try:
-        # Получаем путь к файлу из кэша
-        if file_id in file_path_cache:
-            file_path = file_path_cache[file_id]
+        # Получаем путь к файлу из каталога по ключу
+        record = file_catalog.get_file_by_key(file_id)
+        if record:
+            file_path = record["path"]
         else:
             # Если идентификатор не найден в кэше
             text = "❌ <b>Файл не найден.</b>\n\nИнформация о файле устарела."
@@ -1578,15 +1480,8 @@ def confirm_delete_file(call, file_id):
         # Получаем ID пользователя
         user_id = call.from_user.id
         
-        # Получаем пользовательские папки
-        user_photos_folder, user_videos_folder, user_docs_folder, user_folder = get_user_folders(user_id)
-        
-        # Проверяем, принадлежит ли файл пользователю
-        is_user_file = False
-        
-        # Проверяем, находится ли файл в папке пользователя
-        if file_path.startswith(user_folder):
-            is_user_file = True
+        # Проверяем, принадлежит ли файл пользователю: владелец записан в каталоге
+        is_user_file = record["user_id"] == str(user_id)
         
         if not is_user_file:
             # Если файл не принадлежит пользователю, отказываем в удалении
@@ -1615,8 +1510,9 @@ def confirm_delete_file(call, file_id):
                     raise edit_error
             return
         
-        # Удаляем файл
-        os.remove(file_path)
+        # Удаляем файл и запись в каталоге; содержимое удаляется из хранилища,
+        # если на него больше не ссылается ни один файл
+        blob_store.remove_file(file_path)
         
         # Проверяем, был ли файл успешно удален
         success = not os.path.exists(file_path)
@@ -1691,11 +1587,166 @@ def confirm_delete_file(call, file_id):
             except:
                 pass
 
+def format_size(size):
+    """Размер в байтах в виде строки в МБ или КБ."""
+    size_mb = size / (1024 * 1024)
+    return f"{size_mb:.2f} МБ" if size_mb >= 1 else f"{(size / 1024):.2f} КБ"
+
+def format_duration(seconds):
+    """Длительность в секундах в виде строки "1 мин 20 с"."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} мин {seconds} с"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин"
+
+def send_archive_volume(call, document, archive_base_name, index, volume_count, archive_size,
+                        archived_count, type_name, icon, markup):
+    """
+    Отправить один том архива с обновлением сообщения о ходе отправки.
+    
+    Args:
+        call: Объект обратного вызова
+        document: Файловый объект тома или file_id Telegram
+        archive_base_name: Имя архива без номера тома и расширения
+        index: Номер тома (с нуля)
+        volume_count: Количество томов
+        archive_size: Размер тома в байтах
+        archived_count: Количество файлов во всех томах
+        type_name, icon: Название и иконка типа файлов
+        markup: Клавиатура, прикрепляемая к последнему тому
+        
+    Returns:
+        Отправленное сообщение
+    """
+    # Получаем размер архива
+    archive_size_str = format_size(archive_size)
+    
+    if volume_count > 1:
+        archive_name = f"{archive_base_name}_part{index + 1}of{volume_count}.zip"
+        volume_text = f"📚 <b>Том:</b> {index + 1} из {volume_count}\n"
+    else:
+        archive_name = f"{archive_base_name}.zip"
+        volume_text = ""
+    
+    # Отправляем сообщение о ходе отправки (отложенно: тома из кэша отправляются быстро)
+    try:
+        edit_coalescer.defer(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"✅ <b>Архив готов к скачиванию!</b>\n\n"
+                 f"{icon} <b>Тип файлов:</b> {type_name.capitalize()}\n"
+                 f"{volume_text}"
+                 f"📦 <b>Размер архива:</b> {archive_size_str}\n"
+                 f"🗃️ <b>Количество файлов:</b> {archived_count}\n\n"
+                 f"⏳ <b>Отправка архива...</b>",
+            parse_mode="HTML",
+            reply_markup=JOB_CANCEL_MARKUP
+        )
+    except Exception as edit_error:
+        # Если не удалось отредактировать, логируем ошибку и продолжаем
+        logger.error(f"Ошибка при обновлении сообщения: {edit_error}")
+    
+    # Отправляем архив как документ
+    return bot.send_document(
+        chat_id=call.message.chat.id,
+        document=document,
+        visible_file_name=archive_name if not isinstance(document, str) else None,
+        caption=f"🗃️ <b>Архив:</b> {archive_name}\n📦 <b>Размер:</b> {archive_size_str}\n📁 <b>Включает:</b> {type_name}",
+        parse_mode="HTML",
+        reply_markup=markup if index == volume_count - 1 else None
+    )
+
+def send_cached_archive_volume(call, cache_key, index, volume, archive_base_name, volume_count,
+                               archived_count, type_name, icon, markup):
+    """
+    Отправить том архива из кэша: по file_id Telegram или из файла кэша.
+    
+    Если Telegram отклоняет file_id, том загружается из файла, а новый
+    file_id сохраняется в кэше.
+    """
+    send_args = (archive_base_name, index, volume_count, volume["size"], archived_count, type_name, icon, markup)
+    
+    if volume.get("file_id"):
+        try:
+            return send_archive_volume(call, volume["file_id"], *send_args)
+        except ApiTelegramException as e:
+            if e.error_code != 400 or not volume["path"]:
+                archive_cache.invalidate(cache_key)
+                raise
+            logger.warning(f"Telegram отклонил file_id тома {index} архива {cache_key}: {e}")
+    
+    try:
+        with open(volume["path"], 'rb') as archive_file:
+            sent_message = send_archive_volume(call, archive_file, *send_args)
+    except OSError:
+        archive_cache.invalidate(cache_key)
+        raise
+    
+    file_id = get_sent_file_id(sent_message, "document")
+    if file_id:
+        archive_cache.set_file_id(cache_key, index, file_id)
+    return sent_message
+
 def download_zip_archive(call, file_type="all"):
     """
-    Создать и отправить ZIP-архив с файлами пользователя.
+    Поставить создание и отправку ZIP-архива в очередь фоновых заданий.
+    
+    Архив собирается в потоке заданий (run_zip_archive_job), поэтому
+    обработчик кнопки сразу освобождается для других запросов.
+    
+    Args:
+        call: Объект обратного вызова
+        file_type: Тип файлов для архивации ("all", "photos", "videos", "documents")
+    """
+    user_id = call.from_user.id
+    
+    # Сообщение обновляется до постановки в очередь: сообщение запущенного задания
+    # заменяет отложенное, поэтому быстро начатое задание не показывает состояние очереди
+    try:
+        edit_coalescer.defer(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="⏳ <b>Архив поставлен в очередь...</b>\n\nСоздание начнется в ближайшее время.",
+            parse_mode="HTML",
+            reply_markup=JOB_CANCEL_MARKUP
+        )
+    except Exception as edit_error:
+        logger.error(f"Ошибка при обновлении сообщения: {edit_error}")
+    
+    try:
+        job_manager.submit(user_id, run_zip_archive_job, call, file_type, description=f"zip_{file_type}")
+    except JobRejected as e:
+        if e.reason == JobRejected.USER_LIMIT:
+            text = ("⏳ <b>Архив уже создается.</b>\n\n"
+                    "Дождитесь завершения текущей архивации или отмените ее.")
+            markup = JOB_CANCEL_MENU_MARKUP
+        else:
+            text = "⚠️ <b>Сейчас создается слишком много архивов.</b>\n\nПопробуйте снова через несколько минут."
+            markup = MENU_MARKUP
+        try:
+            bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=text,
+                parse_mode="HTML",
+                reply_markup=markup
+            )
+        except Exception as edit_error:
+            logger.error(f"Ошибка при обновлении сообщения: {edit_error}")
+
+def run_zip_archive_job(job, call, file_type="all"):
+    """
+    Создать и отправить ZIP-архив с файлами пользователя (фоновое задание).
+    
+    Ход сборки (файлы, объем, оставшееся время) показывается в сообщении
+    с кнопкой отмены не чаще JOB_PROGRESS_INTERVAL секунд.
     
     Args:
+        job: Объект фонового задания
         call: Объект обратного вызова
         file_type: Тип файлов для архивации ("all", "photos", "videos", "documents")
     """
@@ -1703,30 +1754,27 @@ def download_zip_archive(call, file_type="all"):
         # Получаем ID пользователя
         user_id = call.from_user.id
         
-        # Получаем папки пользователя
-        user_photos_folder, user_videos_folder, user_docs_folder, user_folder = get_user_folders(user_id)
-        
         # Определяем, какие файлы нужно архивировать
         if file_type == "photos":
-            files = get_file_list(user_photos_folder)
+            catalog_type = "photo"
             type_name = "фотографии"
             icon = "🖼️"
         elif file_type == "videos":
-            files = get_file_list(user_videos_folder)
+            catalog_type = "video"
             type_name = "видео"
             icon = "🎬"
         elif file_type == "documents":
-            files = get_file_list(user_docs_folder)
+            catalog_type = "document"
             type_name = "документы"
             icon = "📄"
         else:  # all
-            files = []
-            files.extend(get_file_list(user_photos_folder))
-            files.extend(get_file_list(user_videos_folder))
-            files.extend(get_file_list(user_docs_folder))
+            catalog_type = None
             type_name = "все файлы"
             icon = "📁"
         
+        # Получаем список файлов из каталога пользователя
+        files = file_catalog.list_files(user_id, catalog_type)
+        
         # Проверяем, есть ли файлы для архивации
         if not files:
             markup = types.InlineKeyboardMarkup()
@@ -1759,7 +1807,8 @@ def download_zip_archive(call, file_type="all"):
                 chat_id=call.message.chat.id,
                 message_id=call.message.message_id,
                 text=f"⏳ <b>Создание архива...</b>\n\nПожалуйста, подождите. Архивируем {len(files)} файлов.",
-                parse_mode="HTML"
+                parse_mode="HTML",
+                reply_markup=JOB_CANCEL_MARKUP
             )
         except Exception as edit_error:
             # Если не удалось отредактировать, отправляем новое
@@ -1767,35 +1816,24 @@ def download_zip_archive(call, file_type="all"):
                 status_message = bot.send_message(
                     chat_id=call.message.chat.id,
                     text=f"⏳ <b>Создание архива...</b>\n\nПожалуйста, подождите. Архивируем {len(files)} файлов.",
-                    parse_mode="HTML"
+                    parse_mode="HTML",
+                    reply_markup=JOB_CANCEL_MARKUP
                 )
                 call.message.message_id = status_message.message_id
             else:
                 raise edit_error
         
-        # Создаем архив
-        archive_path = create_zip_archive(files, user_id, file_type)
-        
-        if not archive_path:
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu"))
-            
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"❌ <b>Ошибка при создании архива.</b>\n\nПожалуйста, попробуйте позже.",
-                parse_mode="HTML",
-                reply_markup=markup
+        # Разбиваем файлы на тома, каждый из которых помещается в ограничение Telegram
+        volumes, oversized = plan_volumes(files)
+        archived_count = len(files) - len(oversized)
+        oversized_text = ""
+        if oversized:
+            oversized_text = (
+                f"\n\n⚠️ <b>Пропущено файлов больше 50 МБ:</b> {len(oversized)}"
             )
-            return
-        
-        # Получаем размер архива
-        archive_size = os.path.getsize(archive_path)
-        archive_size_mb = archive_size / (1024 * 1024)
-        archive_size_str = f"{archive_size_mb:.2f} МБ" if archive_size_mb >= 1 else f"{(archive_size / 1024):.2f} КБ"
         
         # Формируем имя архива
-        archive_name = os.path.basename(archive_path)
+        archive_base_name = f"user_{user_id}_{file_type}_{int(time.time())}"
         
         # Создаем клавиатуру с кнопками
         markup = types.InlineKeyboardMarkup(row_width=1)
@@ -1804,31 +1842,82 @@ def download_zip_archive(call, file_type="all"):
             types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
         )
         
-        # Отправляем сообщение о готовности архива
-        try:
+        if not volumes:
             bot.edit_message_text(
                 chat_id=call.message.chat.id,
                 message_id=call.message.message_id,
-                text=f"✅ <b>Архив готов к скачиванию!</b>\n\n"
-                     f"{icon} <b>Тип файлов:</b> {type_name.capitalize()}\n"
-                     f"📦 <b>Размер архива:</b> {archive_size_str}\n"
-                     f"🗃️ <b>Количество файлов:</b> {len(files)}\n\n"
-                     f"⏳ <b>Отправка архива...</b>",
-                parse_mode="HTML"
-            )
-        except Exception as edit_error:
-            # Если не удалось отредактировать, логируем ошибку и продолжаем
-            logger.error(f"Ошибка при обновлении сообщения: {edit_error}")
-        
-        # Отправляем архив как документ
-        with open(archive_path, 'rb') as archive_file:
-            bot.send_document(
-                chat_id=call.message.chat.id,
-                document=archive_file,
-                caption=f"🗃️ <b>Архив:</b> {archive_name}\n📦 <b>Размер:</b> {archive_size_str}\n📁 <b>Включает:</b> {type_name}",
+                text=f"❌ <b>Архив не создан.</b>\n\nВсе файлы в выбранной категории больше 50 МБ "
+                     f"и не могут быть отправлены через Telegram Bot API.",
                 parse_mode="HTML",
                 reply_markup=markup
             )
+            return
+        
+        # Ключ архива: пока файлы не менялись, тома берутся из кэша
+        cache_key = archive_cache.manifest_key(user_id, file_type, files)
+        cached_archive = archive_cache.get(cache_key)
+        
+        total_size = 0
+        if cached_archive:
+            logger.info(f"Архив {cache_key} для пользователя {user_id} взят из кэша")
+            volume_count = len(cached_archive["volumes"])
+            for index, volume in enumerate(cached_archive["volumes"]):
+                job.check_cancelled()
+                total_size += volume["size"]
+                send_cached_archive_volume(
+                    call, cache_key, index, volume, archive_base_name, volume_count,
+                    archived_count, type_name, icon, markup
+                )
+        else:
+            def show_progress(job, progress):
+                eta_text = ""
+                if progress["eta"] is not None:
+                    eta_text = f"⏱️ <b>Осталось примерно:</b> {format_duration(progress['eta'])}\n"
+                bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text=f"⏳ <b>Создание архива...</b>\n\n"
+                         f"{icon} <b>Тип файлов:</b> {type_name.capitalize()}\n"
+                         f"🗃️ <b>Файлов:</b> {progress['files_done']} из {progress['files_total']}\n"
+                         f"📦 <b>Обработано:</b> {format_size(progress['bytes_done'])} "
+                         f"из {format_size(progress['bytes_total'])}\n"
+                         f"{eta_text}",
+                    parse_mode="HTML",
+                    reply_markup=JOB_CANCEL_MARKUP
+                )
+            
+            archived_paths = {path for volume in volumes for path in volume}
+            job.set_totals(archived_count, sum(file["size"] for file in files if file["path"] in archived_paths))
+            job.on_progress = show_progress
+            
+            # Тома собираются в фоне: первый отправляется, пока следующие еще архивируются
+            volume_count = len(volumes)
+            built_volumes = []
+            try:
+                with VolumeBuilder(volumes, progress=lambda size: job.advance(1, size)) as builder:
+                    for index, archive_file, archive_size, count in builder:
+                        job.check_cancelled()
+                        total_size += archive_size
+                        archive_cache.store_volume(cache_key, index, archive_file)
+                        sent_message = send_archive_volume(
+                            call, archive_file, archive_base_name, index, volume_count, archive_size,
+                            archived_count, type_name, icon, markup
+                        )
+                        built_volumes.append({
+                            "size": archive_size,
+                            "count": count,
+                            "file_id": get_sent_file_id(sent_message, "document")
+                        })
+            except BaseException:
+                # Недостроенный архив не должен оставаться в кэше
+                job.on_progress = None
+                archive_cache.invalidate(cache_key)
+                raise
+            job.on_progress = None
+            archive_cache.commit(cache_key, built_volumes)
+        
+        total_size_str = format_size(total_size)
+        volumes_text = f"📚 <b>Томов:</b> {volume_count}\n" if volume_count > 1 else ""
         
         # Обновляем сообщение с информацией
         try:
@@ -1837,25 +1926,31 @@ def download_zip_archive(call, file_type="all"):
                 message_id=call.message.message_id,
                 text=f"✅ <b>Архив успешно отправлен!</b>\n\n"
                      f"{icon} <b>Тип файлов:</b> {type_name.capitalize()}\n"
-                     f"📦 <b>Размер архива:</b> {archive_size_str}\n"
-                     f"🗃️ <b>Количество файлов:</b> {len(files)}\n\n"
-                     f"Архив с вашими файлами был успешно создан и отправлен.",
+                     f"{volumes_text}"
+                     f"📦 <b>Размер архива:</b> {total_size_str}\n"
+                     f"🗃️ <b>Количество файлов:</b> {archived_count}\n\n"
+                     f"Архив с вашими файлами был успешно создан и отправлен.{oversized_text}",
                 parse_mode="HTML",
                 reply_markup=markup
             )
         except Exception as edit_error:
             logger.error(f"Ошибка при обновлении сообщения об успешной отправке: {edit_error}")
-        
-        # Удаляем временный архив
-        try:
-            os.remove(archive_path)
-            # Удаляем временную директорию
-            temp_dir = os.path.dirname(archive_path)
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-        except Exception as e:
-            logger.error(f"Ошибка при удалении временного архива {archive_path}: {e}")
             
+    except JobCancelled:
+        logger.info(f"Архивация для пользователя {call.from_user.id} отменена")
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu"))
+        try:
+            bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text="⏹ <b>Архивация отменена.</b>",
+                parse_mode="HTML",
+                reply_markup=markup
+            )
+        except Exception as edit_error:
+            logger.error(f"Ошибка при обновлении сообщения: {edit_error}")
+        raise
     except Exception as e:
         logger.error(f"Ошибка при создании архива: {e}")
         markup = types.InlineKeyboardMarkup()
@@ -1953,457 +2048,338 @@ def delete_shared_file(call, share_id):
                 logger.error(f"Не удалось отправить сообщение об ошибке: {str(e)}")
                 pass
 
-@bot.callback_query_handler(func=lambda call: True)
-def button_handler(call):
-    """Обработать нажатия кнопок."""
-    try:
-        # Показать всплывающее уведомление о загрузке (ловим ошибку, если запрос устарел)
-        try:
-            bot.answer_callback_query(call.id)
-        except Exception as e:
-            # Игнорируем ошибки устаревших запросов
-            if "query is too old" in str(e) or "query ID is invalid" in str(e):
-                logger.warning(f"Устаревший запрос: {str(e)}")
-            else:
-                # Логируем другие ошибки
-                logger.error(f"Ошибка ответа на callback: {str(e)}")
-        
-        data = call.data
-        
-        # Обработать команды через кнопки
-        if data.startswith("cmd:"):
-            # Выполнение команды из кнопки
-            cmd = data.split(":")[1]
-            
-            if cmd == "menu":
-                # Показать главное меню (перерисовать текущее сообщение)
-                # Создаем разметку с кнопками главного меню
-                markup = types.InlineKeyboardMarkup(row_width=2)
-                
-                # Кнопки для разных типов файлов
-                btn_photos = types.InlineKeyboardButton("🖼️ Фотографии", callback_data="cmd:photos")
-                btn_videos = types.InlineKeyboardButton("🎬 Видеофайлы", callback_data="cmd:videos")
-                btn_docs = types.InlineKeyboardButton("📄 Документы", callback_data="cmd:documents")
-                btn_all_files = types.InlineKeyboardButton("📁 Все файлы", callback_data="files")
-                
-                # Кнопка скачивания архива
-                btn_download_zip = types.InlineKeyboardButton("🗃️ Скачать ZIP-архив", callback_data="cmd:download_zip")
-                
-                # Кнопки функций
-                btn_help = types.InlineKeyboardButton("❓ Помощь", callback_data="cmd:help")
-                btn_info = types.InlineKeyboardButton("ℹ️ О боте", callback_data="cmd:about")
-                
-                # Добавляем кнопки в разметку
-                markup.add(btn_photos, btn_videos)
-                markup.add(btn_docs, btn_all_files)
-                markup.add(btn_download_zip)
-                markup.add(btn_help, btn_info)
-                
-                # Информационный баннер с инструкцией
-                upload_banner = "📤 Отправьте мне файл, чтобы сохранить его!"
-                
-                # Обновляем сообщение с кнопками
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text=f"👋 <b>Главное меню</b>\n\n"
-                    f"🤖 Я <b>File Storage Bot</b> - ваш помощник для хранения и организации файлов.\n\n"
-                    f"📌 <b>Основные возможности:</b>\n"
-                    f"• Сохранение фото, видео и документов\n"
-                    f"• Удобная организация по категориям\n"
-                    f"• Простой поиск и просмотр\n\n"
-                    f"{upload_banner}",
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-            
-            elif cmd == "help":
-                # Переиспользуем функцию help, но с редактированием текущего сообщения
-                # Создаем разметку с кнопками
-                markup = types.InlineKeyboardMarkup(row_width=2)
-                
-                # Кнопки разделов файлов
-                btn_photos = types.InlineKeyboardButton("🖼️ Просмотр фото", callback_data="cmd:photos")
-                btn_videos = types.InlineKeyboardButton("🎬 Просмотр видео", callback_data="cmd:videos")
-                btn_docs = types.InlineKeyboardButton("📄 Просмотр документов", callback_data="cmd:documents")
-                btn_all = types.InlineKeyboardButton("📁 Все файлы", callback_data="files")
-                
-                # Кнопки обмена файлами
-                btn_shared = types.InlineKeyboardButton("📤 Мои общие файлы", callback_data="cmd:myshared")
-                btn_received = types.InlineKeyboardButton("📥 Полученные файлы", callback_data="cmd:received")
-                
-                # Кнопка возврата в главное меню
-                btn_menu = types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-                
-                # Формируем разметку кнопок
-                markup.add(btn_photos, btn_videos)
-                markup.add(btn_docs, btn_all)
-                markup.add(btn_shared, btn_received)
-                markup.add(btn_menu)
-                
-                # Обновляем сообщение помощи
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="<b>📚 Справка по использованию бота</b>\n\n"
-                    "<b>📋 Доступные команды:</b>\n"
-                    "• /start - Запустить бота и показать главное меню\n"
-                    "• /help - Показать эту справку\n"
-                    "• /files - Показать все сохраненные файлы\n"
-                    "• /photos - Показать только фотографии\n"
-                    "• /videos - Показать только видеофайлы\n"
-                    "• /documents - Показать только документы\n"
-                    "• /share_ID - Получить доступ к общему файлу\n\n"
-                    
-                    "<b>💾 Как сохранить файл:</b>\n"
-                    "Просто отправьте мне фото, видео или документ, и я автоматически сохраню его в соответствующей категории.\n\n"
-                    
-                    "<b>🔍 Как найти файлы:</b>\n"
-                    "Используйте кнопки ниже для просмотра файлов по категориям. При просмотре доступны кнопки навигации и фильтрации.\n\n"
-                    
-                    "<b>📤 Обмен файлами:</b>\n"
-                    "1. Откройте файл через меню просмотра файлов\n"
-                    "2. Нажмите кнопку \"Поделиться файлом\"\n"
-                    "3. Отправьте полученную команду другому пользователю\n"
-                    "4. Пользователь может получить доступ к файлу, отправив эту команду боту\n\n"
-                    
-                    "<b>✨ Дополнительные возможности:</b>\n"
-                    "• Просмотр подробной информации о файле\n"
-                    "• Удобная навигация между категориями\n"
-                    "• Обмен файлами между пользователями\n"
-                    "• Управление своими общими файлами",
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-            
-            elif cmd == "about":
-                # Переиспользуем функцию about, но с редактированием сообщения
-                # Создаем клавиатуру с кнопками
-                markup = types.InlineKeyboardMarkup(row_width=1)
-                
-                # Добавляем кнопки
-                markup.add(
-                    types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu"),
-                    types.InlineKeyboardButton("📚 Справка", callback_data="cmd:help")
-                )
-                
-                # Получаем статистику
-                photos_count = len(get_file_list(PHOTOS_FOLDER))
-                videos_count = len(get_file_list(VIDEOS_FOLDER))
-                docs_count = len(get_file_list(DOCS_FOLDER))
-                total_count = photos_count + videos_count + docs_count
-                
-                # Обновляем сообщение с информацией о боте
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text=f"<b>🤖 File Storage Bot v1.0</b>\n\n"
-                    f"<b>О боте:</b>\n"
-                    f"Бот для хранения и организации файлов в удобном формате.\n\n"
-                    
-                    f"<b>📊 Статистика файлов:</b>\n"
-                    f"• 🖼️ Фотографии: {photos_count}\n"
-                    f"• 🎬 Видеофайлы: {videos_count}\n"
-                    f"• 📄 Документы: {docs_count}\n"
-                    f"• 📁 Всего файлов: {total_count}\n\n"
-                    
-                    f"<b>💻 Техническая информация:</b>\n"
-                    f"• Разработан с использованием pyTelegramBotAPI\n"
-                    f"• Имеет удобную категоризацию файлов\n"
-                    f"• Поддерживает фото, видео и документы\n"
-                    f"• Максимальный размер файла: 50 МБ\n\n"
-                    
-                    f"<b>Используйте /help для получения справки по командам.</b>",
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-            
-            elif cmd == "photos":
-                # Показать только фотографии
-                show_files(call, 0, edit=True, file_type="photo")
-            
-            elif cmd == "videos":
-                # Показать только видео
-                show_files(call, 0, edit=True, file_type="video")
-            
-            elif cmd == "documents":
-                # Показать только документы
-                show_files(call, 0, edit=True, file_type="document")
-            
-            elif cmd == "myshared":
-                # Показать мои общие файлы
-                show_shared_files(call)
-            
-            elif cmd == "received":
-                # Показать полученные файлы
-                show_received_files(call)
-            
-            elif cmd == "download_zip":
-                # Показываем меню выбора типа архива
-                markup = types.InlineKeyboardMarkup(row_width=2)
-                
-                # Кнопки выбора типа архива
-                markup.add(
-                    types.InlineKeyboardButton("📁 Все файлы", callback_data="cmd:zip_all"),
-                    types.InlineKeyboardButton("🖼️ Только фото", callback_data="cmd:zip_photos"),
-                    types.InlineKeyboardButton("🎬 Только видео", callback_data="cmd:zip_videos"),
-                    types.InlineKeyboardButton("📄 Только документы", callback_data="cmd:zip_docs"),
-                    types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-                )
-                
-                # Обновляем сообщение с выбором типа архива
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="<b>🗃️ Скачать ZIP-архив</b>\n\n"
-                    "Выберите, какие файлы вы хотите включить в архив:\n\n"
-                    "• <b>Все файлы</b> - ZIP-архив со всеми вашими файлами\n"
-                    "• <b>Только фото</b> - архив только с фотографиями\n"
-                    "• <b>Только видео</b> - архив только с видеофайлами\n"
-                    "• <b>Только документы</b> - архив только с документами\n\n"
-                    "⚠️ <b>Внимание:</b> В зависимости от размера и количества файлов, создание архива может занять некоторое время.",
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-            
-            elif cmd.startswith("zip_"):
-                # Определяем тип файлов для архивации
-                archive_type = cmd.split("_")[1]
-                
-                # Вызываем функцию создания и отправки архива
-                if archive_type == "all":
-                    download_zip_archive(call, "all")
-                elif archive_type == "photos":
-                    download_zip_archive(call, "photos")
-                elif archive_type == "videos":
-                    download_zip_archive(call, "videos")
-                elif archive_type == "docs":
-                    download_zip_archive(call, "documents")
-            
-            elif cmd == "share":
-                # Поделиться файлом
-                # Формат: share:file_index
-                try:
-                    file_index = int(call.data.split(":")[2])
-                    if 0 <= file_index < len(file_list_cache):
-                        share_file(call, file_index)
-                    else:
-                        bot.edit_message_text(
-                            chat_id=call.message.chat.id,
-                            message_id=call.message.message_id,
-                            text="❌ <b>Файл не найден.</b> Возможно, список файлов изменился.",
-                            parse_mode="HTML"
-                        )
-                except (ValueError, IndexError) as e:
-                    logger.error(f"Ошибка при обмене файлом: {e}")
-                    bot.edit_message_text(
-                        chat_id=call.message.chat.id,
-                        message_id=call.message.message_id,
-                        text="❌ <b>Ошибка при обмене файлом.</b> Пожалуйста, попробуйте снова.",
-                        parse_mode="HTML"
-                    )
-            
-            elif cmd == "delete_share":
-                # Удалить общий доступ к файлу
-                # Формат: delete_share:share_id
-                try:
-                    share_id = call.data.split(":")[2]
-                    delete_shared_file(call, share_id)
-                except (ValueError, IndexError) as e:
-                    logger.error(f"Ошибка при удалении общего доступа: {e}")
-                    bot.edit_message_text(
-                        chat_id=call.message.chat.id,
-                        message_id=call.message.message_id,
-                        text="❌ <b>Ошибка при удалении общего доступа.</b> Пожалуйста, попробуйте снова.",
-                        parse_mode="HTML"
-                    )
-            
-            else:
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text=f"⚠️ Неизвестная команда: {cmd}"
-                )
-        
-        # Обработать кнопку показа всех файлов
-        elif data == "files":
-            show_files(call, 0, edit=True)
-        
-        # Обработать кнопки пагинации для файлов
-        elif data.startswith("page:"):
-            # Формат: page:номер_страницы:тип_файла
-            parts = data.split(":")
-            page = int(parts[1])
-            file_type = parts[2] if len(parts) > 2 else None
-            
-            # Если тип файла 'all', значит нужно показать все файлы
-            if file_type == 'all':
-                file_type = None
-                
-            show_files(call, page, edit=True, file_type=file_type)
-            
-        # Обработать кнопки пагинации для общих файлов
-        elif data.startswith("shared_page:"):
-            # Формат: shared_page:номер_страницы
-            page = int(data.split(":")[1])
-            show_shared_files(call, page)
-            
-        # Обработать кнопки пагинации для полученных файлов
-        elif data.startswith("received_page:"):
-            # Формат: received_page:номер_страницы
-            page = int(data.split(":")[1])
-            show_received_files(call, page)
-            
-        # Обработать доступ к общему файлу
-        elif data.startswith("access_share:"):
-            # Формат: access_share:share_id
-            share_id = data.split(":")[1]
-            # Импортируем хранилище пользователей
-            from user_storage import user_storage
-            
-            # Получаем доступ к файлу
-            file_info = user_storage.access_shared_file(share_id, call.from_user.id)
-            
-            if file_info:
-                # Отправляем файл пользователю
-                view_file(call, file_info["file_path"])
-            else:
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="❌ <b>Ошибка доступа к файлу.</b>\n\nВозможно, ссылка устарела или файл был удален.",
-                    parse_mode="HTML",
-                    reply_markup=types.InlineKeyboardMarkup().add(
-                        types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-                    )
-                )
-        
-        # Обработать команды просмотра файла
-        elif data.startswith("view:"):
-            # Получаем индекс файла
-            try:
-                file_index = int(data.split(":")[1])
-                # Проверяем, что индекс валидный
-                if 0 <= file_index < len(file_list_cache):
-                    file_path = file_list_cache[file_index]
-                    view_file(call, file_path)
-                else:
-                    bot.edit_message_text(
-                        chat_id=call.message.chat.id,
-                        message_id=call.message.message_id,
-                        text="❌ <b>Файл не найден.</b> Возможно, список файлов изменился.",
-                        parse_mode="HTML"
-                    )
-            except (ValueError, IndexError) as e:
-                logger.error(f"Ошибка при получении файла по индексу: {e}")
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="❌ <b>Произошла ошибка при выборе файла.</b>",
-                    parse_mode="HTML"
-                )
-        
-        # Обработать команду удаления файла
-        elif data.startswith("delete_file:"):
-            # Получаем id файла, который нужно удалить
-            file_id = data[len("delete_file:"):]
-            delete_file(call, file_id)
-            
-        # Обработать подтверждение удаления файла
-        elif data.startswith("confirm_delete:"):
-            # Получаем id файла, который нужно удалить
-            file_id = data[len("confirm_delete:"):]
-            confirm_delete_file(call, file_id)
-            
-        # Обработать отмену удаления файла
-        elif data == "cancel_delete":
-            markup = types.InlineKeyboardMarkup()
-            markup.add(
-                types.InlineKeyboardButton("📁 Мои файлы", callback_data="files"),
-                types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-            )
-            try:
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="❌ <b>Удаление отменено.</b>\n\nФайл не был удален.",
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-            except Exception as edit_error:
-                # Если не удалось отредактировать, отправляем новое
-                if "there is no text in the message to edit" in str(edit_error).lower():
-                    bot.send_message(
-                        chat_id=call.message.chat.id,
-                        text="❌ <b>Удаление отменено.</b>\n\nФайл не был удален.",
-                        parse_mode="HTML",
-                        reply_markup=markup
-                    )
-                else:
-                    raise edit_error
-            
-        elif data.startswith("view_share:"):
-            # Получаем ID общего файла
-            share_id = data.split(":")[1]
-            # Отправляем новое сообщение со ссылкой для обмена
-            from user_storage import user_storage
-            
-            # Получаем информацию о файле
-            share_info = user_storage.get_shared_file(share_id)
-            if not share_info:
-                bot.send_message(
-                    chat_id=call.message.chat.id,
-                    text="❌ <b>Ошибка получения информации о файле.</b>\n\nВозможно, срок действия ссылки истек.",
-                    parse_mode="HTML"
-                )
-                return
-            
-            file_name = share_info["file_name"]
-            file_type = share_info["file_type"]
-            
-            # Создаем команду для быстрого доступа к файлу
-            share_command = f"/share_{share_id}"
-            
-            # Создаем клавиатуру с кнопками
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            markup.add(
-                types.InlineKeyboardButton("📤 Мои общие файлы", callback_data="cmd:myshared"),
+# Таблица маршрутов для нажатий inline-кнопок
+callback_router = CallbackRouter()
+
+@callback_router.route("cmd:menu")
+def menu_callback(call):
+    """Показать главное меню (перерисовать текущее сообщение)."""
+    # Обновляем сообщение с кнопками
+    bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=MAIN_MENU_TEXT,
+        parse_mode="HTML",
+        reply_markup=MAIN_MENU_COMPACT_MARKUP
+    )
+
+@callback_router.route("cmd:help")
+def help_callback(call):
+    """Показать справку в текущем сообщении."""
+    # Обновляем сообщение помощи
+    bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=HELP_COMPACT_TEXT,
+        parse_mode="HTML",
+        reply_markup=HELP_COMPACT_MARKUP
+    )
+
+@callback_router.route("cmd:about")
+def about_callback(call):
+    """Показать информацию о боте в текущем сообщении."""
+    # Получаем статистику
+    photos_count = len(get_file_list(PHOTOS_FOLDER))
+    videos_count = len(get_file_list(VIDEOS_FOLDER))
+    docs_count = len(get_file_list(DOCS_FOLDER))
+    total_count = photos_count + videos_count + docs_count
+    
+    # Обновляем сообщение с информацией о боте
+    bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=ABOUT_COMPACT_TEXT.format(
+            photos_count=photos_count,
+            videos_count=videos_count,
+            docs_count=docs_count,
+            total_count=total_count
+        ),
+        parse_mode="HTML",
+        reply_markup=ABOUT_MARKUP
+    )
+
+# Списки файлов по категориям, общие и полученные файлы
+callback_router.add("cmd:photos", lambda call: show_files(call, 0, edit=True, file_type="photo"))
+callback_router.add("cmd:videos", lambda call: show_files(call, 0, edit=True, file_type="video"))
+callback_router.add("cmd:documents", lambda call: show_files(call, 0, edit=True, file_type="document"))
+callback_router.add("cmd:myshared", lambda call: show_shared_files(call))
+callback_router.add("cmd:received", lambda call: show_received_files(call))
+
+@callback_router.route("cmd:download_zip")
+def download_zip_menu_callback(call):
+    """Показать меню выбора типа архива."""
+    # Обновляем сообщение с выбором типа архива
+    bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=DOWNLOAD_ZIP_TEXT,
+        parse_mode="HTML",
+        reply_markup=DOWNLOAD_ZIP_MARKUP
+    )
+
+@callback_router.route("cmd:cancel_job")
+def cancel_job_callback(call):
+    """Отменить фоновые задания пользователя (архивацию)."""
+    # Выполняющееся задание само сообщит об отмене, когда остановится,
+    # поэтому промежуточное сообщение показываем до отмены
+    if any(job.state == "running" for job in job_manager.active_jobs(call.from_user.id)):
+        edit_coalescer.defer(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="⏳ <b>Отмена архивации...</b>",
+            parse_mode="HTML"
+        )
+    
+    cancelled = job_manager.cancel_user_jobs(call.from_user.id)
+    if not cancelled or all(state == "queued" for _, state in cancelled):
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu"))
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="⏹ <b>Архивация отменена.</b>" if cancelled else "ℹ️ <b>Нет активных архиваций.</b>",
+            parse_mode="HTML",
+            reply_markup=markup
+        )
+
+# Создание и отправка архива выбранного типа
+callback_router.add("cmd:zip_all", lambda call: download_zip_archive(call, "all"))
+callback_router.add("cmd:zip_photos", lambda call: download_zip_archive(call, "photos"))
+callback_router.add("cmd:zip_videos", lambda call: download_zip_archive(call, "videos"))
+callback_router.add("cmd:zip_docs", lambda call: download_zip_archive(call, "documents"))
+
+@callback_router.route("cmd:share")
+def share_callback(call, file_key=None):
+    """Поделиться файлом. Формат: cmd:share:file_key"""
+    if file_key is None:
+        logger.error(f"Ошибка при обмене файлом: нет ключа файла в {call.data!r}")
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Ошибка при обмене файлом.</b> Пожалуйста, попробуйте снова.",
+            parse_mode="HTML"
+        )
+    elif resolve_listed_file(call, file_key):
+        share_file(call, file_key)
+    else:
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Файл не найден.</b> Возможно, список файлов изменился.",
+            parse_mode="HTML"
+        )
+
+@callback_router.route("cmd:delete_share")
+def delete_share_callback(call, share_id=None):
+    """Удалить общий доступ к файлу. Формат: cmd:delete_share:share_id"""
+    if share_id is None:
+        logger.error(f"Ошибка при удалении общего доступа: нет ID публикации в {call.data!r}")
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Ошибка при удалении общего доступа.</b> Пожалуйста, попробуйте снова.",
+            parse_mode="HTML"
+        )
+    else:
+        delete_shared_file(call, share_id)
+
+@callback_router.route("files")
+def files_callback(call):
+    """Показать все файлы."""
+    show_files(call, 0, edit=True)
+
+@callback_router.route("page")
+def page_callback(call, page, file_type=None):
+    """Страница списка файлов. Формат: page:номер_страницы:тип_файла"""
+    # Если тип файла 'all', значит нужно показать все файлы
+    if file_type == 'all':
+        file_type = None
+    show_files(call, int(page), edit=True, file_type=file_type)
+
+@callback_router.route("shared_page")
+def shared_page_callback(call, page):
+    """Страница общих файлов. Формат: shared_page:номер_страницы"""
+    show_shared_files(call, int(page))
+
+@callback_router.route("received_page")
+def received_page_callback(call, page):
+    """Страница полученных файлов. Формат: received_page:номер_страницы"""
+    show_received_files(call, int(page))
+
+@callback_router.route("access_share")
+def access_share_callback(call, share_id):
+    """Открыть общий файл. Формат: access_share:share_id"""
+    # Импортируем хранилище пользователей
+    from user_storage import user_storage
+    
+    # Получаем доступ к файлу
+    file_info = user_storage.access_shared_file(share_id, call.from_user.id)
+    
+    if file_info:
+        # Отправляем файл пользователю
+        view_file(call, file_info["file_path"])
+    else:
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Ошибка доступа к файлу.</b>\n\nВозможно, ссылка устарела или файл был удален.",
+            parse_mode="HTML",
+            reply_markup=types.InlineKeyboardMarkup().add(
                 types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
             )
-            
-            # Получаем реферальную ссылку
-            referral_link = user_storage.get_referral_link(share_id)
-            
-            # Отправляем новое сообщение с информацией о созданной ссылке
+        )
+
+@callback_router.route("view")
+def view_callback(call, file_key=None):
+    """Показать файл. Формат: view:file_key"""
+    if file_key is None:
+        logger.error(f"Ошибка при получении файла по ключу: нет ключа в {call.data!r}")
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Произошла ошибка при выборе файла.</b>",
+            parse_mode="HTML"
+        )
+        return
+    # Находим файл в снимке списка этого сообщения или в каталоге
+    file_path = resolve_listed_file(call, file_key)
+    if file_path:
+        view_file(call, file_path)
+    else:
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Файл не найден.</b> Возможно, список файлов изменился.",
+            parse_mode="HTML"
+        )
+
+@callback_router.route("delete_file")
+def delete_file_callback(call, file_id):
+    """Запросить подтверждение удаления файла. Формат: delete_file:file_id"""
+    delete_file(call, file_id)
+
+@callback_router.route("confirm_delete")
+def confirm_delete_callback(call, file_id):
+    """Удалить файл после подтверждения. Формат: confirm_delete:file_id"""
+    confirm_delete_file(call, file_id)
+
+@callback_router.route("cancel_delete")
+def cancel_delete_callback(call):
+    """Отменить удаление файла."""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton("📁 Мои файлы", callback_data="files"),
+        types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
+    )
+    try:
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="❌ <b>Удаление отменено.</b>\n\nФайл не был удален.",
+            parse_mode="HTML",
+            reply_markup=markup
+        )
+    except Exception as edit_error:
+        # Если не удалось отредактировать, отправляем новое
+        if "there is no text in the message to edit" in str(edit_error).lower():
             bot.send_message(
                 chat_id=call.message.chat.id,
-                text=(
-                    f"✅ <b>Ссылка для обмена файлом готова!</b>\n\n"
-                    f"📋 <b>Информация о файле:</b>\n"
-                    f"• <b>Имя файла:</b> {file_name}\n"
-                    f"• <b>Тип:</b> {file_type.capitalize()}\n"
-                    f"• <b>ID публикации:</b> <code>{share_id}</code>\n\n"
-                    f"🔗 <b>Команда для доступа:</b>\n"
-                    f"<code>{share_command}</code>\n\n"
-                    f"🔗 <b>Прямая ссылка:</b>\n"
-                    f"<code>{referral_link}</code>\n\n"
-                    f"📝 <b>Инструкция:</b>\n"
-                    f"Другие пользователи могут получить доступ к этому файлу, отправив боту команду выше или перейдя по прямой ссылке."
-                ),
+                text="❌ <b>Удаление отменено.</b>\n\nФайл не был удален.",
                 parse_mode="HTML",
                 reply_markup=markup
             )
         else:
-            # Неизвестная команда
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"⚠️ <b>Неизвестная команда.</b> Пожалуйста, вернитесь в главное меню.",
-                parse_mode="HTML",
-                reply_markup=types.InlineKeyboardMarkup().add(
-                    types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-                )
-            )
+            raise edit_error
+
+@callback_router.route("view_share")
+def view_share_callback(call, share_id):
+    """Показать ссылку для обмена файлом. Формат: view_share:share_id"""
+    # Отправляем новое сообщение со ссылкой для обмена
+    from user_storage import user_storage
+    
+    # Получаем информацию о файле
+    share_info = user_storage.get_shared_file(share_id)
+    if not share_info:
+        bot.send_message(
+            chat_id=call.message.chat.id,
+            text="❌ <b>Ошибка получения информации о файле.</b>\n\nВозможно, срок действия ссылки истек.",
+            parse_mode="HTML"
+        )
+        return
+    
+    file_name = share_info["file_name"]
+    file_type = share_info["file_type"]
+    
+    # Создаем команду для быстрого доступа к файлу
+    share_command = f"/share_{share_id}"
+    
+    # Создаем клавиатуру с кнопками
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(
+        types.InlineKeyboardButton("📤 Мои общие файлы", callback_data="cmd:myshared"),
+        types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
+    )
+    
+    # Получаем реферальную ссылку
+    referral_link = user_storage.get_referral_link(share_id)
+    
+    # Отправляем новое сообщение с информацией о созданной ссылке
+    bot.send_message(
+        chat_id=call.message.chat.id,
+        text=(
+            f"✅ <b>Ссылка для обмена файлом готова!</b>\n\n"
+            f"📋 <b>Информация о файле:</b>\n"
+            f"• <b>Имя файла:</b> {file_name}\n"
+            f"• <b>Тип:</b> {file_type.capitalize()}\n"
+            f"• <b>ID публикации:</b> <code>{share_id}</code>\n\n"
+            f"🔗 <b>Команда для доступа:</b>\n"
+            f"<code>{share_command}</code>\n\n"
+            f"🔗 <b>Прямая ссылка:</b>\n"
+            f"<code>{referral_link}</code>\n\n"
+            f"📝 <b>Инструкция:</b>\n"
+            f"Другие пользователи могут получить доступ к этому файлу, отправив боту команду выше или перейдя по прямой ссылке."
+        ),
+        parse_mode="HTML",
+        reply_markup=markup
+    )
+
+@callback_router.set_fallback
+def unknown_callback(call, verb, args):
+    """Нажатие кнопки без зарегистрированного маршрута."""
+    if verb.startswith("cmd:"):
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=f"⚠️ Неизвестная команда: {verb[len('cmd:'):]}"
+        )
+        return
+    bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=f"⚠️ <b>Неизвестная команда.</b> Пожалуйста, вернитесь в главное меню.",
+        parse_mode="HTML",
+        reply_markup=types.InlineKeyboardMarkup().add(
+            types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
+        )
+    )
+
+@bot.callback_query_handler(func=lambda call: True)
+def button_handler(call):
+    """Обработать нажатия кнопок."""
+    try:
+        # Показать всплывающее уведомление о загрузке (ловим ошибку, если запрос устарел)
+        try:
+            bot.answer_callback_query(call.id)
+        except Exception as e:
+            # Игнорируем ошибки устаревших запросов
+            if "query is too old" in str(e) or "query ID is invalid" in str(e):
+                logger.warning(f"Устаревший запрос: {str(e)}")
+            else:
+                # Логируем другие ошибки
+                logger.error(f"Ошибка ответа на callback: {str(e)}")
+
+        # Команда и аргументы разбираются один раз, обработчик выбирается по таблице маршрутов
+        callback_router.dispatch(call)
     except Exception as e:
         logger.error(f"Ошибка в обработчике кнопок: {e}")
         try:
@@ -2415,122 +2391,146 @@ def button_handler(call):
         except:
             pass
 
+# Параметры сохранения загрузок по типу сообщения: название, иконка, категория и команда просмотра категории
+UPLOAD_KINDS = {
+    'photo': ("фото", "🖼️", "Фотографии", "photos"),
+    'video': ("видео", "🎬", "Видеофайлы", "videos"),
+    'document': ("документ", "📄", "Документы", "documents"),
+}
+
+UNSUPPORTED_UPLOAD_TEXT = "❌ <b>Этот формат не поддерживается.</b>\n\nЯ могу сохранять только фото, видео и документы."
+
+def get_upload_target(message):
+    """
+    Определить загруженный файл и папку пользователя для его сохранения.
+    
+    Returns:
+        Кортеж (file_id, имя файла или None, папка сохранения)
+    """
+    user_photos_folder, user_videos_folder, user_docs_folder, _ = get_user_folders(message.from_user.id)
+    if message.content_type == 'photo':
+        # Фото наибольшего размера
+        file_id = message.photo[-1].file_id
+        return file_id, f"photo_{file_id}.jpg", user_photos_folder
+    if message.content_type == 'video':
+        file_id = message.video.file_id
+        return file_id, getattr(message.video, 'file_name', None) or f"video_{file_id}.mp4", user_videos_folder
+    file_id = message.document.file_id
+    return file_id, getattr(message.document, 'file_name', None) or f"doc_{file_id}", user_docs_folder
+
+def get_upload_file_name(file_name, content_type, remote_path):
+    """Имя, под которым загруженный файл сохраняется в папке пользователя."""
+    # Проверяем, что имя файла действительно получено
+    if not file_name:
+        # Генерируем уникальное имя с временной меткой
+        timestamp = int(time.time())
+        file_name = f"{UPLOAD_KINDS[content_type][0]}_{timestamp}.{remote_path.split('.')[-1]}"
+    
+    # Очистить имя файла от недопустимых символов
+    return sanitize_filename(file_name)
+
+def upload_status_text(content_type):
+    """Текст сообщения о начале загрузки файла."""
+    file_type, file_type_icon, file_category, _ = UPLOAD_KINDS[content_type]
+    return (
+        f"⏳ <b>Загрузка {file_type}...</b>\n\n"
+        f"{file_type_icon} <i>Подготовка файла к сохранению</i>\n"
+        f"📥 <i>Загрузка содержимого</i>\n"
+        f"📝 <i>Сохранение в категорию \"{file_category}\"</i>"
+    )
+
+def upload_saved_message(content_type, file_path, file_size):
+    """
+    Сообщение об успешном сохранении файла.
+    
+    Returns:
+        Кортеж (текст, клавиатура)
+    """
+    file_type, file_type_icon, file_category, category_cmd = UPLOAD_KINDS[content_type]
+    
+    # Кнопки действий: просмотр категории и главное меню
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        types.InlineKeyboardButton(f"📂 Просмотреть {file_category.lower()}", callback_data=f"cmd:{category_cmd}"),
+        types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
+    )
+    
+    # Получаем дату и время сохранения
+    now = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+    
+    text = (
+        f"{file_type_icon} <b>{file_type.capitalize()} успешно сохранено!</b>\n\n"
+        f"📋 <b>Информация о файле:</b>\n"
+        f"• <b>Имя файла:</b> {os.path.basename(file_path)}\n"
+        f"• <b>Размер:</b> {format_size(file_size)}\n"
+        f"• <b>Категория:</b> {file_category}\n"
+        f"• <b>Дата загрузки:</b> {now}\n\n"
+        f"✨ <i>Вы можете найти этот файл в разделе «{file_category}»</i>"
+    )
+    return text, markup
+
+def upload_error_text(content_type, error):
+    """Текст сообщения об ошибке загрузки файла."""
+    return (
+        f"❌ <b>Ошибка при загрузке {UPLOAD_KINDS[content_type][0]}</b>\n\n"
+        f"Не удалось загрузить файл: {str(error)}\n\n"
+        f"Пожалуйста, попробуйте еще раз или отправьте другой файл."
+    )
+
+def upload_failed_text(error):
+    """Текст сообщения о критической ошибке обработки файла."""
+    return (
+        f"❌ <b>Произошла ошибка при обработке файла</b>\n\n"
+        f"<code>{str(error)}</code>\n\n"
+        f"Пожалуйста, попробуйте отправить файл снова."
+    )
+
 @bot.message_handler(content_types=['photo', 'video', 'document'])
 @require_verification
 def receive_file(message):
     """Получить и сохранить файл, отправленный пользователем."""
     try:
-        # Получаем папки пользователя
-        user_id = message.from_user.id
-        user_photos_folder, user_videos_folder, user_docs_folder, _ = get_user_folders(user_id)
-        
-        # Определить, какой тип файла был отправлен
-        if message.content_type == 'photo':
-            file_info = bot.get_file(message.photo[-1].file_id)  # Получить фото наибольшего размера
-            file_name = f"photo_{message.photo[-1].file_id}.jpg"
-            file_type = "фото"
-            file_type_icon = "🖼️"
-            file_category = "Фотографии"
-            save_folder = user_photos_folder  # Используем персональную папку пользователя
-        elif message.content_type == 'video':
-            file_info = bot.get_file(message.video.file_id)
-            file_name = getattr(message.video, 'file_name', None) or f"video_{message.video.file_id}.mp4"
-            file_type = "видео"
-            file_type_icon = "🎬"
-            file_category = "Видеофайлы"
-            save_folder = user_videos_folder  # Используем персональную папку пользователя
-        elif message.content_type == 'document':
-            file_info = bot.get_file(message.document.file_id)
-            file_name = getattr(message.document, 'file_name', None) or f"doc_{message.document.file_id}"
-            file_type = "документ"
-            file_type_icon = "📄"
-            file_category = "Документы"
-            save_folder = user_docs_folder  # Используем персональную папку пользователя
-        else:
-            bot.send_message(
-                message.chat.id, 
-                "❌ <b>Этот формат не поддерживается.</b>\n\nЯ могу сохранять только фото, видео и документы.",
-                parse_mode="HTML"
-            )
+        if message.content_type not in UPLOAD_KINDS:
+            bot.send_message(message.chat.id, UNSUPPORTED_UPLOAD_TEXT, parse_mode="HTML")
             return
-
-        # Проверяем, что имя файла действительно получено
-        if not file_name:
-            # Генерируем уникальное имя с временной меткой
-            timestamp = int(time.time())
-            file_name = f"{file_type}_{timestamp}.{file_info.file_path.split('.')[-1]}"
         
-        # Очистить имя файла от недопустимых символов
-        file_name = sanitize_filename(file_name)
+        # Определяем файл и персональную папку пользователя для него
+        user_id = message.from_user.id
+        uploaded_file_id, file_name, save_folder = get_upload_target(message)
+        file_info = bot.get_file(uploaded_file_id)
+        file_name = get_upload_file_name(file_name, message.content_type, file_info.file_path)
 
-        # Отправить сообщение о начале загрузки с анимированным эмодзи
-        status_message = bot.send_message(
-            message.chat.id, 
-            f"⏳ <b>Загрузка {file_type}...</b>\n\n"
-            f"{file_type_icon} <i>Подготовка файла к сохранению</i>\n"
-            f"📥 <i>Загрузка содержимого</i>\n"
-            f"📝 <i>Сохранение в категорию \"{file_category}\"</i>",
-            parse_mode="HTML"
-        )
+        # Отправить сообщение о начале загрузки
+        status_message = bot.send_message(message.chat.id, upload_status_text(message.content_type), parse_mode="HTML")
         
         try:
-            # Сохраняем файл
-            downloaded_file = bot.download_file(file_info.file_path)
-            
-            # Сохранить файл
+            # Скачиваем файл в хранилище по частям, вычисляя хэш содержимого; в папке
+            # пользователя сохраняется ссылка на содержимое, и файл добавляется в каталог
             file_path = os.path.join(save_folder, file_name)
-            with open(file_path, 'wb') as new_file:
-                new_file.write(downloaded_file)
-            
-            # Получить размер файла
-            file_size = os.path.getsize(file_path)
-            file_size_mb = file_size / (1024 * 1024)
-            file_size_str = f"{file_size_mb:.2f} МБ" if file_size_mb >= 1 else f"{(file_size_mb * 1024):.2f} КБ"
-            
-            # Создаем клавиатуру с кнопками действий
-            markup = types.InlineKeyboardMarkup(row_width=2)
-            
-            # Команда для просмотра категории
-            view_category = f"cmd:{file_type_cmd}" if (file_type_cmd := "photos" if file_type == "фото" else "videos" if file_type == "видео" else "documents") else "cmd:menu"
-            
-            # Кнопки действий
-            markup.add(
-                types.InlineKeyboardButton(f"📂 Просмотреть {file_category.lower()}", callback_data=view_category),
-                types.InlineKeyboardButton("🏠 Главное меню", callback_data="cmd:menu")
-            )
+            blob_store.save_download(bot, file_info.file_path, file_path, user_id, message.content_type)
             
-            # Получаем дату и время сохранения
-            now = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+            # Запоминаем file_id исходной загрузки
+            file_catalog.set_telegram_file_id(file_path, message.content_type, uploaded_file_id)
             
             # Отправить сообщение об успешном сохранении с деталями файла
+            file_size = os.path.getsize(file_path)
+            text, markup = upload_saved_message(message.content_type, file_path, file_size)
             bot.edit_message_text(
                 chat_id=message.chat.id,
                 message_id=status_message.message_id,
-                text=(
-                    f"{file_type_icon} <b>{file_type.capitalize()} успешно сохранено!</b>\n\n"
-                    f"📋 <b>Информация о файле:</b>\n"
-                    f"• <b>Имя файла:</b> {os.path.basename(file_path)}\n"
-                    f"• <b>Размер:</b> {file_size_str}\n"
-                    f"• <b>Категория:</b> {file_category}\n"
-                    f"• <b>Дата загрузки:</b> {now}\n\n"
-                    f"✨ <i>Вы можете найти этот файл в разделе «{file_category}»</i>"
-                ),
+                text=text,
                 parse_mode="HTML",
                 reply_markup=markup
             )
             
             # Логгирование
-            logger.info(f"Файл {file_name} ({file_size_str}) сохранен пользователем {message.from_user.first_name} (ID: {message.from_user.id})")
+            logger.info(f"Файл {file_name} ({format_size(file_size)}) сохранен пользователем {message.from_user.first_name} (ID: {message.from_user.id})")
         
         except Exception as download_error:
             bot.edit_message_text(
                 chat_id=message.chat.id,
                 message_id=status_message.message_id,
-                text=(
-                    f"❌ <b>Ошибка при загрузке {file_type}</b>\n\n"
-                    f"Не удалось загрузить файл: {str(download_error)}\n\n"
-                    f"Пожалуйста, попробуйте еще раз или отправьте другой файл."
-                ),
+                text=upload_error_text(message.content_type, download_error),
                 parse_mode="HTML"
             )
             logger.error(f"Ошибка при загрузке файла от пользователя {message.from_user.id}: {download_error}")
@@ -2538,13 +2538,7 @@ def receive_file(message):
     except Exception as e:
         logger.error(f"Критическая ошибка при обработке файла: {e}")
         try:
-            bot.send_message(
-                message.chat.id, 
-                f"❌ <b>Произошла ошибка при обработке файла</b>\n\n"
-                f"<code>{str(e)}</code>\n\n"
-                f"Пожалуйста, попробуйте отправить файл снова.",
-                parse_mode="HTML"
-            )
+            bot.send_message(message.chat.id, upload_failed_text(e), parse_mode="HTML")
         except:
             bot.send_message(
                 message.chat.id, 
@@ -2663,33 +2657,14 @@ def process_share_command(message):
         
         # Отправляем файл в зависимости от типа
         try:
-            if file_type == "photo":
-                with open(file_path, 'rb') as file:
-                    sent_message = bot.send_photo(
-                        chat_id=message.chat.id,
-                        photo=file,
-                        caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
-                        reply_markup=markup,
-                        parse_mode="HTML"
-                    )
-            elif file_type == "video":
-                with open(file_path, 'rb') as file:
-                    sent_message = bot.send_video(
-                        chat_id=message.chat.id,
-                        video=file,
-                        caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
-                        reply_markup=markup,
-                        parse_mode="HTML"
-                    )
-            else:
-                with open(file_path, 'rb') as file:
-                    sent_message = bot.send_document(
-                        chat_id=message.chat.id,
-                        document=file,
-                        caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
-                        reply_markup=markup,
-                        parse_mode="HTML"
-                    )
+            sent_message = send_stored_file(
+                message.chat.id,
+                file_path,
+                file_type,
+                caption=f"{icon} <b>Файл:</b> {file_name}\n📦 <b>Размер:</b> {file_size_str}\n👤 <b>От:</b> {owner_name}",
+                reply_markup=markup,
+                parse_mode="HTML"
+            )
             
             # Обновляем статус
             bot.edit_message_text(
@@ -2779,6 +2754,9 @@ def run_bot():
 
 # Запускаем бот напрямую, если файл запущен как скрипт
 if __name__ == "__main__":
+    # Импортируем хранилище в главном потоке, чтобы сохранить данные по SIGTERM
+    from user_storage import install_shutdown_handlers
+    install_shutdown_handlers()
     success = run_bot()
     if not success:
         sys.exit(1)
\ No newline at end of file
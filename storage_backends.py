@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Бэкенды для хранения данных UserStorage.
+
+Каждый бэкенд умеет загрузить полное состояние (пользователи и общие файлы)
+и применить набор изменений: измененные записи пользователей, измененные
+записи общих файлов и идентификаторы удаленных общих файлов.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Поля пользователя, которые хранятся в отдельных колонках SQLite
+USER_COLUMNS = ("username", "first_name", "registered_date", "last_active")
+
+# Поля общего файла, которые хранятся в отдельных колонках SQLite
+SHARE_COLUMNS = (
+    "owner_id", "file_path", "file_type", "file_name",
+    "created_at", "expires_at", "access_count"
+)
+
+
+def atomic_write_json(path, data):
+    """Записать JSON-файл атомарно: через временный файл и os.replace.
+
+    При сбое во время записи на диске остается предыдущая версия файла.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class StorageBackend:
+    """Базовый класс бэкенда хранилища."""
+
+    def load(self):
+        """Загрузить данные.
+
+        Returns:
+            Кортеж (users, shared_files) из двух словарей
+        """
+        raise NotImplementedError
+
+    def commit(self, users, shared_files, deleted_shares):
+        """Применить изменения.
+
+        Args:
+            users: Словарь {user_id: запись} измененных пользователей
+            shared_files: Словарь {share_id: запись} измененных общих файлов
+            deleted_shares: Множество ID удаленных общих файлов
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Освободить ресурсы бэкенда."""
+        pass
+
+
+class JsonStorageBackend(StorageBackend):
+    """Хранение в двух JSON-файлах (исходный формат бота).
+
+    Бэкенд держит у себя копию данных и после применения изменений
+    перезаписывает оба файла целиком.
+    """
+
+    def __init__(self, users_file, shared_files_file):
+        self.users_file = users_file
+        self.shared_files_file = shared_files_file
+        self._users = {}
+        self._shared_files = {}
+
+    def _read(self, path, title):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            logger.info(f"Загружены данные о {len(data)} {title}")
+            return data
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке {path}: {e}")
+            return {}
+
+    def _write(self, path, data, title):
+        """Записать файл; ошибка записи передается вызывающему."""
+        try:
+            atomic_write_json(path, data)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении {path}: {e}")
+            raise
+        logger.info(f"Сохранены данные о {len(data)} {title}")
+
+    def load(self):
+        self._users = self._read(self.users_file, "пользователях")
+        self._shared_files = self._read(self.shared_files_file, "общих файлах")
+        return json.loads(json.dumps(self._users)), json.loads(json.dumps(self._shared_files))
+
+    def _apply(self, users, shared_files, deleted_shares):
+        """Применить изменения к копии данных в памяти."""
+        self._users.update(users)
+        self._shared_files.update(shared_files)
+        for share_id in deleted_shares:
+            self._shared_files.pop(share_id, None)
+
+    def commit(self, users, shared_files, deleted_shares):
+        self._apply(users, shared_files, deleted_shares)
+
+        if users:
+            self._write(self.users_file, self._users, "пользователях")
+        if shared_files or deleted_shares:
+            self._write(self.shared_files_file, self._shared_files, "общих файлах")
+
+
+class JournalStorageBackend(JsonStorageBackend):
+    """Снимок в JSON-файлах и журнал изменений с дозаписью.
+
+    Каждое сохранение дописывает в журнал по строке на измененную запись.
+    Новая запись пишется целиком ({"op": "user"|"share", "id", "data"}),
+    а для существующей пишутся только изменения ({"op": "user_update"|
+    "share_update", "id", "set", "unset", "append", "discard"}): например,
+    подтверждение пользователя - одно поле, новая ссылка - один ID в списке
+    shared_files, поэтому размер записи не зависит от размера записи
+    пользователя. Удаление ссылки - {"op": "share_delete", "id"}.
+
+    При запуске состояние восстанавливается из снимка и журнала. Фоновый
+    поток сворачивает журнал в новый снимок, когда журнал превышает порог.
+    """
+
+    def __init__(self, users_file, shared_files_file, journal_file, compact_threshold):
+        super().__init__(users_file, shared_files_file)
+        self.journal_file = journal_file
+        # Журнал, который в данный момент сворачивается в снимок
+        self.compacting_file = journal_file + ".compacting"
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._journal = None
+        self._compact_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._compactor = None
+
+    @staticmethod
+    def _diff_record(op, record_id, old, new):
+        """Запись журнала с изменениями записи old -> new или None, если изменений нет."""
+        if old is None:
+            return {"op": op, "id": record_id, "data": new}
+        changes = {}
+        appended = {}
+        discarded = {}
+        for key, value in new.items():
+            old_value = old.get(key)
+            if key in old and old_value == value:
+                continue
+            if isinstance(value, list) and isinstance(old_value, list):
+                # Списки ID меняются дописыванием в конец и удалением
+                new_items = set(value)
+                old_items = set(old_value)
+                kept = [item for item in old_value if item in new_items]
+                added = [item for item in value if item not in old_items]
+                if kept + added == value and len(old_items) == len(old_value):
+                    if added:
+                        appended[key] = added
+                    if len(kept) != len(old_value):
+                        discarded[key] = [item for item in old_value if item not in new_items]
+                    continue
+            changes[key] = value
+        removed = [key for key in old if key not in new]
+        if not (changes or removed or appended or discarded):
+            return None
+        update = {"op": f"{op}_update", "id": record_id}
+        if changes:
+            update["set"] = changes
+        if removed:
+            update["unset"] = removed
+        if appended:
+            update["append"] = appended
+        if discarded:
+            update["discard"] = discarded
+        return update
+
+    @staticmethod
+    def _apply_update(target, record):
+        """Применить к записи изменения из записи журнала *_update."""
+        if target is None:
+            return
+        target.update(record.get("set", {}))
+        for key in record.get("unset", ()):
+            target.pop(key, None)
+        for key, items in record.get("discard", {}).items():
+            removed = set(items)
+            target[key] = [item for item in target.get(key, []) if item not in removed]
+        for key, items in record.get("append", {}).items():
+            target[key] = target.get(key, []) + items
+
+    def _replay(self, path):
+        """Применить записи журнала к данным в памяти.
+
+        Returns:
+            Кортеж (количество примененных записей, размер целой части
+            журнала в байтах - после нее идет недописанная строка) или
+            (0, None), если журнала нет
+        """
+        if not os.path.exists(path):
+            return 0, None
+        count = 0
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    # Строка без перевода строки дописана не до конца
+                    if not line.endswith(b"\n"):
+                        raise ValueError("нет конца строки")
+                    record = json.loads(line)
+                except ValueError:
+                    # Недописанная последняя строка после сбоя
+                    logger.warning(f"Пропущена поврежденная запись журнала {path}")
+                    break
+                op = record.get("op")
+                if op == "user":
+                    self._users[record["id"]] = record["data"]
+                elif op == "user_update":
+                    self._apply_update(self._users.get(record["id"]), record)
+                elif op == "share":
+                    self._shared_files[record["id"]] = record["data"]
+                elif op == "share_update":
+                    self._apply_update(self._shared_files.get(record["id"]), record)
+                elif op == "share_delete":
+                    self._shared_files.pop(record["id"], None)
+                count += 1
+                valid_size += len(line)
+        return count, valid_size
+
+    def _recover(self, path):
+        """Применить журнал и обрезать недописанный хвост.
+
+        Иначе следующая запись будет дописана к поврежденной строке и
+        потеряется при следующем запуске вместе с ней.
+
+        Returns:
+            Количество примененных записей
+        """
+        count, valid_size = self._replay(path)
+        if valid_size is not None and os.path.getsize(path) > valid_size:
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+                f.flush()
+                os.fsync(f.fileno())
+            logger.warning(f"Журнал {path} обрезан до {valid_size} байт")
+        return count
+
+    def load(self):
+        with self._lock:
+            self._users = self._read(self.users_file, "пользователях")
+            self._shared_files = self._read(self.shared_files_file, "общих файлах")
+            # Сначала незавершенная компакция, затем текущий журнал
+            replayed = self._recover(self.compacting_file) + self._recover(self.journal_file)
+            if replayed:
+                logger.info(f"Из журнала применено {replayed} записей")
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            needs_compaction = os.path.exists(self.compacting_file) or replayed > 0
+
+        # Восстановленное состояние сразу сворачиваем в снимок: так журнал
+        # начинается с чистого файла, даже если последняя строка была недописана
+        if needs_compaction:
+            try:
+                self.compact()
+            except Exception as e:
+                # Журнал остается на диске и будет свернут позже
+                logger.error(f"Ошибка при компакции журнала хранилища: {e}")
+
+        if self._compactor is None:
+            self._compactor = threading.Thread(target=self._compactor_loop, name="storage-journal-compactor")
+            self._compactor.daemon = True
+            self._compactor.start()
+
+        return json.loads(json.dumps(self._users)), json.loads(json.dumps(self._shared_files))
+
+    def commit(self, users, shared_files, deleted_shares):
+        with self._lock:
+            # Изменения вычисляются относительно копии данных до применения
+            records = [
+                self._diff_record("user", user_id, self._users.get(user_id), user)
+                for user_id, user in users.items()
+            ]
+            records += [
+                self._diff_record("share", share_id, self._shared_files.get(share_id), share)
+                for share_id, share in shared_files.items()
+            ]
+            records += [{"op": "share_delete", "id": share_id} for share_id in deleted_shares]
+            lines = [json.dumps(record, ensure_ascii=False) for record in records if record is not None]
+            self._apply(users, shared_files, deleted_shares)
+            if not lines:
+                return
+            self._journal.write("\n".join(lines) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            journal_size = self._journal.tell()
+
+        if journal_size >= self.compact_threshold:
+            self._compact_event.set()
+
+    def compact(self):
+        """Свернуть журнал в новый снимок."""
+        with self._compact_lock:
+            with self._lock:
+                if os.path.exists(self.compacting_file):
+                    # Предыдущая компакция не завершилась: ее записи уже
+                    # учтены в памяти и попадут в новый снимок
+                    self._journal.close()
+                    with open(self.compacting_file, 'a', encoding='utf-8') as dst, \
+                            open(self.journal_file, 'r', encoding='utf-8') as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_file)
+                else:
+                    self._journal.close()
+                    os.replace(self.journal_file, self.compacting_file)
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                users = json.loads(json.dumps(self._users))
+                shared_files = json.loads(json.dumps(self._shared_files))
+
+            # Запись снимка идет без блокировки: новые изменения
+            # в это время дописываются в свежий журнал. Если запись не
+            # удалась, свернутый журнал остается и применяется при загрузке
+            self._write(self.users_file, users, "пользователях")
+            self._write(self.shared_files_file, shared_files, "общих файлах")
+            os.remove(self.compacting_file)
+            logger.info("Журнал хранилища свернут в снимок")
+
+    def _compactor_loop(self):
+        """Фоновый поток компакции журнала."""
+        while not self._stop_event.is_set():
+            self._compact_event.wait()
+            self._compact_event.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Ошибка при компакции журнала хранилища: {e}")
+
+    def close(self):
+        self._stop_event.set()
+        self._compact_event.set()
+        if self._compactor and self._compactor is not threading.current_thread():
+            self._compactor.join(timeout=5)
+        with self._lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+
+class SqliteStorageBackend(StorageBackend):
+    """Хранение в базе SQLite в режиме WAL.
+
+    Изменения применяются построчно: каждая измененная запись обновляется
+    отдельным INSERT OR REPLACE, без перезаписи всего хранилища.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "user_id TEXT PRIMARY KEY, username TEXT, first_name TEXT, "
+                "registered_date TEXT, last_active TEXT, verified INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_files ("
+                "share_id TEXT PRIMARY KEY, owner_id TEXT NOT NULL, file_path TEXT, "
+                "file_type TEXT, file_name TEXT, created_at TEXT, expires_at TEXT, "
+                "access_count INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS share_recipients ("
+                "share_id TEXT NOT NULL, user_id TEXT NOT NULL, "
+                "PRIMARY KEY (share_id, user_id))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_shared_files_owner ON shared_files (owner_id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_share_recipients_user ON share_recipients (user_id)"
+            )
+
+    def load(self):
+        users = {}
+        shared_files = {}
+
+        with self._lock:
+            for row in self._conn.execute(
+                "SELECT user_id, username, first_name, registered_date, last_active, verified FROM users"
+            ):
+                user = dict(zip(USER_COLUMNS, row[1:5]))
+                user["shared_files"] = []
+                user["received_files"] = []
+                user["verified"] = bool(row[5])
+                users[row[0]] = user
+
+            for row in self._conn.execute(
+                "SELECT share_id, owner_id, file_path, file_type, file_name, created_at, "
+                "expires_at, access_count FROM shared_files ORDER BY rowid"
+            ):
+                share = dict(zip(SHARE_COLUMNS, row[1:]))
+                share["shared_with"] = []
+                shared_files[row[0]] = share
+                if share["owner_id"] in users:
+                    users[share["owner_id"]]["shared_files"].append(row[0])
+
+            for share_id, user_id in self._conn.execute(
+                "SELECT share_id, user_id FROM share_recipients ORDER BY rowid"
+            ):
+                if share_id not in shared_files:
+                    continue
+                shared_files[share_id]["shared_with"].append(user_id)
+                if user_id in users:
+                    users[user_id]["received_files"].append(share_id)
+
+        logger.info(
+            f"Загружены данные о {len(users)} пользователях и {len(shared_files)} общих файлах из {self.db_path}"
+        )
+        return users, shared_files
+
+    def commit(self, users, shared_files, deleted_shares):
+        with self._lock, self._conn:
+            for user_id, user in users.items():
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO users "
+                    "(user_id, username, first_name, registered_date, last_active, verified) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, *(user.get(c) for c in USER_COLUMNS), int(bool(user.get("verified", False))))
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO share_recipients (share_id, user_id) VALUES (?, ?)",
+                    [(share_id, user_id) for share_id in user.get("received_files", [])]
+                )
+
+            for share_id, share in shared_files.items():
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO shared_files "
+                    "(share_id, owner_id, file_path, file_type, file_name, created_at, expires_at, access_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (share_id, *(share.get(c) for c in SHARE_COLUMNS))
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO share_recipients (share_id, user_id) VALUES (?, ?)",
+                    [(share_id, user_id) for user_id in share.get("shared_with", [])]
+                )
+
+            for share_id in deleted_shares:
+                self._conn.execute("DELETE FROM shared_files WHERE share_id = ?", (share_id,))
+                self._conn.execute("DELETE FROM share_recipients WHERE share_id = ?", (share_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage_backend(name, users_file, shared_files_file, db_path,
+                           journal_file=None, compact_threshold=1024 * 1024):
+    """Создать бэкенд хранилища по имени ("json", "journal" или "sqlite")."""
+    if name == "sqlite":
+        return SqliteStorageBackend(db_path)
+    if name == "journal":
+        return JournalStorageBackend(users_file, shared_files_file, journal_file, compact_threshold)
+    if name != "json":
+        logger.warning(f"Неизвестный бэкенд хранилища '{name}', используем json")
+    return JsonStorageBackend(users_file, shared_files_file)
+
+
+def import_json_data(users_file, shared_files_file, backend):
+    """Однократно перенести данные из JSON-файлов в указанный бэкенд.
+
+    Returns:
+        Кортеж (количество пользователей, количество общих файлов)
+    """
+    users, shared_files = JsonStorageBackend(users_file, shared_files_file).load()
+    backend.commit(users, shared_files, set())
+    logger.info(f"Импортировано {len(users)} пользователей и {len(shared_files)} общих файлов")
+    return len(users), len(shared_files)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""Общие настройки тестов: модули бота лежат в корне репозитория."""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# config.py требует токен бота при импорте, а глобальные экземпляры модулей
+# создают базы и папки: направляем их во временную папку, а не в репозиторий
+_data_dir = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:test")
+os.environ.setdefault("CATALOG_DB_PATH", os.path.join(_data_dir, "file_catalog.db"))
+os.environ.setdefault("STORAGE_DB_PATH", os.path.join(_data_dir, "storage.db"))
+os.environ.setdefault("STORAGE_JOURNAL_PATH", os.path.join(_data_dir, "storage.journal"))
+os.environ.setdefault("ARCHIVE_CACHE_DIR", os.path.join(_data_dir, "archive_cache"))
+os.environ.setdefault("BLOB_STORE_DIR", os.path.join(_data_dir, "blobs"))
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты сборки ZIP-архивов."""
+
+import glob
+import io
+import os
+import tempfile
+import time
+import zipfile
+
+import pytest
+
+import archive_utils
+from archive_utils import ZipAssembler, compress_entry, write_zip_parallel
+
+
+@pytest.fixture
+def files(tmp_path):
+    text = tmp_path / "notes.txt"
+    text.write_bytes(b"hello archive\n" * 50000)
+    noise = tmp_path / "фото.jpg"
+    noise.write_bytes(os.urandom(300000))
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    return [str(text), str(noise), str(empty)]
+
+
+def _leftover_entries():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), "zip-entry-*")))
+
+
+def test_assembler_round_trip(files):
+    archive = io.BytesIO()
+    assembler = ZipAssembler(archive)
+    for file_path in files:
+        method, crc, size, compressed_size, data_path, (mtime, mode) = compress_entry(file_path, "auto", 6)
+        source_path = data_path or file_path
+        with open(source_path, 'rb') as source:
+            assembler.add(os.path.basename(file_path), method, crc, size, compressed_size, mtime, mode,
+                          iter(lambda: source.read(65536), b""))
+        if data_path:
+            os.remove(data_path)
+    assembler.close()
+
+    archive.seek(0)
+    with zipfile.ZipFile(archive) as zipf:
+        assert zipf.testzip() is None
+        methods = {info.filename: info.compress_type for info in zipf.infolist()}
+        assert methods == {
+            "notes.txt": zipfile.ZIP_DEFLATED,
+            "фото.jpg": zipfile.ZIP_STORED,
+            "empty.txt": zipfile.ZIP_STORED,
+        }
+        for file_path in files:
+            with open(file_path, 'rb') as file:
+                assert zipf.read(os.path.basename(file_path)) == file.read()
+
+
+def test_parallel_archive_round_trip(files, tmp_path):
+    before = _leftover_entries()
+    archive = io.BytesIO()
+    missing = str(tmp_path / "missing.txt")
+
+    added = write_zip_parallel(files + [missing], archive, workers=2)
+
+    assert added == 3
+    archive.seek(0)
+    with zipfile.ZipFile(archive) as zipf:
+        assert zipf.testzip() is None
+        assert zipf.namelist() == [os.path.basename(file_path) for file_path in files]
+    assert _leftover_entries() <= before
+
+
+def test_parallel_archive_failure_removes_prepared_entries(files):
+    before = _leftover_entries()
+
+    def progress(size):
+        raise RuntimeError("отмена")
+
+    with pytest.raises(RuntimeError):
+        write_zip_parallel(files * 4, io.BytesIO(), compression="deflate", workers=2, progress=progress)
+
+    deadline = time.monotonic() + 10
+    while _leftover_entries() - before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _leftover_entries() <= before
+    archive_utils.shutdown_process_pool()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты маршрутизации нажатий inline-кнопок."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from callback_router import CallbackRouter, UNKNOWN_ROUTE
+
+
+def make_call(data):
+    return SimpleNamespace(data=data)
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("cmd:menu", ("cmd:menu", [])),
+    ("cmd:share:aB3", ("cmd:share", ["aB3"])),
+    ("page:2:photo", ("page", ["2", "photo"])),
+    ("files", ("files", [])),
+    ("cmd", ("cmd", [])),
+    ("", ("", [])),
+    (None, ("", [])),
+])
+def test_parse(data, expected):
+    assert CallbackRouter().parse(data) == expected
+
+
+def test_dispatch_by_prefix():
+    router = CallbackRouter()
+    calls = []
+
+    @router.route("cmd:photos", "cmd:videos")
+    def media(call, *args):
+        calls.append(("media", call.data, args))
+
+    @router.route("page")
+    def page(call, number, file_type):
+        calls.append(("page", number, file_type))
+
+    router.dispatch(make_call("cmd:videos"))
+    router.dispatch(make_call("page:3:all"))
+    # "cmd:photosx" - другая команда, а не "cmd:photos" с суффиксом
+    router.dispatch(make_call("cmd:photosx"))
+
+    assert calls == [("media", "cmd:videos", ()), ("page", "3", "all")]
+
+
+def test_duplicate_route_is_rejected():
+    router = CallbackRouter()
+    router.add("cmd:menu", lambda call: None)
+    with pytest.raises(ValueError):
+        router.add("cmd:menu", lambda call: None)
+
+
+def test_fallback_and_timing():
+    router = CallbackRouter(slow_threshold_ms=0)
+    unknown = []
+    timings = []
+    router.add("cmd:menu", lambda call: None)
+    router.set_fallback(lambda call, verb, args: unknown.append((verb, args)))
+    router.add_timing_hook(lambda verb, elapsed, call: timings.append(verb))
+
+    router.dispatch(make_call("cmd:menu"))
+    router.dispatch(make_call("cmd:gone:1"))
+
+    assert unknown == [("cmd:gone", ["1"])]
+    assert timings == ["cmd:menu", UNKNOWN_ROUTE]
+    stats = router.timing_stats()
+    assert stats["cmd:menu"]["count"] == 1
+    assert stats[UNKNOWN_ROUTE]["count"] == 1
+
+
+def test_timing_recorded_when_handler_fails():
+    router = CallbackRouter()
+
+    @router.route("cmd:broken")
+    def broken(call):
+        raise RuntimeError("ошибка")
+
+    # Ошибка функции замера не мешает обработке
+    router.add_timing_hook(lambda verb, elapsed, call: 1 / 0)
+
+    with pytest.raises(RuntimeError):
+        router.dispatch(make_call("cmd:broken"))
+    assert router.timing_stats()["cmd:broken"]["count"] == 1
+
+
+def test_dispatch_async():
+    router = CallbackRouter()
+    calls = []
+
+    @router.route("page")
+    async def page(call, number, file_type=None):
+        calls.append(("page", number, file_type))
+
+    @router.set_fallback
+    async def fallback(call, verb, args):
+        calls.append(("fallback", verb, args))
+
+    asyncio.run(router.dispatch_async(make_call("page:2")))
+    asyncio.run(router.dispatch_async(make_call("cmd:share:aB3")))
+
+    assert calls == [("page", "2", None), ("fallback", "cmd:share", ["aB3"])]
+    assert set(router.timing_stats()) == {"page", UNKNOWN_ROUTE}
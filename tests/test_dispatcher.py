@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты диспетчера обновлений по чатам."""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from dispatcher import AsyncChatLanes, ChatDispatcher
+
+
+def make_update(update_id, chat_id):
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+    return SimpleNamespace(update_id=update_id, message=message)
+
+
+@pytest.fixture
+def dispatchers():
+    created = []
+    yield created
+    for dispatcher in created:
+        dispatcher.shutdown()
+
+
+def test_updates_of_one_chat_run_in_order(dispatchers):
+    lock = threading.Lock()
+    running = {}
+    overlaps = []
+    order = {}
+
+    def handler(update):
+        chat_id = update.message.chat.id
+        with lock:
+            if running.get(chat_id):
+                overlaps.append(update.update_id)
+            running[chat_id] = True
+        time.sleep(0.001)
+        with lock:
+            running[chat_id] = False
+            order.setdefault(chat_id, []).append(update.update_id)
+
+    dispatcher = ChatDispatcher(handler, workers=4, max_lane_size=100)
+    dispatchers.append(dispatcher)
+    futures = [dispatcher.submit(make_update(i, i % 3)) for i in range(60)]
+    for future in futures:
+        assert future.result(timeout=10) is True
+
+    assert overlaps == []
+    for chat_id in range(3):
+        assert order[chat_id] == list(range(chat_id, 60, 3))
+    assert dispatcher.pending() == 0
+
+
+# SystemExit завершает поток диспетчера, pytest сообщает об этом предупреждением
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_handler_error_does_not_stall_chat(dispatchers):
+    def handler(update):
+        if update.update_id == 1:
+            raise ValueError("ошибка обработчика")
+        if update.update_id == 2:
+            raise SystemExit()
+
+    dispatcher = ChatDispatcher(handler, workers=1)
+    dispatchers.append(dispatcher)
+    failed = dispatcher.submit(make_update(1, 7))
+    stopped = dispatcher.submit(make_update(2, 7))
+    worker = dispatcher._threads[0]
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    with pytest.raises(SystemExit):
+        stopped.result(timeout=5)
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+
+    # Поток завершился, следующее обновление чата обрабатывает новый
+    assert dispatcher.submit(make_update(3, 7)).result(timeout=5) is True
+    assert dispatcher.pending() == 0
+
+
+def test_full_lane_drops_updates(dispatchers):
+    release = threading.Event()
+    dispatcher = ChatDispatcher(lambda update: release.wait(5), workers=1, max_lane_size=2)
+    dispatchers.append(dispatcher)
+
+    futures = [dispatcher.submit(make_update(i, 1)) for i in range(3)]
+    assert futures[2].result(timeout=1) is False
+    release.set()
+    assert [future.result(timeout=5) for future in futures[:2]] == [True, True]
+    assert dispatcher.dropped == 1
+
+
+def test_async_lanes_keep_chat_order():
+    lanes = AsyncChatLanes(max_lane_size=100)
+    order = {}
+    running = set()
+    overlaps = []
+
+    async def handler(update):
+        chat_id = update.message.chat.id
+        if chat_id in running:
+            overlaps.append(update.update_id)
+        running.add(chat_id)
+        # Поздние обновления выполняются быстрее ранних и обогнали бы их без очереди
+        await asyncio.sleep(0.001 * (30 - update.update_id % 30))
+        running.discard(chat_id)
+        order.setdefault(chat_id, []).append(update.update_id)
+
+    async def main():
+        results = await asyncio.gather(*(lanes.run(make_update(i, i % 3), handler) for i in range(30)))
+        assert all(results)
+
+    asyncio.run(main())
+    assert overlaps == []
+    for chat_id in range(3):
+        assert order[chat_id] == list(range(chat_id, 30, 3))
+    assert lanes.pending() == 0
+
+
+def test_async_lanes_drop_and_release_after_error():
+    lanes = AsyncChatLanes(max_lane_size=2)
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(update):
+            await gate.wait()
+            if update.update_id == 0:
+                raise ValueError("ошибка обработчика")
+
+        tasks = [asyncio.create_task(lanes.run(make_update(i, 1), handler)) for i in range(3)]
+        await asyncio.sleep(0)
+        assert await tasks[2] is False
+        gate.set()
+        with pytest.raises(ValueError):
+            await tasks[0]
+        assert await tasks[1] is True
+
+    asyncio.run(main())
+    assert lanes.dropped == 1
+    assert lanes.pending() == 0
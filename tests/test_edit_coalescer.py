@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты объединения редактирований сообщений."""
+
+import threading
+import time
+
+import pytest
+
+import edit_coalescer
+from edit_coalescer import EditCoalescer
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+        self.edited = threading.Event()
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.edits.append((chat_id, message_id, text))
+        self.edited.set()
+        return text
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+def test_identical_edit_is_skipped(bot):
+    coalescer = EditCoalescer(bot.edit_message_text, delay=0.05)
+
+    assert coalescer.edit("готово", chat_id=1, message_id=10) == "готово"
+    assert coalescer.edit("готово", chat_id=1, message_id=10) is None
+    coalescer.edit("готово", chat_id=1, message_id=10, parse_mode="HTML")
+
+    assert bot.edits == [(1, 10, "готово"), (1, 10, "готово")]
+    assert coalescer.stats()["skipped"] == 1
+
+
+def test_defer_superseded_by_edit(bot):
+    coalescer = EditCoalescer(bot.edit_message_text, delay=0.05)
+
+    coalescer.defer("⏳ Загрузка...", chat_id=1, message_id=10)
+    coalescer.edit("готово", chat_id=1, message_id=10)
+    time.sleep(0.2)
+
+    assert bot.edits == [(1, 10, "готово")]
+    assert coalescer.stats()["superseded"] == 1
+
+
+def test_defer_fires_after_delay(bot):
+    coalescer = EditCoalescer(bot.edit_message_text, delay=0.05)
+
+    started = time.monotonic()
+    coalescer.defer("⏳ Загрузка...", chat_id=1, message_id=10)
+    assert bot.edits == []
+    assert bot.edited.wait(5)
+
+    assert time.monotonic() - started >= 0.05
+    assert bot.edits == [(1, 10, "⏳ Загрузка...")]
+    # Итоговое состояние после выполненного отложенного редактирования отправляется
+    coalescer.edit("готово", chat_id=1, message_id=10)
+    assert bot.edits[-1] == (1, 10, "готово")
+
+
+def test_pending_message_is_not_evicted(bot, monkeypatch):
+    monkeypatch.setattr(edit_coalescer, "MAX_TRACKED_MESSAGES", 2)
+    coalescer = EditCoalescer(bot.edit_message_text, delay=0.1)
+
+    coalescer.defer("⏳ Загрузка...", chat_id=1, message_id=10)
+    for message_id in range(11, 15):
+        coalescer.edit("другое", chat_id=1, message_id=message_id)
+    coalescer.edit("готово", chat_id=1, message_id=10)
+    time.sleep(0.3)
+
+    assert [edit for edit in bot.edits if edit[1] == 10] == [(1, 10, "готово")]
+    assert coalescer.stats()["tracked"] == 2
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты каталога файлов и ключей base62."""
+
+import os
+
+import pytest
+
+from file_catalog import FileCatalog, encode_file_key, decode_file_key
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = FileCatalog(str(tmp_path / "catalog.db"), str(tmp_path / "users"))
+    yield catalog
+    catalog.close()
+
+
+def save(catalog, user_id, name, content=b"data"):
+    folder = os.path.join(catalog.user_folder(user_id), "documents")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    catalog.add_file(user_id, path, "document")
+    return path
+
+
+@pytest.mark.parametrize("file_id", [0, 1, 61, 62, 3843, 3844, 2 ** 40])
+def test_file_key_round_trip(file_id):
+    assert decode_file_key(encode_file_key(file_id)) == file_id
+
+
+@pytest.mark.parametrize("file_key", ["", "a-b", "a" * 12, None])
+def test_invalid_file_key(file_key):
+    assert decode_file_key(file_key) is None
+
+
+def test_record_owner_is_exact_user_id(catalog):
+    # Папка пользователя 1234 начинается с пути папки пользователя 123
+    own_path = save(catalog, 123, "own.txt")
+    other_path = save(catalog, 1234, "other.txt")
+
+    other = catalog.get_file_by_path(other_path)
+    assert other["user_id"] == "1234"
+    assert other["path"].startswith(catalog.user_folder(123))
+    assert catalog.get_file_by_key(other["key"])["user_id"] != "123"
+    assert [f["path"] for f in catalog.list_files(123)] == [own_path]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты очереди фоновых заданий."""
+
+import threading
+
+import pytest
+
+from jobs import JobManager, JobRejected
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(workers=1, max_queue=10, per_user_limit=1)
+    yield manager
+    manager.shutdown()
+
+
+def test_cancelled_queued_job_frees_user_slot(manager):
+    release = threading.Event()
+    started = threading.Event()
+    ran = []
+
+    def blocking(job):
+        started.set()
+        release.wait(5)
+
+    manager.submit(1, blocking)
+    assert started.wait(5)
+    queued = manager.submit(2, lambda job: ran.append("queued"))
+
+    with pytest.raises(JobRejected) as error:
+        manager.submit(2, lambda job: None)
+    assert error.value.reason == JobRejected.USER_LIMIT
+
+    assert manager.cancel_user_jobs(2) == [(queued, "queued")]
+    assert queued.state == "cancelled"
+    assert manager.active_jobs(2) == []
+
+    done = threading.Event()
+    manager.submit(2, lambda job: done.set())
+    release.set()
+    assert done.wait(5)
+    assert ran == []
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты ограничения частоты запросов к Bot API."""
+
+import io
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    """Часы, которые двигаются только при sleep."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession:
+    """Сессия, отвечающая заранее заданными ответами и запоминающая загруженные файлы."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.uploads = []
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        if files:
+            self.uploads.append(files["document"][1].read())
+        return self.responses.pop(0)
+
+
+class FakeTelegramError(Exception):
+    """Как asyncio_helper.ApiTelegramException: код ошибки и ответ Telegram."""
+
+    def __init__(self, error_code, result_json):
+        super().__init__(error_code)
+        self.error_code = error_code
+        self.result_json = result_json
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+
+    async def async_sleep(seconds):
+        clock.sleep(seconds)
+
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    monkeypatch.setattr(rate_limiter, "asyncio", SimpleNamespace(sleep=async_sleep))
+    return clock
+
+
+def test_bucket_refill():
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.updated = 0.0
+
+    # Всплеск в пределах емкости проходит без ожидания
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == 0.0
+    # Дальше каждый запрос ждет следующего токена
+    assert bucket.reserve(0.0) == pytest.approx(0.5)
+    assert bucket.reserve(0.0) == pytest.approx(1.0)
+    # За 2 секунды накопились два занятых токена и еще один
+    assert bucket.reserve(2.0) == 0.0
+    # Емкость не превышается даже после долгого простоя
+    assert [bucket.reserve(100.0) for _ in range(3)] == [0.0, 0.0, pytest.approx(0.5)]
+
+
+def test_block_delays_reserve():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.updated = 0.0
+    bucket.block(5.0)
+    assert bucket.reserve(1.0) == pytest.approx(4.0)
+    assert bucket.reserve(5.0) == 0.0
+
+
+def test_429_is_retried_after_retry_after_with_rewound_file(clock):
+    limiter = RateLimiter(global_rate=30, chat_rate=1, chat_burst=3, max_retries=3)
+    limiter.session = FakeSession([
+        FakeResponse(429, {"parameters": {"retry_after": 7}}),
+        FakeResponse(200),
+    ])
+    document = io.BytesIO(b"header-data")
+    document.seek(7)
+
+    response = limiter.send_request(
+        "post", "https://api.telegram.org/bot1:x/sendDocument",
+        params={"chat_id": "42"}, files={"document": ("a.txt", document)}
+    )
+
+    assert response.status_code == 200
+    # Повтор отправил файл с той же позиции, а не с конца
+    assert limiter.session.uploads == [b"data", b"data"]
+    assert clock.sleeps == [pytest.approx(7.0)]
+    stats = limiter.stats()
+    assert stats["too_many_requests"] == 1
+    assert stats["requests"] == 2
+    assert stats["blocked_threads"] == 0
+
+
+def test_429_retries_are_limited(clock):
+    limiter = RateLimiter(max_retries=1)
+    limiter.session = FakeSession([FakeResponse(429), FakeResponse(429)])
+
+    response = limiter.send_request(
+        "post", "https://api.telegram.org/bot1:x/sendMessage", params={"chat_id": -100}
+    )
+
+    assert response.status_code == 429
+    assert len(limiter.session.responses) == 0
+
+
+def test_unlimited_methods_are_not_delayed(clock):
+    limiter = RateLimiter(global_rate=1, chat_rate=1, chat_burst=1)
+    limiter.session = FakeSession([FakeResponse(200)] * 5)
+
+    for _ in range(5):
+        limiter.send_request("get", "https://api.telegram.org/bot1:x/getFile", params={"file_id": "f"})
+
+    assert clock.sleeps == []
+    assert limiter.stats()["requests"] == 0
+
+
+def test_call_async_waits_and_retries_429(clock):
+    limiter = RateLimiter(global_rate=30, chat_rate=1, chat_burst=1, max_retries=3)
+    responses = [FakeTelegramError(429, {"parameters": {"retry_after": 5}}), "sent", "sent"]
+    calls = []
+
+    async def send_message(chat_id, text, **kwargs):
+        calls.append((chat_id, text, kwargs))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def main():
+        assert await limiter.call_async(42, send_message, 42, "a") == "sent"
+        assert await limiter.call_async("42", send_message, 42, "b") == "sent"
+
+    asyncio.run(main())
+    assert [call[1] for call in calls] == ["a", "a", "b"]
+    # Повтор после 429 ждет retry_after; за это время корзина чата пополнилась
+    assert clock.sleeps == [pytest.approx(5.0)]
+    assert limiter.stats()["too_many_requests"] == 1
+
+
+def test_call_async_reraises_other_errors(clock):
+    limiter = RateLimiter()
+
+    async def edit_message_text(text, chat_id=None, message_id=None):
+        raise FakeTelegramError(400, {"description": "Bad Request"})
+
+    with pytest.raises(FakeTelegramError):
+        asyncio.run(limiter.call_async(1, edit_message_text, "x", chat_id=1, message_id=2))
+    assert limiter.stats()["too_many_requests"] == 0
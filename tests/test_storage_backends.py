@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты журнального бэкенда хранилища."""
+
+import json
+import os
+
+import pytest
+
+import storage_backends
+from storage_backends import JournalStorageBackend
+
+
+def make_backend(tmp_path):
+    return JournalStorageBackend(
+        str(tmp_path / "users.json"),
+        str(tmp_path / "shared.json"),
+        str(tmp_path / "storage.journal"),
+        compact_threshold=1024 * 1024
+    )
+
+
+def test_reload_replays_journal(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.load()
+    backend.commit({"1": {"username": "a"}}, {"s1": {"owner_id": "1"}}, set())
+    backend.commit({}, {}, {"s1"})
+    backend.close()
+
+    backend = make_backend(tmp_path)
+    users, shared_files = backend.load()
+    backend.close()
+    assert users == {"1": {"username": "a"}}
+    assert shared_files == {}
+
+
+def test_failed_snapshot_keeps_journal(tmp_path, monkeypatch):
+    backend = make_backend(tmp_path)
+    backend.load()
+    backend.commit({"1": {"username": "a"}}, {"s1": {"owner_id": "1"}}, set())
+
+    def fail(path, data):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(storage_backends, "atomic_write_json", fail)
+    with pytest.raises(OSError):
+        backend.compact()
+    assert os.path.exists(backend.compacting_file)
+
+    # Изменение после неудачной компакции попадает в новый журнал
+    backend.commit({"2": {"username": "b"}}, {}, set())
+    backend.close()
+    monkeypatch.undo()
+
+    backend = make_backend(tmp_path)
+    users, shared_files = backend.load()
+    backend.close()
+    assert users == {"1": {"username": "a"}, "2": {"username": "b"}}
+    assert shared_files == {"s1": {"owner_id": "1"}}
+    # Восстановленное состояние свернуто в снимок
+    assert not os.path.exists(backend.compacting_file)
+
+
+def test_crash_during_compaction_replays_both_journals(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.load()
+    backend.commit({"1": {"username": "a"}}, {}, set())
+    backend.close()
+
+    # Процесс остановился после переименования журнала, но до записи снимка
+    os.replace(backend.journal_file, backend.compacting_file)
+    with open(backend.journal_file, "w", encoding="utf-8") as f:
+        f.write('{"op": "user", "id": "1", "data": {"username": "renamed"}}\n')
+        f.write('{"op": "user", "id": "2", "data"')
+
+    backend = make_backend(tmp_path)
+    users, _ = backend.load()
+    backend.close()
+    assert users == {"1": {"username": "renamed"}}
+
+
+def test_commit_after_torn_line_survives_restart(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.load()
+    backend.close()
+
+    # Сбой во время записи первой строки: целых записей в журнале нет
+    with open(backend.journal_file, "w", encoding="utf-8") as f:
+        f.write('{"op": "user", "id": "1", "da')
+
+    backend = make_backend(tmp_path)
+    assert backend.load() == ({}, {})
+    backend.commit({"2": {"username": "b"}}, {}, set())
+    backend.close()
+
+    backend = make_backend(tmp_path)
+    users, _ = backend.load()
+    backend.close()
+    assert users == {"2": {"username": "b"}}
+
+
+def test_torn_line_is_truncated_when_compaction_fails(tmp_path, monkeypatch):
+    backend = make_backend(tmp_path)
+    backend.load()
+    backend.commit({"1": {"username": "a"}}, {}, set())
+    backend.close()
+    with open(backend.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"op": "user", "id": "3"')
+
+    def fail(path, data):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(storage_backends, "atomic_write_json", fail)
+    backend = make_backend(tmp_path)
+    backend.load()
+    backend.commit({"2": {"username": "b"}}, {}, set())
+    backend.close()
+    monkeypatch.undo()
+
+    backend = make_backend(tmp_path)
+    users, _ = backend.load()
+    backend.close()
+    assert users == {"1": {"username": "a"}, "2": {"username": "b"}}
+
+
+def test_changes_are_journaled_as_updates(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.load()
+    user = {"username": "a", "verified": False, "shared_files": ["s1", "s2"], "received_files": []}
+    backend.commit({"1": user}, {"s1": {"owner_id": "1", "access_count": 0, "shared_with": []}}, set())
+    size = os.path.getsize(backend.journal_file)
+
+    backend.commit({"1": dict(user, verified=True, shared_files=["s2", "s3"])}, {}, set())
+    backend.commit({}, {"s1": {"owner_id": "1", "access_count": 1, "shared_with": ["5"]}}, set())
+    backend.commit({"1": dict(user, verified=True, shared_files=["s2", "s3"])}, {}, set())
+    backend.close()
+
+    with open(backend.journal_file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f.readlines()[2:]]
+    assert records == [
+        {"op": "user_update", "id": "1", "set": {"verified": True},
+         "append": {"shared_files": ["s3"]}, "discard": {"shared_files": ["s1"]}},
+        {"op": "share_update", "id": "s1", "set": {"access_count": 1},
+         "append": {"shared_with": ["5"]}},
+    ]
+    assert os.path.getsize(backend.journal_file) - size < 300
+
+    backend = make_backend(tmp_path)
+    users, shared_files = backend.load()
+    backend.close()
+    assert users["1"] == dict(user, verified=True, shared_files=["s2", "s3"])
+    assert shared_files["s1"] == {"owner_id": "1", "access_count": 1, "shared_with": ["5"]}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""Тесты записи изменений UserStorage в бэкенд."""
+
+import threading
+
+import pytest
+
+from storage_backends import StorageBackend
+from user_storage import UserStorage
+
+
+class FlakyBackend(StorageBackend):
+    """Бэкенд в памяти, первые failures записей которого завершаются ошибкой."""
+
+    def __init__(self, failures=0, shared_files=None):
+        self.failures = failures
+        self.shared_files = shared_files or {}
+        self.commits = []
+
+    def load(self):
+        return {}, self.shared_files
+
+    def commit(self, users, shared_files, deleted_shares):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(28, "No space left on device")
+        self.commits.append((set(users), set(shared_files), set(deleted_shares)))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def storage():
+    instances = []
+
+    def make(backend):
+        instance = UserStorage(backend=backend, write_behind=False)
+        instances.append(instance)
+        return instance
+
+    yield make
+    for instance in instances:
+        instance.close()
+
+
+def test_failed_commit_is_retried_on_next_flush(storage):
+    backend = FlakyBackend(failures=1)
+    user_storage = storage(backend)
+
+    user_storage.register_user(1, "alice", "Alice")
+    assert backend.commits == []
+
+    user_storage.flush()
+    assert backend.commits == [({"1"}, set(), set())]
+
+
+def test_failed_commit_keeps_later_changes(storage):
+    backend = FlakyBackend(failures=1)
+    user_storage = storage(backend)
+
+    user_storage.register_user(1, "alice", "Alice")
+    user_storage.register_user(2, "bob", "Bob")
+    assert backend.commits == [({"1", "2"}, set(), set())]
+
+
+def test_flush_under_data_lock_from_another_thread(storage):
+    backend = FlakyBackend()
+    user_storage = storage(backend)
+    user_storage.register_user(1, "alice", "Alice")
+
+    # Обработчик держит _lock и вызывает flush, пока фоновый поток тоже пишет
+    errors = []
+
+    def flush_loop():
+        try:
+            for _ in range(200):
+                user_storage.flush()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=flush_loop)
+    thread.start()
+    for i in range(200):
+        user_storage.register_user(i, f"user{i}", "User")
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert errors == []
+    committed = set().union(*(users for users, _, _ in backend.commits))
+    assert committed == {str(i) for i in range(200)}
+
+
+def _share(file_path, expires_at):
+    return {
+        "owner_id": "1",
+        "file_path": str(file_path),
+        "file_type": "document",
+        "file_name": "a.txt",
+        "created_at": "2026-01-01 00:00:00",
+        "expires_at": expires_at,
+        "access_count": 0,
+        "shared_with": [],
+    }
+
+
+def test_malformed_expiry_is_treated_as_expired(storage, tmp_path):
+    file_path = tmp_path / "a.txt"
+    file_path.write_text("a")
+    backend = FlakyBackend(shared_files={
+        "good": _share(file_path, "2999-01-01 00:00:00"),
+        "bad": _share(file_path, "01.01.2999"),
+        "missing": _share(file_path, None),
+    })
+    user_storage = storage(backend)
+
+    user_storage.cleanup_expired_shares()
+    assert set(user_storage.shared_files) == {"good"}
+    assert backend.commits[-1][2] == {"bad", "missing"}
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Готовые клавиатуры и тексты сообщений.
+
+Клавиатуры меню, справки и списков одинаковы для всех пользователей, поэтому
+собираются один раз при импорте. FrozenMarkup хранит готовый JSON
+reply_markup и при каждой отправке отдает его без повторной сериализации.
+Изменяемые части (строки пагинации, кнопки файлов) собираются из
+строк-фрагментов ButtonRow, JSON которых тоже вычисляется один раз; строки
+пагинации кэшируются.
+"""
+
+import json
+from functools import lru_cache
+
+from telebot import types
+
+
+class ButtonRow:
+    """Неизменяемая строка inline-кнопок с готовым JSON."""
+
+    __slots__ = ("json",)
+
+    def __init__(self, *buttons):
+        """
+        Args:
+            buttons: Пары (текст, callback_data)
+        """
+        self.json = json.dumps([
+            types.InlineKeyboardButton(text, callback_data=callback_data).to_dict()
+            for text, callback_data in buttons
+        ])
+
+
+class FrozenMarkup(types.JsonSerializable):
+    """
+    Неизменяемая inline-клавиатура из строк ButtonRow.
+
+    Передается в reply_markup вместо InlineKeyboardMarkup: telebot вызывает
+    to_json, который возвращает JSON, собранный при создании.
+    """
+
+    __slots__ = ("rows", "_json")
+
+    def __init__(self, *rows):
+        self.rows = rows
+        self._json = '{"inline_keyboard": [' + ", ".join(row.json for row in rows) + ']}'
+
+    def to_json(self):
+        return self._json
+
+    def to_dict(self):
+        return json.loads(self._json)
+
+    def extend(self, *rows):
+        """Новая клавиатура с дополнительными строками в конце."""
+        return FrozenMarkup(*self.rows, *rows)
+
+
+def button_markup(*rows):
+    """Клавиатура из строк, заданных списками пар (текст, callback_data)."""
+    return FrozenMarkup(*(ButtonRow(*row) for row in rows))
+
+
+# Общие строки кнопок
+MENU_ROW = ButtonRow(("🏠 Главное меню", "cmd:menu"))
+FILTER_ROW = ButtonRow(("📷 Фото", "cmd:photos"), ("🎥 Видео", "cmd:videos"), ("📑 Документы", "cmd:documents"))
+CANCEL_JOB_ROW = ButtonRow(("✖️ Отменить", "cmd:cancel_job"))
+
+MENU_MARKUP = FrozenMarkup(MENU_ROW)
+FILTER_MARKUP = FrozenMarkup(FILTER_ROW)
+JOB_CANCEL_MARKUP = FrozenMarkup(CANCEL_JOB_ROW)
+JOB_CANCEL_MENU_MARKUP = JOB_CANCEL_MARKUP.extend(MENU_ROW)
+
+# Главное меню после /start
+MAIN_MENU_MARKUP = button_markup(
+    [("🖼️ Фотографии", "cmd:photos"), ("🎬 Видеофайлы", "cmd:videos")],
+    [("📄 Документы", "cmd:documents"), ("📁 Все файлы", "files")],
+    [("📤 Мои общие файлы", "cmd:myshared"), ("📥 Полученные файлы", "cmd:received")],
+    [("🗃️ Скачать ZIP-архив", "cmd:download_zip")],
+    [("❓ Помощь", "cmd:help"), ("ℹ️ О боте", "cmd:about")],
+)
+
+# Главное меню по кнопке "Главное меню" (перерисовка сообщения)
+MAIN_MENU_COMPACT_MARKUP = button_markup(
+    [("🖼️ Фотографии", "cmd:photos"), ("🎬 Видеофайлы", "cmd:videos")],
+    [("📄 Документы", "cmd:documents"), ("📁 Все файлы", "files")],
+    [("🗃️ Скачать ZIP-архив", "cmd:download_zip")],
+    [("❓ Помощь", "cmd:help"), ("ℹ️ О боте", "cmd:about")],
+)
+
+# Информационный баннер с инструкцией
+UPLOAD_BANNER = "📤 Отправьте мне файл, чтобы сохранить его!"
+
+START_TEXT = (
+    "👋 <b>Привет, {first_name}!</b>\n\n"
+    "🤖 Я <b>File Storage Bot</b> - ваш помощник для хранения и организации файлов.\n\n"
+    "📌 <b>Основные возможности:</b>\n"
+    "• Сохранение фото, видео и документов\n"
+    "• Удобная организация по категориям\n"
+    "• Простой поиск и просмотр\n"
+    "• Обмен файлами с другими пользователями\n"
+    "• Скачивание всех файлов в ZIP-архиве\n\n"
+    f"{UPLOAD_BANNER}"
+)
+
+MAIN_MENU_TEXT = (
+    "👋 <b>Главное меню</b>\n\n"
+    "🤖 Я <b>File Storage Bot</b> - ваш помощник для хранения и организации файлов.\n\n"
+    "📌 <b>Основные возможности:</b>\n"
+    "• Сохранение фото, видео и документов\n"
+    "• Удобная организация по категориям\n"
+    "• Простой поиск и просмотр\n\n"
+    f"{UPLOAD_BANNER}"
+)
+
+# Справка по /help и по кнопке "Помощь"
+HELP_MARKUP = button_markup(
+    [("🖼️ Просмотр фото", "cmd:photos"), ("🎬 Просмотр видео", "cmd:videos")],
+    [("📄 Просмотр документов", "cmd:documents"), ("📁 Все файлы", "files")],
+    [("📤 Мои общие файлы", "cmd:myshared"), ("📥 Полученные файлы", "cmd:received")],
+    [("🗃️ Скачать ZIP-архив", "cmd:download_zip")],
+    [("🏠 Главное меню", "cmd:menu")],
+)
+
+HELP_COMPACT_MARKUP = button_markup(
+    [("🖼️ Просмотр фото", "cmd:photos"), ("🎬 Просмотр видео", "cmd:videos")],
+    [("📄 Просмотр документов", "cmd:documents"), ("📁 Все файлы", "files")],
+    [("📤 Мои общие файлы", "cmd:myshared"), ("📥 Полученные файлы", "cmd:received")],
+    [("🏠 Главное меню", "cmd:menu")],
+)
+
+HELP_COMPACT_TEXT = (
+    "<b>📚 Справка по использованию бота</b>\n\n"
+    "<b>📋 Доступные команды:</b>\n"
+    "• /start - Запустить бота и показать главное меню\n"
+    "• /help - Показать эту справку\n"
+    "• /files - Показать все сохраненные файлы\n"
+    "• /photos - Показать только фотографии\n"
+    "• /videos - Показать только видеофайлы\n"
+    "• /documents - Показать только документы\n"
+    "• /share_ID - Получить доступ к общему файлу\n\n"
+
+    "<b>💾 Как сохранить файл:</b>\n"
+    "Просто отправьте мне фото, видео или документ, и я автоматически сохраню его в соответствующей категории.\n\n"
+
+    "<b>🔍 Как найти файлы:</b>\n"
+    "Используйте кнопки ниже для просмотра файлов по категориям. При просмотре доступны кнопки навигации и фильтрации.\n\n"
+
+    "<b>📤 Обмен файлами:</b>\n"
+    "1. Откройте файл через меню просмотра файлов\n"
+    "2. Нажмите кнопку \"Поделиться файлом\"\n"
+    "3. Отправьте полученную команду другому пользователю\n"
+    "4. Пользователь может получить доступ к файлу, отправив эту команду боту\n\n"
+
+    "<b>✨ Дополнительные возможности:</b>\n"
+    "• Просмотр подробной информации о файле\n"
+    "• Удобная навигация между категориями\n"
+    "• Обмен файлами между пользователями\n"
+    "• Управление своими общими файлами"
+)
+
+HELP_TEXT = HELP_COMPACT_TEXT + "\n• Скачивание всех файлов в ZIP-архиве"
+
+# Информация о боте: статистика подставляется через format
+ABOUT_MARKUP = button_markup(
+    [("🏠 Главное меню", "cmd:menu")],
+    [("📚 Справка", "cmd:help")],
+)
+
+ABOUT_TEXT = (
+    "<b>🤖 File Storage Bot v1.0</b>\n\n"
+    "<b>О боте:</b>\n"
+    "Бот для хранения и организации файлов в удобном формате.\n\n"
+
+    "<b>📊 Статистика файлов:</b>\n"
+    "• 🖼️ Фотографии: {photos_count}\n"
+    "• 🎬 Видеофайлы: {videos_count}\n"
+    "• 📄 Документы: {docs_count}\n"
+    "• 📁 Всего файлов: {total_count}\n\n"
+
+    "<b>🔄 Обмен файлами:</b>\n"
+    "• 📤 Вы поделились: {shared_count} файлами\n"
+    "• 📥 Вы получили: {received_count} файлов\n\n"
+
+    "<b>💻 Техническая информация:</b>\n"
+    "• Разработан с использованием pyTelegramBotAPI\n"
+    "• Имеет удобную категоризацию файлов\n"
+    "• Поддерживает фото, видео и документы\n"
+    "• Поддерживает обмен файлами\n"
+    "• Скачивание всех файлов в ZIP-архиве\n"
+    "• Максимальный размер файла: 50 МБ\n\n"
+
+    "<b>Используйте /help для получения справки по командам.</b>"
+)
+
+ABOUT_COMPACT_TEXT = (
+    "<b>🤖 File Storage Bot v1.0</b>\n\n"
+    "<b>О боте:</b>\n"
+    "Бот для хранения и организации файлов в удобном формате.\n\n"
+
+    "<b>📊 Статистика файлов:</b>\n"
+    "• 🖼️ Фотографии: {photos_count}\n"
+    "• 🎬 Видеофайлы: {videos_count}\n"
+    "• 📄 Документы: {docs_count}\n"
+    "• 📁 Всего файлов: {total_count}\n\n"
+
+    "<b>💻 Техническая информация:</b>\n"
+    "• Разработан с использованием pyTelegramBotAPI\n"
+    "• Имеет удобную категоризацию файлов\n"
+    "• Поддерживает фото, видео и документы\n"
+    "• Максимальный размер файла: 50 МБ\n\n"
+
+    "<b>Используйте /help для получения справки по командам.</b>"
+)
+
+# Меню выбора типа архива
+DOWNLOAD_ZIP_MARKUP = button_markup(
+    [("📁 Все файлы", "cmd:zip_all"), ("🖼️ Только фото", "cmd:zip_photos")],
+    [("🎬 Только видео", "cmd:zip_videos"), ("📄 Только документы", "cmd:zip_docs")],
+    [("🏠 Главное меню", "cmd:menu")],
+)
+
+DOWNLOAD_ZIP_TEXT = (
+    "<b>🗃️ Скачать ZIP-архив</b>\n\n"
+    "Выберите, какие файлы вы хотите включить в архив:\n\n"
+    "• <b>Все файлы</b> - ZIP-архив со всеми вашими файлами\n"
+    "• <b>Только фото</b> - архив только с фотографиями\n"
+    "• <b>Только видео</b> - архив только с видеофайлами\n"
+    "• <b>Только документы</b> - архив только с документами\n\n"
+    "⚠️ <b>Внимание:</b> В зависимости от размера и количества файлов, создание архива может занять некоторое время."
+)
+
+
+@lru_cache(maxsize=512)
+def paging_row(page, file_type, has_previous, has_next):
+    """
+    Строка кнопок "Назад"/"Вперед" для списка файлов.
+
+    Returns:
+        ButtonRow или None, если переходить некуда
+    """
+    filter_name = file_type or "all"
+    buttons = []
+    if has_previous:
+        buttons.append(("⬅️ Назад", f"page:{page - 1}:{filter_name}"))
+    if has_next:
+        buttons.append(("Вперед ➡️", f"page:{page + 1}:{filter_name}"))
+    return ButtonRow(*buttons) if buttons else None
@@ -2,13 +2,25 @@
 # -*- coding: utf-8 -*-
 
 import os
+import copy
 import json
 import time
+import atexit
+import signal
 import logging
+import functools
+import threading
 import uuid
+import heapq
 import urllib.parse
 from datetime import datetime, timedelta
-from config import BOT_USERNAME, SHARE_LINK_TTL
+from config import (
+    BOT_USERNAME, SHARE_LINK_TTL, STORAGE_BACKEND, STORAGE_DB_PATH,
+    STORAGE_JOURNAL_PATH, STORAGE_JOURNAL_COMPACT_BYTES,
+    STORAGE_WRITE_BEHIND, STORAGE_FLUSH_INTERVAL_MS, STORAGE_FLUSH_MAX_MUTATIONS,
+    SHARE_SWEEP_INTERVAL
+)
+from storage_backends import create_storage_backend
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,57 +35,303 @@ SHARED_FILES_DATA = "shared_files.json"
 
 # Импортируем из конфига, если значения не переданы с аргументами
 
+def synchronized(method):
+    """Декоратор: выполнить метод хранилища под его блокировкой."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class UserStorage:
     """Класс для хранения информации о пользователях и общих файлах."""
     
-    def __init__(self):
-        """Инициализация хранилища пользователей."""
+    def __init__(self, backend=None, write_behind=STORAGE_WRITE_BEHIND,
+                 flush_interval_ms=STORAGE_FLUSH_INTERVAL_MS,
+                 flush_max_mutations=STORAGE_FLUSH_MAX_MUTATIONS):
+        """Инициализация хранилища пользователей.
+        
+        Args:
+            backend: Бэкенд хранения данных (по умолчанию выбирается по STORAGE_BACKEND)
+            write_behind: Сохранять изменения в фоновом потоке, а не в каждом вызове
+            flush_interval_ms: Максимальная задержка фонового сохранения в миллисекундах
+            flush_max_mutations: Количество изменений, после которого сохранение запускается сразу
+        """
         self.users = {}
         self.shared_files = {}
+        self.backend = backend or create_storage_backend(
+            STORAGE_BACKEND, USERS_DATA_FILE, SHARED_FILES_DATA, STORAGE_DB_PATH,
+            STORAGE_JOURNAL_PATH, STORAGE_JOURNAL_COMPACT_BYTES
+        )
+        # Блокировка данных хранилища и отдельная блокировка записи в бэкенд
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        # Записи, измененные с момента последнего сохранения
+        self._dirty_users = set()
+        self._dirty_shares = set()
+        self._deleted_shares = set()
+        self._pending_mutations = 0
+        
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_max_mutations = max(1, flush_max_mutations)
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flusher = None
+        self._sweeper = None
+        
+        # Очередь с приоритетом (время истечения, ID ссылки) для очистки ссылок
+        self._expiry_heap = []
+        
+        # Обратные индексы общих файлов. Списки "shared_files" и "received_files"
+        # пользователей хранятся в памяти как упорядоченные множества (dict без значений)
+        self._share_recipients = {}  # ID ссылки -> множество ID получателей
+        self._path_index = {}        # путь к файлу -> множество ID ссылок
+        self._name_index = {}        # имя файла -> множество ID ссылок
+        
         self.load_data()
         # Исправляем пути к файлам в шаринге при запуске
         self.fix_shared_file_paths()
+        
+        if self.write_behind:
+            self._flusher = threading.Thread(target=self._flusher_loop, name="user-storage-flusher")
+            self._flusher.daemon = True
+            self._flusher.start()
     
     def load_data(self):
         """Загрузить данные о пользователях и общих файлах."""
-        # Загрузка данных пользователей
-        if os.path.exists(USERS_DATA_FILE):
-            try:
-                with open(USERS_DATA_FILE, 'r', encoding='utf-8') as f:
-                    self.users = json.load(f)
-                logger.info(f"Загружены данные о {len(self.users)} пользователях")
-            except Exception as e:
-                logger.error(f"Ошибка при загрузке данных пользователей: {e}")
-                self.users = {}
-        
-        # Загрузка данных об общих файлах
-        if os.path.exists(SHARED_FILES_DATA):
-            try:
-                with open(SHARED_FILES_DATA, 'r', encoding='utf-8') as f:
-                    self.shared_files = json.load(f)
-                logger.info(f"Загружены данные о {len(self.shared_files)} общих файлах")
-            except Exception as e:
-                logger.error(f"Ошибка при загрузке данных об общих файлах: {e}")
-                self.shared_files = {}
-    
-    def save_data(self):
-        """Сохранить данные о пользователях и общих файлах."""
-        # Сохранение данных пользователей
         try:
-            with open(USERS_DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, ensure_ascii=False, indent=2)
-            logger.info(f"Сохранены данные о {len(self.users)} пользователях")
+            self.users, self.shared_files = self.backend.load()
         except Exception as e:
-            logger.error(f"Ошибка при сохранении данных пользователей: {e}")
+            logger.error(f"Ошибка при загрузке данных хранилища: {e}")
+            self.users, self.shared_files = {}, {}
+        
+        # Время истечения храним в секундах эпохи, строку разбираем один раз
+        self._expiry_heap = []
+        for share_id, share_info in self.shared_files.items():
+            if "expires_ts" not in share_info:
+                try:
+                    share_info["expires_ts"] = datetime.strptime(
+                        share_info["expires_at"], "%Y-%m-%d %H:%M:%S"
+                    ).timestamp()
+                except (KeyError, TypeError, ValueError) as e:
+                    # Ссылка с поврежденным сроком действия считается истекшей
+                    # и удаляется при ближайшей очистке
+                    logger.warning(f"Некорректный срок действия ссылки {share_id}: {e}")
+                    share_info["expires_ts"] = 0.0
+            self._expiry_heap.append((share_info["expires_ts"], share_id))
+        heapq.heapify(self._expiry_heap)
+        
+        self._rebuild_indexes()
+    
+    def _rebuild_indexes(self):
+        """Построить обратные индексы по загруженным данным."""
+        self._share_recipients = {}
+        self._path_index = {}
+        self._name_index = {}
+        
+        for user_id, user_info in self.users.items():
+            user_info["shared_files"] = dict.fromkeys(user_info.get("shared_files", []))
+            user_info["received_files"] = dict.fromkeys(user_info.get("received_files", []))
+            for share_id in user_info["received_files"]:
+                self._share_recipients.setdefault(share_id, set()).add(user_id)
+        
+        for share_id, share_info in self.shared_files.items():
+            self._index_share_path(share_id, share_info["file_path"])
+            for user_id in share_info.get("shared_with", []):
+                self._share_recipients.setdefault(share_id, set()).add(user_id)
+    
+    def _index_share_path(self, share_id, file_path):
+        """Добавить ссылку в индексы по пути и имени файла."""
+        self._path_index.setdefault(file_path, set()).add(share_id)
+        self._name_index.setdefault(os.path.basename(file_path), set()).add(share_id)
+    
+    def _unindex_share_path(self, share_id, file_path):
+        """Удалить ссылку из индексов по пути и имени файла."""
+        for index, key in ((self._path_index, file_path), (self._name_index, os.path.basename(file_path))):
+            share_ids = index.get(key)
+            if share_ids is not None:
+                share_ids.discard(share_id)
+                if not share_ids:
+                    del index[key]
+    
+    def _set_share_path(self, share_id, file_path):
+        """Изменить путь к файлу в ссылке с обновлением индексов."""
+        share_info = self.shared_files[share_id]
+        self._unindex_share_path(share_id, share_info["file_path"])
+        share_info["file_path"] = file_path
+        self._index_share_path(share_id, file_path)
+        self._mark_share(share_id)
+    
+    def _remove_share(self, share_id):
+        """Удалить ссылку вместе с записями у владельца и получателей.
+        
+        Стоимость пропорциональна числу получателей ссылки.
+        
+        Returns:
+            Удаленная запись об общем файле
+        """
+        share_info = self.shared_files.pop(share_id)
+        self._mark_share_deleted(share_id)
+        self._unindex_share_path(share_id, share_info["file_path"])
         
-        # Сохранение данных об общих файлах
+        # Удаляем из списка пользователя-владельца
+        owner_id = share_info["owner_id"]
+        owner = self.users.get(owner_id)
+        if owner is not None and share_id in owner["shared_files"]:
+            del owner["shared_files"][share_id]
+            self._mark_user(owner_id)
+        
+        # Удаляем из списков получателей
+        for user_id in self._share_recipients.pop(share_id, ()):
+            user_info = self.users.get(user_id)
+            if user_info is not None and share_id in user_info["received_files"]:
+                del user_info["received_files"][share_id]
+                self._mark_user(user_id)
+        
+        return share_info
+    
+    def save_data(self):
+        """Сохранить изменения о пользователях и общих файлах.
+        
+        В режиме отложенной записи только отмечает хранилище измененным,
+        а запись выполняет фоновый поток.
+        """
+        if not self.write_behind:
+            self.flush()
+            return
+        
+        with self._lock:
+            self._pending_mutations += 1
+            if self._pending_mutations >= self.flush_max_mutations:
+                self._flush_event.set()
+    
+    def flush(self):
+        """Записать все накопленные изменения в бэкенд.
+        
+        Блокировки всегда берутся в одном порядке: сначала _lock, затем
+        _flush_lock (в синхронном режиме flush вызывается под _lock).
+        Если запись не удалась, изменения снова отмечаются для сохранения.
+        """
+        self._lock.acquire()
+        data_locked = True
         try:
-            with open(SHARED_FILES_DATA, 'w', encoding='utf-8') as f:
-                json.dump(self.shared_files, f, ensure_ascii=False, indent=2)
-            logger.info(f"Сохранены данные о {len(self.shared_files)} общих файлах")
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении данных об общих файлах: {e}")
+            with self._flush_lock:
+                dirty_users = self._dirty_users
+                dirty_shares = self._dirty_shares
+                deleted_shares = self._deleted_shares
+                users = {
+                    user_id: self._export_user(self.users[user_id])
+                    for user_id in dirty_users if user_id in self.users
+                }
+                shared_files = {
+                    share_id: copy.deepcopy(self.shared_files[share_id])
+                    for share_id in dirty_shares if share_id in self.shared_files
+                }
+                
+                self._dirty_users = set()
+                self._dirty_shares = set()
+                self._deleted_shares = set()
+                self._pending_mutations = 0
+                
+                # Запись в бэкенд выполняется без блокировки данных,
+                # чтобы обработчики не ждали дискового ввода-вывода
+                self._lock.release()
+                data_locked = False
+                
+                if not (users or shared_files or deleted_shares):
+                    return
+                try:
+                    self.backend.commit(users, shared_files, deleted_shares)
+                    return
+                except Exception as e:
+                    logger.error(f"Ошибка при сохранении данных хранилища: {e}")
+            
+            # _flush_lock уже отпущен: возвращаем изменения под _lock
+            with self._lock:
+                self._restore_dirty(dirty_users, dirty_shares, deleted_shares)
+        finally:
+            if data_locked:
+                self._lock.release()
+    
+    def _restore_dirty(self, dirty_users, dirty_shares, deleted_shares):
+        """Снова отметить для сохранения изменения, которые не удалось записать."""
+        self._dirty_users |= dirty_users
+        for share_id in dirty_shares:
+            # Ссылка могла быть удалена после неудачной записи
+            if share_id in self.shared_files:
+                self._dirty_shares.add(share_id)
+        for share_id in deleted_shares:
+            # Ссылку с тем же ID могли создать заново - тогда сохраняем ее запись
+            if share_id in self.shared_files:
+                self._dirty_shares.add(share_id)
+            else:
+                self._deleted_shares.add(share_id)
+        self._pending_mutations += 1
+    
+    def _flusher_loop(self):
+        """Фоновый поток отложенной записи."""
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+    
+    def start_expiry_sweeper(self, interval=SHARE_SWEEP_INTERVAL):
+        """Запустить фоновый поток периодической очистки истекших ссылок.
+        
+        Args:
+            interval: Период очистки в секундах
+        """
+        if self._sweeper:
+            return
+        
+        def sweeper_loop():
+            while not self._stop_event.is_set():
+                try:
+                    self.cleanup_expired_shares()
+                except Exception as e:
+                    logger.error(f"Ошибка при очистке истекших ссылок: {e}")
+                self._stop_event.wait(interval)
+        
+        self._sweeper = threading.Thread(target=sweeper_loop, name="user-storage-expiry-sweeper")
+        self._sweeper.daemon = True
+        self._sweeper.start()
+    
+    def close(self):
+        """Остановить фоновую запись, сохранить изменения и закрыть бэкенд."""
+        with self._lock:
+            if self._stop_event.is_set():
+                return
+            self._stop_event.set()
+        self._flush_event.set()
+        if self._flusher and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=5)
+        self.flush()
+        self.backend.close()
+        logger.info("Хранилище пользователей закрыто")
+    
+    @staticmethod
+    def _export_user(user_info):
+        """Копия записи пользователя для сохранения (множества -> списки)."""
+        record = dict(user_info)
+        record["shared_files"] = list(user_info.get("shared_files", ()))
+        record["received_files"] = list(user_info.get("received_files", ()))
+        return record
+    
+    def _mark_user(self, user_id_str):
+        """Отметить запись пользователя как измененную."""
+        self._dirty_users.add(user_id_str)
+    
+    def _mark_share(self, share_id):
+        """Отметить запись общего файла как измененную."""
+        self._dirty_shares.add(share_id)
+    
+    def _mark_share_deleted(self, share_id):
+        """Отметить общий файл как удаленный."""
+        self._dirty_shares.discard(share_id)
+        self._deleted_shares.add(share_id)
     
+    @synchronized
     def register_user(self, user_id, username, first_name):
         """Регистрация нового пользователя или обновление существующего."""
         user_id_str = str(user_id)
@@ -90,27 +348,32 @@ class UserStorage:
                 "first_name": first_name,
                 "registered_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "last_active": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "shared_files": [],
-                "received_files": [],
+                "shared_files": dict(),
+                "received_files": dict(),
                 "verified": False
             }
             logger.info(f"Зарегистрирован новый пользователь: {username} (ID: {user_id})")
         
+        self._mark_user(user_id_str)
         self.save_data()
         return self.users[user_id_str]
     
+    @synchronized
     def get_user(self, user_id):
         """Получить информацию о пользователе."""
         user_id_str = str(user_id)
         return self.users.get(user_id_str)
     
+    @synchronized
     def update_user_activity(self, user_id):
         """Обновить время последней активности пользователя."""
         user_id_str = str(user_id)
         if user_id_str in self.users:
             self.users[user_id_str]["last_active"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._mark_user(user_id_str)
             self.save_data()
             
+    @synchronized
     def verify_user(self, user_id, password):
         """Проверить пароль пользователя и установить статус верификации.
         
@@ -138,6 +401,7 @@ class UserStorage:
         # Админу не нужна верификация
         if BOT_ADMIN_ID and user_id_str == str(BOT_ADMIN_ID):
             self.users[user_id_str]["verified"] = True
+            self._mark_user(user_id_str)
             self.save_data()
             logger.info(f"Администратор {user_id} автоматически верифицирован")
             return True
@@ -145,6 +409,7 @@ class UserStorage:
         # Проверяем пароль
         if password == SPECIAL_PASSWORD:
             self.users[user_id_str]["verified"] = True
+            self._mark_user(user_id_str)
             self.save_data()
             logger.info(f"Пользователь {user_id} успешно верифицирован")
             return True
@@ -152,6 +417,7 @@ class UserStorage:
             logger.warning(f"Неудачная попытка верификации пользователя {user_id}")
             return False
             
+    @synchronized
     def is_user_verified(self, user_id):
         """Проверить, верифицирован ли пользователь.
         
@@ -169,15 +435,22 @@ class UserStorage:
         
         return self.users[user_id_str].get("verified", False)
     
-    def create_share_link(self, user_id, file_path, file_type, file_name, ttl=SHARE_LINK_TTL):
+    @synchronized
+    def create_share_link(self, user_id, file_path, file_type, file_name, ttl=SHARE_LINK_TTL,
+                          reuse=True, extend_ttl=False):
         """Создать ссылку для обмена файлом.
         
+        Если у пользователя уже есть действующая ссылка на этот файл, по умолчанию
+        возвращается она, и хранилище не перезаписывается.
+        
         Args:
             user_id: ID пользователя, создающего ссылку
             file_path: Путь к файлу
             file_type: Тип файла (photo, video, document)
             file_name: Имя файла
             ttl: Время жизни ссылки в часах
+            reuse: Вернуть существующую действующую ссылку вместо создания новой
+            extend_ttl: Продлить существующую ссылку до now + ttl
             
         Returns:
             Уникальный идентификатор общего файла
@@ -194,12 +467,26 @@ class UserStorage:
             logger.error(f"Файл не существует: {file_path}")
             return None
         
+        # Расчет времени истечения ссылки
+        expiry = datetime.now() + timedelta(hours=ttl)
+        expiry_time = expiry.strftime("%Y-%m-%d %H:%M:%S")
+        
+        if reuse:
+            share_id = self._find_active_share(user_id_str, file_path)
+            if share_id is not None:
+                share_info = self.shared_files[share_id]
+                if extend_ttl and expiry.timestamp() > share_info["expires_ts"]:
+                    share_info["expires_at"] = expiry_time
+                    share_info["expires_ts"] = expiry.timestamp()
+                    heapq.heappush(self._expiry_heap, (share_info["expires_ts"], share_id))
+                    self._mark_share(share_id)
+                    self.save_data()
+                    logger.info(f"Продлена ссылка {share_id} до {expiry_time}")
+                return share_id
+        
         # Генерация уникального идентификатора
         share_id = str(uuid.uuid4())
         
-        # Расчет времени истечения ссылки
-        expiry_time = (datetime.now() + timedelta(hours=ttl)).strftime("%Y-%m-%d %H:%M:%S")
-        
         # Добавление файла в список общих файлов
         self.shared_files[share_id] = {
             "owner_id": user_id_str,
@@ -208,21 +495,33 @@ class UserStorage:
             "file_name": file_name,
             "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "expires_at": expiry_time,
+            "expires_ts": expiry.timestamp(),
             "access_count": 0,
             "shared_with": []
         }
         
         # Добавление в список общих файлов пользователя
-        if "shared_files" not in self.users[user_id_str]:
-            self.users[user_id_str]["shared_files"] = []
-        
-        self.users[user_id_str]["shared_files"].append(share_id)
+        self.users[user_id_str]["shared_files"][share_id] = None
+        self._index_share_path(share_id, file_path)
+        heapq.heappush(self._expiry_heap, (self.shared_files[share_id]["expires_ts"], share_id))
         
+        self._mark_share(share_id)
+        self._mark_user(user_id_str)
         self.save_data()
         logger.info(f"Создана ссылка для обмена файлом '{file_name}' пользователем {user_id} (ID ссылки: {share_id})")
         
         return share_id
     
+    def _find_active_share(self, user_id_str, file_path):
+        """Найти действующую ссылку пользователя на файл через индекс путей."""
+        now = time.time()
+        for share_id in self._path_index.get(file_path, ()):
+            share_info = self.shared_files[share_id]
+            if share_info["owner_id"] == user_id_str and share_info["expires_ts"] > now:
+                return share_id
+        return None
+    
+    @synchronized
     def get_shared_file(self, share_id):
         """Получить информацию о общем файле."""
         if share_id not in self.shared_files:
@@ -231,13 +530,13 @@ class UserStorage:
         shared_file = self.shared_files[share_id]
         
         # Проверяем, не истекла ли ссылка
-        expires_at = datetime.strptime(shared_file["expires_at"], "%Y-%m-%d %H:%M:%S")
-        if expires_at < datetime.now():
+        if shared_file["expires_ts"] < time.time():
             logger.info(f"Ссылка с ID {share_id} истекла")
             return None
         
         return shared_file
         
+    @synchronized
     def get_referral_link(self, share_id):
         """Создать реферальную ссылку для доступа к файлу.
         
@@ -264,6 +563,7 @@ class UserStorage:
         
         return share_url
     
+    @synchronized
     def access_shared_file(self, share_id, user_id):
         """Получить доступ к общему файлу.
         
@@ -300,55 +600,51 @@ class UserStorage:
         # Обновляем путь к файлу, если он изменился
         if correct_path != shared_file["file_path"]:
             logger.info(f"Исправлен путь к файлу: {shared_file['file_path']} -> {correct_path}")
-            self.shared_files[share_id]["file_path"] = correct_path
+            self._set_share_path(share_id, correct_path)
             self.save_data()
         
         # Обновляем информацию о доступе
         self.shared_files[share_id]["access_count"] += 1
         
         # Добавляем пользователя в список тех, кому был открыт доступ
-        if user_id_str not in self.shared_files[share_id]["shared_with"]:
+        recipients = self._share_recipients.setdefault(share_id, set())
+        if user_id_str not in recipients:
+            recipients.add(user_id_str)
             self.shared_files[share_id]["shared_with"].append(user_id_str)
         
         # Добавляем файл в список полученных для пользователя
-        if "received_files" not in self.users[user_id_str]:
-            self.users[user_id_str]["received_files"] = []
-        
-        if share_id not in self.users[user_id_str]["received_files"]:
-            self.users[user_id_str]["received_files"].append(share_id)
+        self.users[user_id_str]["received_files"][share_id] = None
         
+        self._mark_share(share_id)
+        self._mark_user(user_id_str)
         self.save_data()
         logger.info(f"Пользователь {user_id} получил доступ к файлу с ID {share_id}")
         
         return shared_file
     
+    @synchronized
     def cleanup_expired_shares(self):
-        """Очистить истекшие ссылки на файлы."""
-        current_time = datetime.now()
+        """Очистить истекшие ссылки на файлы.
+        
+        Из очереди извлекаются только ссылки, срок которых уже наступил.
+        Записи удаленных или продленных ссылок пропускаются.
+        """
+        current_time = time.time()
         expired_shares = []
         
-        for share_id, share_info in list(self.shared_files.items()):
-            expires_at = datetime.strptime(share_info["expires_at"], "%Y-%m-%d %H:%M:%S")
-            if expires_at < current_time:
-                expired_shares.append(share_id)
-                # Удаляем из списка общих файлов
-                self.shared_files.pop(share_id)
-                
-                # Удаляем из списка пользователя
-                owner_id = share_info["owner_id"]
-                if owner_id in self.users and "shared_files" in self.users[owner_id]:
-                    if share_id in self.users[owner_id]["shared_files"]:
-                        self.users[owner_id]["shared_files"].remove(share_id)
-                
-                # Удаляем из списков получателей
-                for user_id, user_info in self.users.items():
-                    if "received_files" in user_info and share_id in user_info["received_files"]:
-                        user_info["received_files"].remove(share_id)
+        while self._expiry_heap and self._expiry_heap[0][0] < current_time:
+            expires_ts, share_id = heapq.heappop(self._expiry_heap)
+            share_info = self.shared_files.get(share_id)
+            if share_info is None or share_info["expires_ts"] != expires_ts:
+                continue
+            expired_shares.append(share_id)
+            self._remove_share(share_id)
         
         if expired_shares:
             self.save_data()
             logger.info(f"Очищено {len(expired_shares)} истекших ссылок: {', '.join(expired_shares)}")
     
+    @synchronized
     def get_user_shared_files(self, user_id):
         """Получить список файлов, которыми поделился пользователь."""
         user_id_str = str(user_id)
@@ -357,7 +653,7 @@ class UserStorage:
             return []
         
         # Получаем список идентификаторов общих файлов пользователя
-        shared_file_ids = self.users[user_id_str].get("shared_files", [])
+        shared_file_ids = self.users[user_id_str]["shared_files"]
         
         # Фильтруем только существующие и не истекшие файлы
         valid_shares = []
@@ -371,6 +667,7 @@ class UserStorage:
         
         return valid_shares
     
+    @synchronized
     def get_user_received_files(self, user_id):
         """Получить список файлов, полученных пользователем."""
         user_id_str = str(user_id)
@@ -379,7 +676,7 @@ class UserStorage:
             return []
         
         # Получаем список идентификаторов полученных файлов
-        received_file_ids = self.users[user_id_str].get("received_files", [])
+        received_file_ids = self.users[user_id_str]["received_files"]
         
         # Фильтруем только существующие и не истекшие файлы
         valid_shares = []
@@ -393,6 +690,7 @@ class UserStorage:
         
         return valid_shares
     
+    @synchronized
     def cleanup_by_filepath(self, file_path):
         """Удалить все общие ссылки на конкретный файл.
         
@@ -402,23 +700,13 @@ class UserStorage:
         Returns:
             Количество удаленных ссылок
         """
-        # Сохраняем ID файлов для удаления
-        shares_to_delete = []
+        # Ссылки, которые указывают точно на данный путь
+        shares_to_delete = set(self._path_index.get(file_path, ()))
         
-        # Находим все общие файлы, которые указывают на данный путь или относятся к удаленному файлу
-        for share_id, share_info in list(self.shared_files.items()):
-            # Проверяем точное совпадение пути
-            if share_info["file_path"] == file_path:
-                shares_to_delete.append(share_id)
-            else:
-                # Проверяем, относится ли запись к тому же файлу под другим путем
-                file_name = os.path.basename(file_path)
-                share_file_name = os.path.basename(share_info["file_path"])
-                
-                if file_name == share_file_name:
-                    # Проверяем существование файла
-                    if not os.path.exists(share_info["file_path"]):
-                        shares_to_delete.append(share_id)
+        # Ссылки на тот же файл под другим путем, который уже не существует
+        for share_id in self._name_index.get(os.path.basename(file_path), ()):
+            if share_id not in shares_to_delete and not os.path.exists(self.shared_files[share_id]["file_path"]):
+                shares_to_delete.add(share_id)
         
         # Если нет ссылок на этот файл, возвращаем 0
         if not shares_to_delete:
@@ -426,21 +714,7 @@ class UserStorage:
         
         # Удаляем все найденные ссылки
         for share_id in shares_to_delete:
-            # Получаем ID владельца
-            owner_id = self.shared_files[share_id]["owner_id"]
-            
-            # Удаляем из списка общих файлов
-            self.shared_files.pop(share_id)
-            
-            # Удаляем из списка пользователя-владельца
-            if owner_id in self.users and "shared_files" in self.users[owner_id]:
-                if share_id in self.users[owner_id]["shared_files"]:
-                    self.users[owner_id]["shared_files"].remove(share_id)
-            
-            # Удаляем из списков получателей
-            for user_id, user_info in self.users.items():
-                if "received_files" in user_info and share_id in user_info["received_files"]:
-                    user_info["received_files"].remove(share_id)
+            self._remove_share(share_id)
         
         # Сохраняем изменения
         self.save_data()
@@ -448,6 +722,7 @@ class UserStorage:
         
         return len(shares_to_delete)
     
+    @synchronized
     def delete_share(self, share_id, user_id):
         """Удалить общий доступ к файлу (только для владельца).
         
@@ -471,23 +746,15 @@ class UserStorage:
             logger.error(f"Пользователь {user_id} не является владельцем файла с ID {share_id}")
             return False
         
-        # Удаляем из списка общих файлов
-        self.shared_files.pop(share_id)
-        
-        # Удаляем из списка пользователя
-        if "shared_files" in self.users[user_id_str] and share_id in self.users[user_id_str]["shared_files"]:
-            self.users[user_id_str]["shared_files"].remove(share_id)
-        
-        # Удаляем из списков получателей
-        for user_id, user_info in self.users.items():
-            if "received_files" in user_info and share_id in user_info["received_files"]:
-                user_info["received_files"].remove(share_id)
+        # Удаляем ссылку у владельца и у всех получателей
+        self._remove_share(share_id)
         
         self.save_data()
         logger.info(f"Удален общий доступ к файлу с ID {share_id}")
         
         return True
 
+    @synchronized
     def fix_shared_file_paths(self):
         """
         Исправляет пути к файлам в общих ссылках.
@@ -525,7 +792,7 @@ class UserStorage:
                 # Проверяем, существует ли файл по новому пути
                 if os.path.exists(new_path):
                     # Обновляем путь в записи о шаринге
-                    self.shared_files[share_id]["file_path"] = new_path
+                    self._set_share_path(share_id, new_path)
                     logger.info(f"Исправлен путь к файлу для шаринга {share_id}: {file_path} -> {new_path}")
                     fixed_count += 1
                 else:
@@ -543,24 +810,16 @@ class UserStorage:
                             logger.info(f"Файл скопирован из {old_full_path} в {new_path}")
                             
                             # Обновляем путь в записи о шаринге
-                            self.shared_files[share_id]["file_path"] = new_path
+                            self._set_share_path(share_id, new_path)
                             fixed_count += 1
                         except Exception as e:
                             logger.error(f"Ошибка при копировании файла: {e}")
                             # Удаляем шаринг, если не удалось скопировать файл
-                            self.shared_files.pop(share_id)
-                            # Удаляем из списка пользователя
-                            if owner_id in self.users and "shared_files" in self.users[owner_id]:
-                                if share_id in self.users[owner_id]["shared_files"]:
-                                    self.users[owner_id]["shared_files"].remove(share_id)
+                            self._remove_share(share_id)
                             removed_count += 1
                     else:
                         # Если файл не найден ни в одной папке, удаляем запись о шаринге
-                        self.shared_files.pop(share_id)
-                        # Удаляем из списка пользователя
-                        if owner_id in self.users and "shared_files" in self.users[owner_id]:
-                            if share_id in self.users[owner_id]["shared_files"]:
-                                self.users[owner_id]["shared_files"].remove(share_id)
+                        self._remove_share(share_id)
                         
                         logger.info(f"Удален шаринг {share_id}, так как файл не найден: {file_path}")
                         removed_count += 1
@@ -611,8 +870,61 @@ class UserStorage:
         # Файл не найден
         return None
 
+_shutdown_handlers_installed = False
+
+def install_shutdown_handlers():
+    """Гарантировать сохранение изменений при завершении процесса и по SIGTERM.
+    
+    Обработчик сигнала можно установить только из главного потока,
+    поэтому при вызове из другого потока регистрируется только atexit.
+    """
+    global _shutdown_handlers_installed
+    if _shutdown_handlers_installed:
+        return
+    _shutdown_handlers_installed = True
+    
+    atexit.register(user_storage.close)
+    
+    if threading.current_thread() is not threading.main_thread():
+        logger.debug("Обработчик SIGTERM не установлен: вызов не из главного потока")
+        return
+    
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    shutdown_requested = threading.Event()
+    storage_closed = threading.Event()
+    
+    def handle_sigterm(signum, frame):
+        # Обработчик может прервать главный поток внутри flush, поэтому
+        # данные сохраняет отдельный поток, а здесь только ставится флаг
+        if not storage_closed.is_set():
+            shutdown_requested.set()
+            return
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+        else:
+            # Восстанавливаем стандартное поведение и завершаем процесс
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+    
+    def shutdown_loop():
+        shutdown_requested.wait()
+        logger.info("Получен SIGTERM, сохраняем данные хранилища")
+        try:
+            user_storage.close()
+        finally:
+            storage_closed.set()
+            # Повторный сигнал обрабатывается в главном потоке уже как завершение
+            os.kill(os.getpid(), signal.SIGTERM)
+    
+    shutdown_thread = threading.Thread(target=shutdown_loop, name="user-storage-shutdown")
+    shutdown_thread.daemon = True
+    shutdown_thread.start()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
 # Создание глобального экземпляра хранилища
 user_storage = UserStorage()
+install_shutdown_handlers()
 
-# Запуск очистки истекших ссылок при импорте модуля
-user_storage.cleanup_expired_shares()
\ No newline at end of file
+# Запуск фоновой очистки истекших ссылок
+user_storage.start_expiry_sweeper()
\ No newline at end of file